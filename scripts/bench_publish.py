@@ -0,0 +1,217 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Publishing Throughput Benchmark
+-------------------------------
+Runs the real publishing code paths of scripts/instagram_publisher.py against
+an in-process fake Graph API server (src/fake_graph.py), so no credentials or
+network access are needed.
+
+For each scenario (single image, carousel, video, bulk manifest) it reports
+posts/sec and p50/p99 latency per post. The fake server can add latency,
+transient errors and rate limiting to see how the client behaves under them.
+Results can be saved as a baseline and later runs compared against it.
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src.fake_graph import FakeGraphServer
+
+SCENARIOS = ('single', 'carousel', 'video', 'bulk')
+
+
+def percentile(values, pct):
+    """Nearest-rank percentile of a list of numbers"""
+    ordered = sorted(values)
+    if not ordered:
+        return 0.0
+    index = max(0, min(len(ordered) - 1, int(round(pct / 100 * len(ordered))) - 1))
+    return ordered[index]
+
+
+def summarize(latencies, elapsed, failed):
+    return {
+        'posts': len(latencies),
+        'failed': failed,
+        'posts_per_sec': round(len(latencies) / elapsed, 2) if elapsed else 0.0,
+        'p50_ms': round(percentile(latencies, 50) * 1000, 1),
+        'p99_ms': round(percentile(latencies, 99) * 1000, 1),
+    }
+
+
+def bench_env(server, workdir):
+    """Environment pointing every client at the fake server with a fresh local state"""
+    return {
+        'GRAPH_API_URL': server.url,
+        'APP_ID': 'bench-app',
+        'APP_SECRET': 'bench-secret',
+        'ACCESS_TOKEN': 'bench-token',
+        'PAGE_ID': server.page_ids[0],
+        'TOKEN_FILE': os.path.join(workdir, 'tokens.json'),
+        'ACCOUNT_CACHE_FILE': os.path.join(workdir, 'account_cache.json'),
+        'PUBLISH_LEDGER_FILE': os.path.join(workdir, 'publish_ledger.db'),
+    }
+
+
+def run_concurrent(post, posts, concurrency):
+    """Call post(index) for every post with a thread pool, returning (latencies, elapsed, failed)"""
+    latencies = []
+    failed = 0
+
+    def timed(index):
+        started = time.perf_counter()
+        post(index)
+        return time.perf_counter() - started
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        futures = [executor.submit(timed, index) for index in range(posts)]
+        for future in futures:
+            try:
+                latencies.append(future.result())
+            except Exception:
+                failed += 1
+    return latencies, time.perf_counter() - started, failed
+
+
+def run_scenario(name, publisher, server, args, workdir):
+    run_id = f"{name}-{time.time_ns()}"
+    image = server.media_url('bench.jpg')
+    video = server.media_url('bench.mp4')
+
+    if name == 'single':
+        def post(index):
+            publisher.create_and_publish('IMAGE', image, f"{run_id} {index}", use_batch=args.batch)
+    elif name == 'carousel':
+        def post(index):
+            urls = [server.media_url(f"bench-{i}.jpg") for i in range(args.carousel_size)]
+            publisher.create_and_publish('CAROUSEL', urls, f"{run_id} {index}", use_batch=args.batch)
+    elif name == 'video':
+        def post(index):
+            publisher.create_and_publish('VIDEO', video, f"{run_id} {index}", upload_type='REELS')
+    else:
+        return run_bulk(publisher, server, args, workdir, run_id)
+
+    latencies, elapsed, failed = run_concurrent(post, args.posts, args.concurrency)
+    return summarize(latencies, elapsed, failed)
+
+
+def run_bulk(publisher, server, args, workdir, run_id):
+    from src.bulk_publisher import BulkPublisher, read_manifest
+
+    manifest = os.path.join(workdir, f"{run_id}.jsonl")
+    with open(manifest, 'w') as f:
+        for index in range(args.posts):
+            f.write(json.dumps({'type': 'IMAGE', 'url': server.media_url('bench.jpg'),
+                                'caption': f"{run_id} {index}"}) + '\n')
+    results_path = f"{manifest}.results.jsonl"
+    bulk = BulkPublisher(publisher, workers=args.concurrency, results_path=results_path,
+                         checkpoint_path=f"{manifest}.checkpoint")
+    started = time.perf_counter()
+    summary = bulk.run(read_manifest(manifest))
+    elapsed = time.perf_counter() - started
+
+    with open(results_path) as f:
+        latencies = [result['elapsed'] for result in map(json.loads, f) if result['status'] == 'published']
+    return summarize(latencies, elapsed, summary['failed'])
+
+
+def run_benchmarks(args):
+    server = FakeGraphServer(
+        latency=args.latency / 1000, jitter=args.jitter / 1000, error_rate=args.error_rate,
+        rate_limit=args.rate_limit, video_processing=args.video_processing,
+        quota_total=args.posts * len(SCENARIOS) * 10, seed=args.seed,
+    ).start()
+    try:
+        with tempfile.TemporaryDirectory() as workdir:
+            # 必須在導入發布器模組之前設置，GRAPH_API_URL 在導入時讀取
+            os.environ.update(bench_env(server, workdir))
+            from scripts.instagram_publisher import InstagramPublisher
+            from src.rate_governor import get_default_governor
+
+            if args.max_rate:
+                get_default_governor().max_rate = args.max_rate
+            publisher = InstagramPublisher(max_workers=args.carousel_size, preflight=not args.skip_preflight)
+            publisher.ig_account  # 預先完成令牌和帳戶設置，不計入結果
+
+            results = {}
+            for name in args.scenarios:
+                results[name] = run_scenario(name, publisher, server, args, workdir)
+            return results, server.stats()
+    finally:
+        server.stop()
+
+
+def compare(results, baseline, tolerance):
+    """Return a list of scenarios whose throughput dropped by more than tolerance"""
+    regressions = []
+    for name, result in results.items():
+        base = baseline.get(name)
+        if base and result['posts_per_sec'] < base['posts_per_sec'] * (1 - tolerance):
+            regressions.append(f"{name}: {result['posts_per_sec']:.2f} posts/sec "
+                               f"(baseline {base['posts_per_sec']:.2f})")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark publishing throughput against a fake Graph API')
+    parser.add_argument('--scenarios', nargs='+', choices=SCENARIOS, default=list(SCENARIOS),
+                        help='Scenarios to run (default: all)')
+    parser.add_argument('--posts', type=int, default=50, help='Posts per scenario (default: 50)')
+    parser.add_argument('--concurrency', type=int, default=8, help='Posts in flight at once (default: 8)')
+    parser.add_argument('--carousel-size', type=int, default=3, help='Images per carousel (default: 3)')
+    parser.add_argument('--batch', action='store_true', help='Use Graph batch requests for image/carousel posts')
+    parser.add_argument('--skip-preflight', action='store_true', help='Do not check media URLs')
+    parser.add_argument('--latency', type=float, default=20, help='Fake server latency per request in ms (default: 20)')
+    parser.add_argument('--jitter', type=float, default=10, help='Extra random latency in ms (default: 10)')
+    parser.add_argument('--error-rate', type=float, default=0.0,
+                        help='Fraction of requests failing with a transient error (default: 0)')
+    parser.add_argument('--rate-limit', type=int, help='Requests per minute before the fake server throttles')
+    parser.add_argument('--video-processing', type=float, default=1.0,
+                        help='Seconds a video container stays IN_PROGRESS (default: 1)')
+    parser.add_argument('--max-rate', type=float, help='Client rate governor limit in requests/sec (default: 20)')
+    parser.add_argument('--seed', type=int, default=1, help='Random seed for latency and errors (default: 1)')
+    parser.add_argument('--baseline', help='Baseline JSON file to compare against')
+    parser.add_argument('--save', help='Write results as a baseline JSON file')
+    parser.add_argument('--tolerance', type=float, default=0.2,
+                        help='Allowed throughput drop relative to baseline (default: 0.2 = 20%%)')
+    parser.add_argument('--show-requests', action='store_true', help='Print request counts per endpoint')
+    args = parser.parse_args()
+
+    results, requests = run_benchmarks(args)
+    print(f"{'scenario':10s} {'posts/s':>9s} {'p50 ms':>9s} {'p99 ms':>9s} {'failed':>7s}")
+    for name, result in results.items():
+        print(f"{name:10s} {result['posts_per_sec']:9.2f} {result['p50_ms']:9.1f} "
+              f"{result['p99_ms']:9.1f} {result['failed']:7d}")
+
+    if args.show_requests:
+        print("\n請求次數:")
+        for endpoint, count in sorted(requests.items(), key=lambda item: -item[1]):
+            print(f"  {count:6d}  {endpoint}")
+
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f"基準已保存至: {args.save}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        if regressions:
+            print("吞吐量退化:")
+            for regression in regressions:
+                print(f"  {regression}")
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,153 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+CLI Startup Benchmark
+---------------------
+Measures the startup cost of scripts/instagram_publisher.py without touching
+the network: module import time, and for each subcommand the time until the
+first outgoing request (DNS lookup) or until the process exits.
+
+Each measurement runs in a fresh interpreter. Results can be saved as a
+baseline and later runs compared against it to catch regressions.
+"""
+
+import os
+import sys
+import json
+import argparse
+import statistics
+import subprocess
+import tempfile
+
+SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'instagram_publisher.py')
+
+# 在子進程中執行：攔截第一次 DNS 查詢，記錄時間後立即退出
+HARNESS = r'''
+import os, sys, time, socket, runpy
+t0 = time.perf_counter()
+
+def _first_request(*args, **kwargs):
+    sys.stderr.write("__BENCH__ first_request %f\n" % ((time.perf_counter() - t0) * 1000))
+    sys.stderr.flush()
+    os._exit(0)
+
+socket.getaddrinfo = _first_request
+script, mode = sys.argv[1], sys.argv[2]
+sys.argv = [script] + sys.argv[3:]
+try:
+    runpy.run_path(script, run_name='__main__' if mode == 'run' else '__bench__')
+except SystemExit:
+    pass
+sys.stderr.write("__BENCH__ exit %f\n" % ((time.perf_counter() - t0) * 1000))
+'''
+
+# 要測量的命令：名稱 -> 命令行參數
+COMMANDS = {
+    'help': ['--help'],
+    'tokens': ['tokens'],
+    'view': ['view'],
+    'image': ['image', '--url', 'https://example.com/a.jpg', '--caption', 'bench'],
+    'video': ['video', '--url', 'https://example.com/a.mp4', '--caption', 'bench'],
+    'carousel': ['carousel', '--urls', 'https://example.com/a.jpg', 'https://example.com/b.jpg',
+                 '--caption', 'bench'],
+    'bulk': ['bulk', '--manifest', '{manifest}'],
+}
+
+
+def run_once(mode, args, env):
+    """Run the harness once and return {'first_request': ms, 'exit': ms}"""
+    completed = subprocess.run(
+        [sys.executable, '-c', HARNESS, SCRIPT, mode] + args,
+        env=env, capture_output=True, text=True, timeout=120,
+    )
+    result = {}
+    for line in completed.stderr.splitlines():
+        if line.startswith('__BENCH__ '):
+            _, key, value = line.split()
+            result[key] = float(value)
+    if not result:
+        raise RuntimeError(f"benchmark run failed:\n{completed.stderr[-2000:]}")
+    return result
+
+
+def bench_env(workdir):
+    """Environment with dummy credentials and an empty token store"""
+    env = dict(os.environ)
+    env.update({
+        'APP_ID': 'bench-app',
+        'APP_SECRET': 'bench-secret',
+        'ACCESS_TOKEN': 'bench-token',
+        'PAGE_ID': '1',
+        'TOKEN_FILE': os.path.join(workdir, 'tokens.json'),
+        'ACCOUNT_CACHE_FILE': os.path.join(workdir, 'account_cache.json'),
+    })
+    return env
+
+
+def run_benchmarks(repeat, commands):
+    with tempfile.TemporaryDirectory() as workdir:
+        manifest = os.path.join(workdir, 'manifest.jsonl')
+        with open(manifest, 'w') as f:
+            f.write(json.dumps({'type': 'IMAGE', 'url': 'https://example.com/a.jpg', 'caption': 'bench'}) + '\n')
+        env = bench_env(workdir)
+
+        results = {}
+        samples = [run_once('import', [], env)['exit'] for _ in range(repeat)]
+        results['import'] = {'ms': round(statistics.median(samples), 2)}
+
+        for name in commands:
+            args = [arg.format(manifest=manifest) for arg in COMMANDS[name]]
+            runs = [run_once('run', args, env) for _ in range(repeat)]
+            # 沒有發出請求的命令以退出時間計算
+            key = 'first_request' if all('first_request' in r for r in runs) else 'exit'
+            results[name] = {
+                'ms': round(statistics.median(r[key] for r in runs), 2),
+                'until': key,
+            }
+        return results
+
+
+def compare(results, baseline, tolerance):
+    """Return a list of regressions slower than baseline by more than tolerance"""
+    regressions = []
+    for name, result in results.items():
+        base = baseline.get(name)
+        if base and result['ms'] > base['ms'] * (1 + tolerance):
+            regressions.append(f"{name}: {result['ms']:.1f}ms (baseline {base['ms']:.1f}ms)")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark instagram_publisher.py startup time')
+    parser.add_argument('--repeat', type=int, default=5, help='Runs per measurement, median is reported (default: 5)')
+    parser.add_argument('--commands', nargs='+', choices=list(COMMANDS), default=list(COMMANDS),
+                        help='Subcommands to measure (default: all)')
+    parser.add_argument('--baseline', help='Baseline JSON file to compare against')
+    parser.add_argument('--save', help='Write results as a baseline JSON file')
+    parser.add_argument('--tolerance', type=float, default=0.2,
+                        help='Allowed slowdown relative to baseline (default: 0.2 = 20%%)')
+    args = parser.parse_args()
+
+    results = run_benchmarks(args.repeat, args.commands)
+    for name, result in results.items():
+        until = f" (until {result['until']})" if 'until' in result else ''
+        print(f"{name:10s} {result['ms']:8.1f} ms{until}")
+
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f"基準已保存至: {args.save}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        if regressions:
+            print("啟動時間退化:")
+            for regression in regressions:
+                print(f"  {regression}")
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,40 +1,146 @@
+#!/usr/bin/env python3
+"""
+Business and Ad Account Tools
+-----------------------------
+Without a command, prints the business users and the campaigns of AD_ACCOUNT_ID.
+
+The `insights` command runs asynchronous ads insights reports (AdReportRun)
+for many ad accounts and date ranges in parallel and streams the results to
+a JSONL, CSV or parquet file (see src/ads_insights.py).
+"""
+
 import os
 import sys
-sys.path.append('/opt/homebrew/lib/python2.7/site-packages') # Replace this with the place you installed facebookads using pip
-sys.path.append('/opt/homebrew/lib/python2.7/site-packages/facebook_business-3.0.0-py2.7.egg-info') # same as above
+import time
+import argparse
+import datetime
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def create_api():
+    from dotenv import load_dotenv
+    from facebook_business.api import FacebookAdsApi
+    from src.graph_api import GraphApi
+
+    load_dotenv()
+    load_dotenv('config/.env')
+    api = GraphApi.create(os.getenv('APP_ID'), os.getenv('APP_SECRET'), os.getenv('ACCESS_TOKEN'))
+    FacebookAdsApi.set_default_api(api)
+    return api
+
+
+def show_overview(args):
+    from facebook_business.adobjects.adaccount import AdAccount
+    from facebook_business.adobjects.business import Business
+    from facebook_business.adobjects.campaign import Campaign
+
+    create_api()
+
+    #  ===== Business =======
+    # 懶惰得人的平台
+    myBusiness = Business(os.getenv('BUSINESS_ID'))
+    businessUser = myBusiness.get_business_users()
+    print('---------businessUser---------')
+    for user in businessUser:
+        print(user)
+
+    #  ===== AdAccount =======
+    my_account = AdAccount('act_' + os.getenv('AD_ACCOUNT_ID'))
+    campaigns = my_account.get_campaigns(fields=[Campaign.Field.id, Campaign.Field.name, Campaign.Field.status])
+    print('---------campaigns---------')
+    for campaign in campaigns:
+        print(f"{campaign[Campaign.Field.id]}  {campaign.get(Campaign.Field.status, ''):10s}  "
+              f"{campaign.get(Campaign.Field.name, '')}")
+    return 0
+
+
+def resolve_accounts(args):
+    """返回要查詢的廣告帳戶 ID 列表"""
+    if args.all_accounts:
+        from src.meta_client import MetaBusinessClient
+
+        accounts = MetaBusinessClient().get_ad_accounts(refresh=args.refresh_accounts)
+        # 只查詢啟用中的帳戶（account_status 1）
+        return [account['id'] for account in accounts if account.get('account_status') in (1, None)]
+    if args.accounts:
+        return args.accounts
+    if os.getenv('AD_ACCOUNT_ID'):
+        return [os.getenv('AD_ACCOUNT_ID')]
+    return []
+
+
+def run_insights(args):
+    from src.ads_insights import AdsInsightsPool, DEFAULT_FIELDS
+
+    api = create_api()
+    accounts = resolve_accounts(args)
+    if not accounts:
+        print("❌ 沒有要查詢的廣告帳戶，請使用 --accounts、--all-accounts 或設置 AD_ACCOUNT_ID")
+        return 1
+
+    pool = AdsInsightsPool(
+        api, level=args.level, fields=args.fields or DEFAULT_FIELDS, time_increment=args.time_increment,
+        breakdowns=args.breakdowns, jobs_per_account=args.jobs_per_account, max_jobs=args.max_jobs,
+        download_workers=args.download_workers, debug=args.debug,
+    )
+    print(f"正在為 {len(accounts)} 個廣告帳戶獲取 {args.since} 至 {args.until} 的洞察...")
+    started = time.monotonic()
+    summary = pool.export(accounts, args.since, args.until, args.output,
+                          days_per_job=args.days_per_job, deadline=args.deadline)
+
+    print(f"✅ 已導出 {summary['rows']} 行至: {args.output}（{time.monotonic() - started:.1f} 秒）")
+    print(f"   報告任務: {summary['completed']} 完成, {summary['failed']} 失敗（共 {summary['jobs']} 個）")
+    for job, error in summary['errors'].items():
+        print(f"   ❌ {job}: {error}")
+    return 1 if summary['failed'] else 0
 
-from facebook_business.api import FacebookAdsApi
-from facebook_business.adobjects.adaccount import AdAccount
-from facebook_business.adobjects.business import Business
-from facebook_business.adobjects.page import Page
-from facebook_business.adobjects.adaccount import AdAccount
-from facebook_business.adobjects.adaccountuser import AdAccountUser
 
-my_app_id = os.getenv('APP_ID')
-my_app_secret = os.getenv('APP_SECRET')
-my_access_token = os.getenv('ACCESS_TOKEN')
-FacebookAdsApi.init(my_app_id, my_app_secret, my_access_token)
+def parse_args():
+    yesterday = (datetime.date.today() - datetime.timedelta(days=1)).isoformat()
+    parser = argparse.ArgumentParser(description='Business and ad account tools')
+    subparsers = parser.add_subparsers(dest='command')
 
+    insights = subparsers.add_parser('insights', help='Export ads insights with asynchronous report runs')
+    insights.add_argument('--output', '-o', required=True,
+                          help='Output file (.jsonl, .csv or .parquet directory)')
+    insights.add_argument('--accounts', nargs='+', help='Ad account IDs (default: AD_ACCOUNT_ID env var)')
+    insights.add_argument('--all-accounts', action='store_true',
+                          help='All active ad accounts owned or managed by BUSINESS_ID')
+    insights.add_argument('--refresh-accounts', action='store_true', help='Ignore the cached ad account list')
+    insights.add_argument('--since', default=yesterday, help='First day, YYYY-MM-DD (default: yesterday)')
+    insights.add_argument('--until', default=yesterday, help='Last day, YYYY-MM-DD (default: yesterday)')
+    insights.add_argument('--level', choices=['account', 'campaign', 'adset', 'ad'], default='ad',
+                          help='Report level (default: ad)')
+    insights.add_argument('--fields', help='Comma separated insights fields')
+    insights.add_argument('--breakdowns', nargs='+', help='Breakdowns, e.g. age gender')
+    insights.add_argument('--time-increment', default='1',
+                          help='Days per row, or monthly / all_days (default: 1)')
+    insights.add_argument('--days-per-job', type=int, default=7,
+                          help='Split each account into report runs of this many days (default: 7)')
+    insights.add_argument('--jobs-per-account', type=int, help='Report runs in flight per ad account')
+    insights.add_argument('--max-jobs', type=int, help='Report runs in flight in total')
+    insights.add_argument('--download-workers', type=int, default=4,
+                          help='Finished reports downloaded at once (default: 4)')
+    insights.add_argument('--deadline', type=float,
+                          help='Give up on unfinished report runs after this many seconds')
+    insights.add_argument('--debug', action='store_true', help='Show progress of every report run')
 
+    args = parser.parse_args()
+    if args.command == 'insights':
+        from src.ads_insights import JOBS_PER_ACCOUNT, MAX_JOBS
 
-#  ===== Business =======
-# 懶惰得人的平台
-myBusiness = Business(os.getenv('BUSINESS_ID'))
-businessUser = myBusiness.get_business_users()
-print('---------businessUser---------')
-print(businessUser)
+        args.jobs_per_account = args.jobs_per_account or JOBS_PER_ACCOUNT
+        args.max_jobs = args.max_jobs or MAX_JOBS
+    return args
 
-# adInfo = myBusiness.get_ad_account_infos()
-# print('---------ad info---------')
-# print(adInfo)
 
+def main():
+    args = parse_args()
+    if args.command == 'insights':
+        return run_insights(args)
+    return show_overview(args)
 
-#  ===== AdAccount =======
-my_account = AdAccount('act_' + os.getenv('AD_ACCOUNT_ID'))
-campaigns = my_account.get_campaigns()
-print(campaigns)
 
-# users = my_account.get_users()
-# print('--------get_users----------')
-# for user in users:
-#     print(user[AdAccountUser.Field.id])
+if __name__ == '__main__':
+    sys.exit(main())
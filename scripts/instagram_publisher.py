@@ -10,8 +10,15 @@ including image posts, videos, carousel posts and scheduled posts.
 import os
 import sys
 import time
+
+# --profile 的 imports 階段從這裡開始計算
+_IMPORT_STARTED = (time.perf_counter(), time.process_time())
+
 import datetime
 import argparse
+import threading
+import contextvars
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from typing import Optional, List, Dict, Any
 
 # Path setup for Facebook Business SDK
@@ -20,47 +27,143 @@ sys.path.append('/opt/homebrew/lib/python2.7/site-packages/facebook_business-3.0
 # 添加src目錄到路徑
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
-from facebook_business.api import FacebookAdsApi
-from facebook_business.adobjects.page import Page
-from facebook_business.adobjects.user import User
-from facebook_business.adobjects.iguser import IGUser
-from facebook_business.exceptions import FacebookRequestError
-
 # 引入 TokenManager 和環境變數
+# Facebook Business SDK 和網絡相關模組在第一次使用時才載入，讓 --help 和 tokens 等命令快速啟動
 from src.token_manager import TokenManager
+from src.graph_batch import GraphBatch, result_ref
+from src.account_cache import AccountCache
+from src.errors import carousel_error
+from src.metrics import traced, current_span, get_default_metrics
 from dotenv import load_dotenv
 
 
+@traced('config.load')
+def load_environment():
+    """Load environment variables from .env and config/.env"""
+    load_dotenv()
+    load_dotenv('config/.env')
+
+
 class InstagramPublisher:
     """Instagram content publishing handler"""
     
-    def __init__(self, debug=False):
-        """Initialize the Instagram publisher with authentication"""
+    def __init__(self, debug=False, max_workers: int = 5, background_refresh: bool = False,
+                 page_id: Optional[str] = None, token_manager: Optional[TokenManager] = None,
+                 account_cache: Optional[AccountCache] = None, ledger=None, preflight: bool = True,
+                 quota=None):
+        """Initialize the Instagram publisher with authentication
+        
+        Each publisher is bound to its own FacebookAdsApi instance and page
+        token, so publishers for different pages can be used concurrently
+        in one process.
+        
+        Args:
+            debug: Enable debug output
+            max_workers: Maximum number of concurrent requests for carousel items
+            background_refresh: Validate and renew tokens ahead of expiry in a
+                background thread (for long-running processes)
+            page_id: Facebook Page to publish for (default: PAGE_ID env var)
+            token_manager: Shared TokenManager (default: a new one)
+            account_cache: Shared Page -> Instagram account cache (default: a new one)
+            ledger: PublishLedger recording publish progress (default: the
+                process-wide ledger, opened on first use)
+            preflight: Check media URLs (reachability, type, size) before
+                creating containers
+            quota: PublishQuota tracking the content publishing limit
+                (default: the process-wide tracker)
+        """
         # 載入環境變數
-        load_dotenv()
-        load_dotenv('config/.env')
+        load_environment()
         
         self.app_id = os.getenv('APP_ID')
         self.app_secret = os.getenv('APP_SECRET')
-        self.page_id = os.getenv('PAGE_ID')
+        self.page_id = page_id or os.getenv('PAGE_ID')
         self.debug = debug
+        self.max_workers = max(1, max_workers)
         
         # 初始化 TokenManager
-        self.token_manager = TokenManager(app_id=self.app_id, app_secret=self.app_secret)
+        self.token_manager = token_manager or TokenManager(app_id=self.app_id, app_secret=self.app_secret)
+        if background_refresh:
+            self.token_manager.start_background_refresh()
+        self.account_cache = account_cache or AccountCache()
+        self.page_token = None
         self.ig_account_id = None
-        self.ig_account = None
+        self._api = None
+        self._ig_account = None
+        self._poller = None
+        self._ledger = ledger
+        self._quota = quota
+        self.preflight = preflight
+        self._ready = False
+        self._setup_lock = threading.Lock()
         
-        # 設置 Facebook API
-        self._setup_api()
+        # Facebook API 在第一次需要時才設置（見 _ensure_setup）
     
+    @property
+    def api(self):
+        """FacebookAdsApi instance bound to this page (set up on first use)"""
+        self._ensure_setup()
+        return self._api
+    
+    @property
+    def ig_account(self):
+        """IGUser for the linked Instagram account (set up on first use)"""
+        self._ensure_setup()
+        return self._ig_account
+    
+    @property
+    def ledger(self):
+        """PublishLedger used to make create_and_publish idempotent"""
+        if self._ledger is None:
+            from src.publish_ledger import get_default_ledger
+            
+            self._ledger = get_default_ledger()
+        return self._ledger
+    
+    @property
+    def quota(self):
+        """PublishQuota used to avoid publishing past the 24-hour limit"""
+        if self._quota is None:
+            from src.publish_quota import get_default_quota
+            
+            self._quota = get_default_quota()
+        return self._quota
+    
+    def publishing_quota(self, refresh: bool = False) -> Dict[str, Any]:
+        """Content publishing quota of the account
+        
+        Args:
+            refresh: Query the API even if the cached usage is still fresh
+            
+        Returns:
+            Dict with limit, used, reserved, remaining and next_slot
+            (Unix timestamp when the next post can go out)
+        """
+        if not self.ig_account:
+            raise ValueError("Instagram 帳戶未初始化")
+        return self.quota.status(self, refresh=refresh)
+    
+    def _ensure_setup(self):
+        """Resolve tokens and the Instagram account the first time they are needed"""
+        if not self._ready:
+            with self._setup_lock:
+                if not self._ready:
+                    self._setup_api()
+                    self._ready = True
+    
+    @traced('setup')
     def _setup_api(self):
         """Set up Facebook API and get necessary tokens and IDs"""
+        with get_default_metrics().span('imports.sdk'):
+            from src.graph_api import GraphApi
+        
         if self.debug:
             print("初始化 API...")
         
-        # 獲取頁面token並初始化API
-        page_token = self.token_manager.get_valid_page_token(self.page_id)
-        FacebookAdsApi.init(self.app_id, self.app_secret, page_token)
+        # 獲取頁面token並建立此頁面專用的 API 實例（不使用全局默認 API）
+        self.page_token = self.token_manager.get_valid_page_token(self.page_id)
+        self._api = GraphApi.create(self.app_id, self.app_secret, self.page_token,
+                                    governor=self.token_manager.governor)
         
         if self.debug:
             self.token_manager.print_token_info()
@@ -68,37 +171,80 @@ class InstagramPublisher:
         # 獲取 Instagram 帳戶
         self._get_instagram_account()
     
+    @traced('account.lookup')
     def _get_instagram_account(self):
-        """Get Instagram business account ID from the Facebook Page"""
+        """Get Instagram business account ID from the Facebook Page
+        
+        Looked up, in order, from the on-disk account cache, the page-token
+        sweep stored by TokenManager, and finally the Graph API (whose result
+        is cached for the next run).
+        """
+        from facebook_business.adobjects.page import Page
+        from facebook_business.adobjects.iguser import IGUser
+        
         if self.debug:
             print("獲取與頁面關聯的 Instagram 帳戶...")
         
         try:
-            page = Page(self.page_id)
-            page_data = page.api_get(fields=['instagram_business_account'])
-            
-            if 'instagram_business_account' in page_data:
-                self.ig_account_id = page_data['instagram_business_account']['id']
-                self.ig_account = IGUser(self.ig_account_id)
-                if self.debug:
-                    print(f"找到關聯的 Instagram 帳戶 ID: {self.ig_account_id}")
+            cached = self.account_cache.get(self.page_id)
+            if not cached:
+                page_info = self.token_manager.get_page_info(self.page_id) or {}
+                if page_info.get('instagram_business_account_id'):
+                    cached = self.account_cache.set(self.page_id, {
+                        'instagram_business_account_id': page_info['instagram_business_account_id'],
+                        'username': page_info.get('instagram_username'),
+                    })
+            
+            if cached:
+                self.ig_account_id = cached['instagram_business_account_id']
+            else:
+                page = Page(self.page_id, api=self._api)
+                page_data = page.api_get(
+                    fields=['instagram_business_account{id,username,biography,followers_count}']
+                )
+                if 'instagram_business_account' not in page_data:
+                    raise ValueError("此頁面沒有關聯的 Instagram 商業帳戶")
+                
+                account = page_data['instagram_business_account']
+                self.ig_account_id = account['id']
+                cached = self.account_cache.set(self.page_id, {
+                    'instagram_business_account_id': account['id'],
+                    'username': account.get('username'),
+                    'biography': account.get('biography'),
+                    'followers_count': account.get('followers_count'),
+                })
+            
+            self._ig_account = IGUser(self.ig_account_id, api=self._api)
+            if self.debug:
+                print(f"找到關聯的 Instagram 帳戶 ID: {self.ig_account_id}")
                 
                 # 獲取基本信息
-                if self.debug:
-                    self._print_account_info()
-            else:
-                raise ValueError("此頁面沒有關聯的 Instagram 商業帳戶")
+                self._print_account_info()
                 
         except Exception as e:
             raise Exception(f"獲取 Instagram 帳戶時出錯: {e}")
     
+    def refresh_account(self):
+        """Drop the cached Instagram account for this page and look it up again"""
+        self.account_cache.invalidate(self.page_id)
+        if self._ready:
+            self._get_instagram_account()
+    
     def _print_account_info(self):
         """Print Instagram account information (for debug)"""
-        account_info = self.ig_account.api_get(
-            fields=['id', 'username', 'biography', 'followers_count']
-        )
+        account_info = self.account_cache.get(self.page_id) or {}
+        if 'followers_count' not in account_info:
+            account_info = self._ig_account.api_get(
+                fields=['id', 'username', 'biography', 'followers_count']
+            )
+            self.account_cache.set(self.page_id, {
+                'instagram_business_account_id': account_info.get('id'),
+                'username': account_info.get('username'),
+                'biography': account_info.get('biography'),
+                'followers_count': account_info.get('followers_count'),
+            })
         print("---------Instagram 帳戶信息---------")
-        print(f"ID: {account_info.get('id')}")
+        print(f"ID: {account_info.get('id') or account_info.get('instagram_business_account_id')}")
         print(f"用戶名: {account_info.get('username')}")
         print(f"簡介: {account_info.get('biography')}")
         print(f"粉絲數: {account_info.get('followers_count')}")
@@ -122,6 +268,59 @@ class InstagramPublisher:
         
         return media
     
+    def iter_media(self, fields: Optional[str] = None, page_size: int = 100, after: Optional[str] = None):
+        """Iterate over the account's full media history, newest first
+        
+        The next page is requested in the background while the current one
+        is being consumed, and only two pages are held in memory.
+        
+        Args:
+            fields: Comma-separated media fields (default: media_export.DEFAULT_FIELDS)
+            page_size: Number of media per request
+            after: Resume after this paging cursor
+            
+        Returns:
+            Generator of media dictionaries
+        """
+        from src.media_export import iter_media, DEFAULT_FIELDS
+        
+        if not self.ig_account:
+            raise ValueError("Instagram 帳戶未初始化")
+        
+        return iter_media(self.api, self.ig_account_id, fields=fields or DEFAULT_FIELDS,
+                          page_size=page_size, after=after)
+    
+    def export_media(self, output: str, format: Optional[str] = None, fields: Optional[str] = None,
+                     page_size: int = 100, checkpoint_path: Optional[str] = None,
+                     restart: bool = False) -> Dict[str, Any]:
+        """Export the account's full media history to JSONL, CSV or parquet
+        
+        Progress is checkpointed after every page; running the same export
+        again resumes from the last written page.
+        
+        Args:
+            output: Output file (a directory of part files for parquet)
+            format: jsonl, csv or parquet (default: from the file extension)
+            fields: Comma-separated media fields (default: media_export.DEFAULT_FIELDS)
+            page_size: Number of media per request
+            checkpoint_path: Checkpoint file (default: <output>.checkpoint)
+            restart: Ignore the checkpoint and export from the beginning
+            
+        Returns:
+            Summary with exported, total and complete
+        """
+        from src.media_export import MediaExporter, DEFAULT_FIELDS
+        
+        if not self.ig_account:
+            raise ValueError("Instagram 帳戶未初始化")
+        
+        def progress(total):
+            if self.debug:
+                print(f"已導出 {total} 個媒體...")
+        
+        exporter = MediaExporter(self.api, self.ig_account_id, fields or DEFAULT_FIELDS, page_size)
+        return exporter.export(output, format, checkpoint_path, restart, progress)
+    
     def print_recent_posts(self, limit: int = 5):
         """Print recent Instagram posts (for debugging)"""
         media = self.get_recent_posts(limit)
@@ -140,6 +339,27 @@ class InstagramPublisher:
             print(f"讚數: {item.get('like_count', 0)}")
             print("-" * 40)
     
+    @traced('media.preflight')
+    def validate_media(self, urls, media_type: str = 'IMAGE'):
+        """Check media URLs before any container is created
+        
+        URLs are checked concurrently with HEAD/ranged GET requests against
+        Instagram's type and size limits; results are cached per URL.
+        
+        Args:
+            urls: A URL or list of URLs
+            media_type: IMAGE, VIDEO, REELS or STORIES
+            
+        Raises:
+            MediaValidationError: If any URL fails the check
+        """
+        if not self.preflight:
+            return
+        from src.media_preflight import get_default_preflight
+        
+        get_default_preflight().validate(urls, media_type)
+    
+    @traced('container.create.image')
     def post_image(self, image_url: str, caption: str, is_carousel_item: bool = False) -> Dict[str, Any]:
         """Create a container for an image post
         
@@ -151,6 +371,8 @@ class InstagramPublisher:
         Returns:
             Response containing creation_id
         """
+        from facebook_business.exceptions import FacebookRequestError
+        
         if not self.ig_account:
             raise ValueError("Instagram 帳戶未初始化")
         
@@ -161,6 +383,9 @@ class InstagramPublisher:
         
         if is_carousel_item:
             params['is_carousel_item'] = True
+        else:
+            # 輪播項目已在 _create_carousel_items 中一併檢查
+            self.validate_media(image_url, 'IMAGE')
         
         try:
             response = self.ig_account.create_media(params=params)
@@ -170,6 +395,7 @@ class InstagramPublisher:
         except FacebookRequestError as e:
             raise Exception(f"創建媒體容器時出錯: {e}")
     
+    @traced('container.create.video')
     def post_video(self, video_url: str, caption: str, cover_url: Optional[str] = None, 
                   upload_type: str = 'FEED') -> Dict[str, Any]:
         """Create a container for a video post
@@ -183,6 +409,8 @@ class InstagramPublisher:
         Returns:
             Response containing creation_id
         """
+        from facebook_business.exceptions import FacebookRequestError
+        
         if not self.ig_account:
             raise ValueError("Instagram 帳戶未初始化")
         
@@ -199,6 +427,10 @@ class InstagramPublisher:
         if cover_url:
             params['cover_url'] = cover_url
         
+        self.validate_media(video_url, upload_type if upload_type in ('REELS', 'STORIES') else 'VIDEO')
+        if cover_url:
+            self.validate_media(cover_url, 'IMAGE')
+        
         if self.debug:
             print(f"準備上傳影片，參數: {params}")
             
@@ -213,29 +445,37 @@ class InstagramPublisher:
                 raise Exception(f"Google Drive 連結無法直接使用。請提供直接可下載的影片URL。Google Drive 需要額外的身份驗證，API 無法直接訪問。")
             raise Exception(f"創建影片媒體容器時出錯: {e}")
     
-    def post_carousel(self, image_urls: List[str], caption: str) -> Dict[str, Any]:
+    @traced('container.create.carousel')
+    def post_carousel(self, image_urls: List[str], caption: str, use_batch: bool = False) -> Dict[str, Any]:
         """Create a container for a carousel post with multiple images
         
         Args:
             image_urls: List of image URLs
             caption: Caption text for the post
+            use_batch: Create the children and the carousel container in a
+                single Graph batch request
             
         Returns:
             Response containing creation_id
         """
+        from facebook_business.exceptions import FacebookRequestError
+        
         if not self.ig_account:
             raise ValueError("Instagram 帳戶未初始化")
         
+        if use_batch:
+            batch = self.new_batch()
+            name = self.add_to_batch(batch, 'CAROUSEL', image_urls, caption)
+            batch.execute()
+            response = batch.result(name)
+            if not response.ok:
+                raise Exception(f"創建輪播媒體容器時出錯: {batch.first_error()}")
+            if self.debug:
+                print(f"輪播媒體容器已創建，creation_id: {response['id']}")
+            return response.body
+        
         # First, create individual carousel items
-        children_ids = []
-        for url in image_urls:
-            try:
-                response = self.post_image(url, "", is_carousel_item=True)
-                children_ids.append(response['id'])
-                if self.debug:
-                    print(f"輪播項目已創建: {response['id']}")
-            except Exception as e:
-                raise Exception(f"創建輪播項目時出錯: {e}")
+        children_ids = self._create_carousel_items(image_urls)
         
         # Then create the carousel container
         params = {
@@ -252,26 +492,83 @@ class InstagramPublisher:
         except FacebookRequestError as e:
             raise Exception(f"創建輪播媒體容器時出錯: {e}")
     
+    def _create_carousel_items(self, image_urls: List[str]) -> List[str]:
+        """Create carousel child containers concurrently
+        
+        Children are created with a pool of at most ``max_workers`` threads.
+        If any child fails, items not yet started are cancelled and a
+        CarouselItemError reports the children that were already created
+        (unpublished containers expire on their own after 24 hours).
+        
+        Args:
+            image_urls: List of image URLs
+            
+        Returns:
+            List of child creation IDs, in the same order as image_urls
+        """
+        # 在創建任何項目之前並行檢查所有 URL
+        self.validate_media(image_urls, 'IMAGE')
+        
+        children_ids: List[Optional[str]] = [None] * len(image_urls)
+        failed: Dict[int, Exception] = {}
+        workers = min(self.max_workers, len(image_urls)) or 1
+        
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = {
+                # 在各自的上下文副本中執行，讓項目的 span 歸入目前的發布操作
+                executor.submit(contextvars.copy_context().run, self.post_image, url, "", True): index
+                for index, url in enumerate(image_urls)
+            }
+            for future in as_completed(futures):
+                index = futures[future]
+                if future.cancelled():
+                    continue
+                try:
+                    children_ids[index] = future.result()['id']
+                    if self.debug:
+                        print(f"輪播項目已創建: {children_ids[index]}")
+                except Exception as e:
+                    failed[index] = e
+                    # 取消尚未開始的項目
+                    for pending in futures:
+                        pending.cancel()
+        
+        if failed:
+            raise carousel_error(children_ids, failed)
+        
+        return children_ids
+    
     def schedule_post(self, media_type: str, content_url: str, caption: str, 
-                     scheduled_time: Optional[int] = None, **kwargs) -> Dict[str, Any]:
+                     scheduled_time: Optional[int] = None, idempotency_key: Optional[str] = None,
+                     **kwargs) -> Dict[str, Any]:
         """Schedule a post for future publishing
         
+        Scheduled posts count against the publishing quota of the 24 hours
+        before their publishing time; scheduling past it raises
+        QuotaExceededError without creating a container.
+        
         Args:
             media_type: Type of media ('IMAGE', 'VIDEO', 'CAROUSEL')
             content_url: URL of the media or list of URLs for carousel
             caption: Caption text for the post
             scheduled_time: Unix timestamp for scheduled publishing time
+            idempotency_key: Ledger key to record the scheduled post under
+                (default: hash of the account, URLs, caption and time)
             **kwargs: Additional parameters specific to the media type
             
         Returns:
             Response containing creation_id
         """
+        from facebook_business.exceptions import FacebookRequestError
+        from src.publish_ledger import SCHEDULED
+        
         if not self.ig_account:
             raise ValueError("Instagram 帳戶未初始化")
         
         # If no scheduled time is provided, default to 24 hours from now
         if not scheduled_time:
             scheduled_time = int(time.time()) + 86400  # 24 hours
+        self.quota.check_scheduled(self, scheduled_time)
         
         # Prepare base parameters for scheduling
         base_params = {
@@ -282,6 +579,7 @@ class InstagramPublisher:
         
         try:
             if media_type == 'IMAGE':
+                self.validate_media(content_url, 'IMAGE')
                 params = {**base_params, 'image_url': content_url}
                 response = self.ig_account.create_media(params=params)
             elif media_type == 'VIDEO':
@@ -298,7 +596,9 @@ class InstagramPublisher:
                     params['cover_url'] = kwargs['cover_url']
                 if 'upload_type' in kwargs:
                     params['upload_type'] = kwargs['upload_type']
-                    
+                
+                upload_type = kwargs.get('upload_type')
+                self.validate_media(content_url, upload_type if upload_type in ('REELS', 'STORIES') else 'VIDEO')
                 response = self.ig_account.create_media(params=params)
             elif media_type == 'CAROUSEL':
                 # For carousel, content_url should be a list of URLs
@@ -306,12 +606,7 @@ class InstagramPublisher:
                     raise ValueError("輪播貼文需要提供URL列表")
                     
                 # Create carousel items
-                children_ids = []
-                for url in content_url:
-                    item_response = self.ig_account.create_media(
-                        params={'image_url': url, 'is_carousel_item': True}
-                    )
-                    children_ids.append(item_response['id'])
+                children_ids = self._create_carousel_items(content_url)
                 
                 # Create carousel container with scheduling
                 carousel_params = {
@@ -326,73 +621,542 @@ class InstagramPublisher:
             if self.debug:
                 print(f"排程貼文媒體容器已創建，creation_id: {response.get('id')}")
                 print(f"排程發布時間: {datetime.datetime.fromtimestamp(scheduled_time).strftime('%Y-%m-%d %H:%M:%S')}")
-                
+            
+            key = idempotency_key or self.publish_key(content_url, caption, scheduled_time)
+            self.ledger.record(key, SCHEDULED, ig_account_id=self.ig_account_id, media_type=media_type,
+                               container_id=response.get('id'), scheduled_time=scheduled_time)
             return response
             
         except FacebookRequestError as e:
             raise Exception(f"排程貼文時出錯: {e}")
     
-    def publish_media(self, creation_id: str) -> Dict[str, Any]:
+    def get_container_status(self, creation_id: str) -> str:
+        """Get the processing status of a media container
+        
+        Args:
+            creation_id: The creation ID returned from a create_media call
+            
+        Returns:
+            Status code (IN_PROGRESS, FINISHED, PUBLISHED, ERROR, EXPIRED)
+        """
+        from facebook_business.exceptions import FacebookRequestError
+        
+        try:
+            response = self.api.call(
+                'GET', (creation_id,), params={'fields': 'status_code'}
+            )
+            return response.json().get('status_code')
+        except FacebookRequestError as e:
+            raise Exception(f"獲取媒體容器狀態時出錯: {e}")
+    
+    @property
+    def poller(self):
+        """Shared poller tracking the status of pending media containers"""
+        if self._poller is None:
+            from src.container_poller import ContainerPoller
+            
+            self._poller = ContainerPoller(self.api)
+        return self._poller
+    
+    def watch_container(self, creation_id: str, upload_type: str = 'FEED',
+                        timeout: int = 600, callback=None):
+        """Track a media container until it finishes processing
+        
+        Status lookups for all watched containers are batched by a single
+        background poller, with backoff tuned to the upload type.
+        
+        Args:
+            creation_id: The creation ID returned from a create_media call
+            upload_type: IMAGE, CAROUSEL, FEED, VIDEO, REELS or STORIES
+            timeout: Maximum number of seconds to wait
+            callback: Called with the future once the container resolves
+            
+        Returns:
+            Future resolving to FINISHED/PUBLISHED, or raising ContainerError
+        """
+        return self.poller.watch(creation_id, upload_type, timeout, callback)
+    
+    @traced('container.wait')
+    def wait_until_ready(self, creation_id: str, upload_type: str = 'FEED', timeout: int = 600) -> str:
+        """Wait until a media container has finished processing
+        
+        Args:
+            creation_id: The creation ID returned from a create_media call
+            upload_type: IMAGE, CAROUSEL, FEED, VIDEO, REELS or STORIES
+            timeout: Maximum number of seconds to wait
+            
+        Returns:
+            Final status code (FINISHED or PUBLISHED)
+        """
+        if self.debug:
+            print(f"等待媒體容器 {creation_id} 處理完成...")
+        status = self.watch_container(creation_id, upload_type, timeout).result()
+        if self.debug:
+            print(f"媒體容器 {creation_id} 狀態: {status}")
+        return status
+    
+    def new_batch(self) -> GraphBatch:
+        """Create a Graph batch bound to this publisher's page token"""
+        # 經由 GraphApi 建立，與單一請求共用速率控制器和重試/熔斷設定
+        return self.api.new_batch()
+    
+    def add_to_batch(self, batch: GraphBatch, media_type: str, content, caption: str, **kwargs) -> str:
+        """Queue the creation of a media container on a Graph batch
+        
+        Carousel children are queued as separate operations and referenced
+        from the carousel container by JSONPath, so the whole carousel is
+        created by a single batch request.
+        
+        Args:
+            batch: Batch to add the operations to
+            media_type: Type of media ('IMAGE', 'VIDEO', 'CAROUSEL')
+            content: URL of the media or list of URLs for carousel
+            caption: Caption text for the post
+            **kwargs: Additional parameters (cover_url, upload_type,
+                scheduled_time for scheduled posts)
+            
+        Returns:
+            Name of the container operation in the batch
+        """
+        if not self.ig_account:
+            raise ValueError("Instagram 帳戶未初始化")
+        
+        path = f"{self.ig_account_id}/media"
+        base_params = {'caption': caption}
+        if kwargs.get('scheduled_time'):
+            base_params['publish_type'] = 'SCHEDULED'
+            base_params['scheduled_publish_time'] = kwargs['scheduled_time']
+        
+        if media_type == 'IMAGE':
+            self.validate_media(content, 'IMAGE')
+            return batch.add('POST', path, {**base_params, 'image_url': content})
+        elif media_type == 'VIDEO':
+            upload_type = kwargs.get('upload_type') or 'FEED'
+            self.validate_media(content, upload_type if upload_type in ('REELS', 'STORIES') else 'VIDEO')
+            params = {**base_params, 'video_url': content, 'upload_type': upload_type}
+            if upload_type != 'REELS':
+                params['media_type'] = 'VIDEO'
+            if kwargs.get('cover_url'):
+                params['cover_url'] = kwargs['cover_url']
+            return batch.add('POST', path, params)
+        elif media_type == 'CAROUSEL':
+            if not isinstance(content, list):
+                raise ValueError("輪播貼文需要提供URL列表")
+            self.validate_media(content, 'IMAGE')
+            children = [
+                batch.add('POST', path, {'image_url': url, 'is_carousel_item': True})
+                for url in content
+            ]
+            params = {
+                **base_params,
+                'children': [result_ref(child) for child in children],
+                'media_type': 'CAROUSEL'
+            }
+            return batch.add('POST', path, params)
+        else:
+            raise ValueError(f"不支持的媒體類型: {media_type}")
+    
+    def add_publish_to_batch(self, batch: GraphBatch, container: str) -> str:
+        """Queue publishing of a container created earlier in the same batch
+        
+        Args:
+            batch: Batch to add the operation to
+            container: Name of the container operation returned by add_to_batch
+            
+        Returns:
+            Name of the publish operation in the batch
+        """
+        return batch.add('POST', f"{self.ig_account_id}/media_publish",
+                         {'creation_id': result_ref(container)})
+    
+    @traced('media.publish')
+    def publish_media(self, creation_id: str, idempotency_key: Optional[str] = None,
+                      reservation=None) -> Dict[str, Any]:
         """Publish a media container using its creation ID
         
+        Raises QuotaExceededError without calling the API when the account
+        has no publishing quota left.
+        
         Args:
             creation_id: The creation ID returned from a create_media call
+            idempotency_key: Ledger key to record the publish under (optional)
+            reservation: Quota reservation taken earlier with quota.reserve()
+                (default: reserve one now)
             
         Returns:
             Response containing published media ID
         """
+        from facebook_business.exceptions import FacebookRequestError
+        from src.publish_ledger import PUBLISHING, PUBLISHED, FAILED
+        from src.publish_quota import is_quota_error
+        
         if not self.ig_account:
             raise ValueError("Instagram 帳戶未初始化")
         
+        reservation = reservation or self.quota.reserve(self)
+        if idempotency_key:
+            self.ledger.record(idempotency_key, PUBLISHING, container_id=creation_id)
         try:
             response = self.ig_account.create_media_publish(
                 params={'creation_id': creation_id}
             )
-            if self.debug:
-                print(f"媒體已發布，ID: {response.get('id')}")
-            return response
         except FacebookRequestError as e:
+            reservation.release()
+            if is_quota_error(e):
+                self.quota.exhausted(self)
+            if idempotency_key:
+                self.ledger.record(idempotency_key, FAILED, error=str(e.api_error_message() or e))
             raise Exception(f"發布媒體時出錯: {e}")
+        except BaseException:
+            reservation.release()
+            raise
+        
+        reservation.commit()
+        if idempotency_key:
+            self.ledger.record(idempotency_key, PUBLISHED, media_id=response.get('id'))
+        if self.debug:
+            print(f"媒體已發布，ID: {response.get('id')}")
+        return response
     
-    def create_and_publish(self, media_type: str, content: str, caption: str, **kwargs) -> Dict[str, Any]:
+    def publish_key(self, content, caption: str, scheduled_time: Optional[int] = None) -> str:
+        """Idempotency key for posting this content to this account
+        
+        Args:
+            content: URL of the media or list of URLs for carousel
+            caption: Caption text for the post
+            scheduled_time: Scheduled publishing time, if any
+        """
+        from src.publish_ledger import idempotency_key
+        
+        if not self.ig_account:
+            raise ValueError("Instagram 帳戶未初始化")
+        return idempotency_key(self.ig_account_id, content, caption, scheduled_time)
+    
+    def find_published_media(self, caption: str, since: int = 0) -> Optional[str]:
+        """Find the media ID of a post published from this account
+        
+        Media containers do not link to the media they were published as,
+        so recent media are matched by caption and publishing time.
+        
+        Args:
+            caption: Caption of the post
+            since: Unix time the post's container was created
+            
+        Returns:
+            The media ID when exactly one recent post matches, otherwise None
+        """
+        from src.media_export import iter_media_pages
+        from src.insights_sync import parse_timestamp
+        
+        matches = []
+        # 容許本機與 API 之間幾分鐘的時鐘誤差
+        cutoff = since - 300
+        pages = iter_media_pages(self.api, self.ig_account_id, 'id,caption,timestamp', page_size=50,
+                                 prefetch=False)
+        try:
+            for items, _ in pages:
+                for item in items:
+                    if item.get('timestamp') and parse_timestamp(item['timestamp']) < cutoff:
+                        return matches[0] if len(matches) == 1 else None
+                    if (item.get('caption') or '') == (caption or ''):
+                        matches.append(item['id'])
+        finally:
+            pages.close()
+        return matches[0] if len(matches) == 1 else None
+    
+    def published_media(self, key: str, caption: str, container_id: Optional[str] = None) -> Dict[str, Any]:
+        """Record content found to be published already and return its media ID
+        
+        Args:
+            key: Idempotency key of the post
+            caption: Caption of the post, used to find the media ID when the
+                ledger does not have it
+            container_id: Container that was published (default: the one in the ledger)
+            
+        Returns:
+            {'id': media ID}
+            
+        Raises:
+            AlreadyPublishedError: the post is published but its media ID cannot be found
+        """
+        from src.publish_ledger import PUBLISHED, AlreadyPublishedError
+        
+        entry = self.ledger.get(key) or {}
+        container_id = container_id or entry.get('container_id')
+        media_id = entry.get('media_id') if entry.get('state') == PUBLISHED else None
+        if not media_id:
+            media_id = self.find_published_media(caption, entry.get('container_created_at') or 0)
+        if media_id:
+            self.ledger.record(key, PUBLISHED, media_id=media_id)
+            return {'id': media_id}
+        self.ledger.record(key, PUBLISHED)
+        raise AlreadyPublishedError(key, container_id)
+    
+    def _resume_from_ledger(self, key: str, caption: str):
+        """Look up earlier attempts for an idempotency key
+        
+        Returns:
+            (publish response, reusable container ID); the response is set
+            when the content was already published
+            
+        Raises:
+            AlreadyPublishedError: the content was published but its media ID is unknown
+        """
+        from src.publish_ledger import PUBLISHED, PUBLISHING
+        
+        entry = self.ledger.get(key)
+        if not entry:
+            return None, None
+        if entry['state'] == PUBLISHED:
+            response = self.published_media(key, caption)
+            if self.debug:
+                print(f"此內容已發布過（媒體 ID: {response['id']}），不會重複發布")
+            return response, None
+        
+        container_id = self.ledger.reusable_container(entry)
+        if container_id and entry['state'] == PUBLISHING:
+            # 上一次發布請求的結果未知，先確認容器是否已經發布
+            if self.get_container_status(container_id) == 'PUBLISHED':
+                print(f"媒體容器 {container_id} 已在先前的嘗試中發布，不會重複發布")
+                return self.published_media(key, caption, container_id), None
+        if container_id and self.debug:
+            print(f"重用先前創建的媒體容器: {container_id}")
+        return None, container_id
+    
+    @traced('publish')
+    def create_and_publish(self, media_type: str, content: str, caption: str,
+                           use_batch: bool = False, idempotency_key: Optional[str] = None,
+                           **kwargs) -> Dict[str, Any]:
         """Create and immediately publish content in one step
         
+        Progress is recorded in the publish ledger under an idempotency key,
+        so calling this again for the same content returns the earlier
+        result instead of posting twice, and resumes from an unexpired
+        container if only the publish step failed. Only one attempt at a
+        time can hold the ledger claim for a key; a concurrent attempt
+        raises PublishInProgressError. A publishing quota slot
+        is reserved before any container is created, so a post that would
+        be rejected raises QuotaExceededError without wasting API calls.
+        
         Args:
             media_type: Type of media ('IMAGE', 'VIDEO', 'CAROUSEL')
             content: URL of the media or list of URLs for carousel
             caption: Caption text for the post
+            use_batch: Create and publish IMAGE/CAROUSEL posts in a single
+                Graph batch request (videos must finish processing first)
+            idempotency_key: Ledger key (default: hash of the account, URLs and caption)
             **kwargs: Additional parameters for specific media types
             
         Returns:
             Response from publish operation
+            
+        Raises:
+            PublishInProgressError: another attempt is publishing the same content
+            AlreadyPublishedError: the content was published before but its media ID is unknown
         """
+        from src.publish_ledger import PUBLISHED, PublishInProgressError
+        
+        key = idempotency_key or self.publish_key(content, caption)
+        current_span().set(media_type=media_type, ig_account_id=self.ig_account_id)
+        # 只有認領到發布權的嘗試才能創建和發布，其他同時進行的嘗試直接停止
+        claim = self.ledger.claim(key)
+        if claim is None:
+            entry = self.ledger.get(key)
+            if not entry or entry['state'] != PUBLISHED:
+                raise PublishInProgressError(key)
+        try:
+            return self._create_and_publish(media_type, content, caption, key, use_batch, **kwargs)
+        finally:
+            if claim:
+                self.ledger.release(key, claim)
+    
+    def _create_and_publish(self, media_type: str, content, caption: str, key: str, use_batch: bool,
+                            **kwargs) -> Dict[str, Any]:
+        from src.publish_ledger import CREATING, CREATED, FAILED
+        from src.container_poller import ContainerError
+        
         creation_response = None
+        published, creation_id = self._resume_from_ledger(key, caption)
+        if published:
+            return published
+        
+        reservation = self.quota.reserve(self)
+        if use_batch and media_type in ('IMAGE', 'CAROUSEL') and not creation_id:
+            with reservation:
+                return self._create_and_publish_batch(media_type, content, caption, key, reservation)
         
         try:
-            # Create the appropriate media container
-            if media_type == 'IMAGE':
-                creation_response = self.post_image(content, caption)
-            elif media_type == 'VIDEO':
-                cover_url = kwargs.get('cover_url')
-                upload_type = kwargs.get('upload_type', 'FEED')
-                creation_response = self.post_video(content, caption, cover_url, upload_type)
-            elif media_type == 'CAROUSEL':
-                # For carousel, content should be a list
-                if not isinstance(content, list):
-                    raise ValueError("輪播貼文需要提供URL列表")
-                creation_response = self.post_carousel(content, caption)
+            # Create the appropriate media container, unless an earlier attempt left one
+            if creation_id:
+                creation_response = {'id': creation_id}
             else:
-                raise ValueError(f"不支持的媒體類型: {media_type}")
+                self.ledger.record(key, CREATING, ig_account_id=self.ig_account_id, media_type=media_type)
+                if media_type == 'IMAGE':
+                    creation_response = self.post_image(content, caption)
+                elif media_type == 'VIDEO':
+                    cover_url = kwargs.get('cover_url')
+                    upload_type = kwargs.get('upload_type', 'FEED')
+                    creation_response = self.post_video(content, caption, cover_url, upload_type)
+                elif media_type == 'CAROUSEL':
+                    # For carousel, content should be a list
+                    if not isinstance(content, list):
+                        raise ValueError("輪播貼文需要提供URL列表")
+                    creation_response = self.post_carousel(content, caption)
+                else:
+                    raise ValueError(f"不支持的媒體類型: {media_type}")
+                creation_id = creation_response['id']
+                self.ledger.record(key, CREATED, container_id=creation_id)
+            
+            # Videos are processed asynchronously; publish only once ready
+            if media_type == 'VIDEO':
+                try:
+                    self.wait_until_ready(creation_id, kwargs.get('upload_type') or 'FEED')
+                except ContainerError as e:
+                    if e.status in ('ERROR', 'EXPIRED'):
+                        # 處理失敗或過期的容器不能再使用
+                        self.ledger.record(key, FAILED, container_id=None, error=str(e))
+                    raise
             
             # Publish the media
-            creation_id = creation_response['id']
-            publish_response = self.publish_media(creation_id)
+            publish_response = self.publish_media(creation_id, idempotency_key=key, reservation=reservation)
             return publish_response
             
         except Exception as e:
+            reservation.release()
             if creation_response and 'id' in creation_response:
                 print(f"創建了媒體容器 {creation_response['id']}，但發布失敗: {e}")
+            else:
+                self.ledger.record(key, FAILED, error=str(e))
+            raise Exception(f"創建並發布媒體時出錯: {e}")
+    
+    @traced('publish.batch')
+    def _create_and_publish_batch(self, media_type: str, content, caption: str, key: str,
+                                  reservation) -> Dict[str, Any]:
+        """Create and publish an IMAGE or CAROUSEL post with one batch request"""
+        from src.publish_ledger import CREATING, CREATED, PUBLISHED, FAILED
+        from src.publish_quota import is_quota_error
+        
+        batch = self.new_batch()
+        container = self.add_to_batch(batch, media_type, content, caption)
+        publish = self.add_publish_to_batch(batch, container)
+        self.ledger.record(key, CREATING, ig_account_id=self.ig_account_id, media_type=media_type)
+        try:
+            batch.execute()
+        except Exception as e:
+            self.ledger.record(key, FAILED, error=str(e))
             raise Exception(f"創建並發布媒體時出錯: {e}")
+        
+        creation_response = batch.result(container)
+        publish_response = batch.result(publish)
+        if creation_response.ok:
+            self.ledger.record(key, CREATED, container_id=creation_response['id'])
+        if publish_response.ok:
+            reservation.commit()
+            self.ledger.record(key, PUBLISHED, media_id=publish_response['id'])
+            if self.debug:
+                print(f"媒體已發布，ID: {publish_response['id']}")
+            return publish_response.body
+        
+        error = batch.first_error()
+        if is_quota_error(error):
+            self.quota.exhausted(self)
+        self.ledger.record(key, FAILED, error=str(error))
+        if creation_response.ok:
+            print(f"創建了媒體容器 {creation_response['id']}，但發布失敗: {error}")
+        raise Exception(f"創建並發布媒體時出錯: {error}")
+
+
+class PublisherRegistry:
+    """Hands out one InstagramPublisher per Facebook Page
+    
+    All publishers share one TokenManager (token store, rate governor and
+    connection pool); each is created on first use and then reused.
+    """
+    
+    def __init__(self, debug=False, max_workers: int = 5, background_refresh: bool = False,
+                 token_manager: Optional[TokenManager] = None, account_cache: Optional[AccountCache] = None,
+                 ledger=None, preflight: bool = True):
+        """Initialize the registry
+        
+        Args:
+            debug: Enable debug output for created publishers
+            max_workers: Maximum concurrent requests for carousel items per publisher
+            background_refresh: Renew tokens for all pages in a background thread
+            token_manager: Shared TokenManager (default: a new one)
+            account_cache: Shared Page -> Instagram account cache (default: a new one)
+            ledger: Shared PublishLedger (default: the process-wide ledger)
+            preflight: Check media URLs before creating containers
+        """
+        load_environment()
+        
+        self.debug = debug
+        self.max_workers = max_workers
+        self.token_manager = token_manager or TokenManager()
+        self.account_cache = account_cache or AccountCache()
+        self.ledger = ledger
+        self.preflight = preflight
+        if background_refresh:
+            self.token_manager.start_background_refresh()
+        self._publishers: Dict[str, InstagramPublisher] = {}
+        self._page_locks: Dict[str, threading.Lock] = {}
+        self._lock = threading.Lock()
+    
+    def get(self, page_id: Optional[str] = None) -> InstagramPublisher:
+        """Get the publisher for a Facebook Page
+        
+        Args:
+            page_id: Facebook Page ID (default: PAGE_ID env var)
+            
+        Returns:
+            InstagramPublisher bound to that page
+        """
+        page_id = page_id or os.getenv('PAGE_ID')
+        with self._lock:
+            publisher = self._publishers.get(page_id)
+            if publisher:
+                return publisher
+            page_lock = self._page_locks.setdefault(page_id, threading.Lock())
+        
+        # 各頁面獨立加鎖，初始化一個頁面時不會阻塞其他頁面
+        with page_lock:
+            with self._lock:
+                publisher = self._publishers.get(page_id)
+            if publisher is None:
+                publisher = InstagramPublisher(debug=self.debug, max_workers=self.max_workers,
+                                               page_id=page_id, token_manager=self.token_manager,
+                                               account_cache=self.account_cache, ledger=self.ledger,
+                                               preflight=self.preflight)
+                with self._lock:
+                    self._publishers[page_id] = publisher
+        return publisher
+    
+    def for_instagram_account(self, ig_account_id: str) -> InstagramPublisher:
+        """Get the publisher for an Instagram business account
+        
+        Args:
+            ig_account_id: Instagram business account ID
+            
+        Returns:
+            InstagramPublisher for the page linked to that account
+        """
+        page_id = self._find_page(ig_account_id)
+        if page_id is None:
+            # 存儲中沒有對應關係時重新掃描所有頁面
+            self.token_manager.refresh_page_tokens()
+            page_id = self._find_page(ig_account_id)
+        if page_id is None:
+            raise ValueError(f"找不到與 Instagram 帳戶 {ig_account_id} 關聯的頁面")
+        return self.get(page_id)
+    
+    def _find_page(self, ig_account_id: str) -> Optional[str]:
+        for key, info in self.token_manager.tokens.items():
+            if key.startswith('page_') and info.get('instagram_business_account_id') == ig_account_id:
+                return key[len('page_'):]
+        return None
+    
+    def page_ids(self) -> List[str]:
+        """IDs of all pages with a stored page token"""
+        return [key[len('page_'):] for key in self.token_manager.tokens if key.startswith('page_')]
 
 
 def parse_args():
@@ -435,13 +1199,98 @@ def parse_args():
     schedule_parser.add_argument('--cover', help='Cover URL for video (only for VIDEO type)')
     schedule_parser.add_argument('--upload-type', choices=['FEED', 'REELS', 'STORIES'], 
                                default='FEED', help='Upload type for video (only for VIDEO type)')
+    schedule_parser.add_argument('--local', action='store_true',
+                               help='Queue the post for the local scheduler daemon instead of scheduling it with the API')
+    schedule_parser.add_argument('--queue', help='Scheduler queue file (default: config/schedule_queue.db)')
+    
+    # Local scheduler daemon
+    daemon_parser = subparsers.add_parser('daemon', help='Run the local scheduler that publishes queued posts on time')
+    daemon_parser.add_argument('--queue', help='Scheduler queue file (default: config/schedule_queue.db)')
+    daemon_parser.add_argument('--workers', type=int, default=4, help='Posts processed concurrently (default: 4)')
+    daemon_parser.add_argument('--stage-ahead', type=int,
+                               help='Seconds before publishing to create the media container (default: 600)')
+    
+    # Scheduler queue
+    jobs_parser = subparsers.add_parser('jobs', help='List or cancel posts queued for the local scheduler')
+    jobs_parser.add_argument('--queue', help='Scheduler queue file (default: config/schedule_queue.db)')
+    jobs_parser.add_argument('--state', choices=['pending', 'staging', 'staged', 'publishing', 'published',
+                                                 'failed', 'cancelled'], help='Only list jobs in this state')
+    jobs_parser.add_argument('--limit', type=int, default=20, help='Number of jobs to list (default: 20)')
+    jobs_parser.add_argument('--cancel', type=int, metavar='JOB_ID', help='Cancel a job that has not started publishing')
+    
+    # Bulk publishing
+    bulk_parser = subparsers.add_parser('bulk', help='Publish posts from a JSONL/CSV manifest')
+    bulk_parser.add_argument('--manifest', required=True, help='Path to the JSONL or CSV manifest')
+    bulk_parser.add_argument('--workers', type=int, default=4, help='Number of posts processed concurrently (default: 4)')
+    bulk_parser.add_argument('--results', help='Per-item results file (default: <manifest>.results.jsonl)')
+    bulk_parser.add_argument('--checkpoint', help='Checkpoint file for resuming (default: <manifest>.checkpoint)')
+    bulk_parser.add_argument('--ready-timeout', type=int, default=600,
+                             help='Seconds to wait for a container to finish processing (default: 600)')
+    bulk_parser.add_argument('--max-pending', type=int,
+                             help='Maximum posts in progress, including those waiting on processing (default: workers x 10)')
+    bulk_parser.add_argument('--on-quota', choices=['defer', 'schedule'], default='defer',
+                             help='When an account is out of publishing quota: leave the post for a later run '
+                                  '(defer) or schedule it for the next free slot (default: defer)')
+    
+    # Publishing quota
+    quota_parser = subparsers.add_parser('quota', help='Show the content publishing quota')
+    quota_parser.add_argument('--all-pages', action='store_true',
+                              help='Show every page with a stored page token (default: PAGE_ID only)')
+    
+    # Export full media history
+    export_parser = subparsers.add_parser('export', help='Export all media of the account')
+    export_parser.add_argument('--output', required=True,
+                               help='Output file (.jsonl, .csv) or directory (.parquet)')
+    export_parser.add_argument('--format', choices=['jsonl', 'csv', 'parquet'],
+                               help='Output format (default: from the output extension)')
+    export_parser.add_argument('--fields', help='Comma-separated media fields to export')
+    export_parser.add_argument('--page-size', type=int, default=100, help='Media per request (default: 100)')
+    export_parser.add_argument('--checkpoint', help='Checkpoint file for resuming (default: <output>.checkpoint)')
+    export_parser.add_argument('--restart', action='store_true', help='Ignore the checkpoint and start over')
+    
+    # Incremental insights sync
+    insights_parser = subparsers.add_parser('insights', help='Sync per-media insights incrementally')
+    insights_parser.add_argument('--output', required=True, help='JSONL file the insights are appended to')
+    insights_parser.add_argument('--all-pages', action='store_true',
+                                 help='Sync every page with a stored page token (default: PAGE_ID only)')
+    insights_parser.add_argument('--workers', type=int, default=8, help='Accounts synced concurrently (default: 8)')
+    insights_parser.add_argument('--window-days', type=int,
+                                 help='Also re-sync posts from the last N days (default: 7)')
+    insights_parser.add_argument('--state', help='High-water mark file (default: config/insights_state.json)')
+    insights_parser.add_argument('--full', action='store_true', help='Ignore high-water marks and sync all media')
     
     # Tokens command
     tokens_parser = subparsers.add_parser('tokens', help='Manage API tokens')
     tokens_parser.add_argument('--refresh', action='store_true', help='Force refresh all tokens')
+    tokens_parser.add_argument('--validate', action='store_true',
+                               help='Validate all tokens with debug_token and renew those about to expire')
+    
+    # Account cache command
+    cache_parser = subparsers.add_parser('cache', help='Manage the Page -> Instagram account cache')
+    cache_parser.add_argument('--clear', action='store_true', help='Remove cached accounts')
+    cache_parser.add_argument('--page-id', help='Only clear this page (default: all pages)')
     
     # Global options
     parser.add_argument('--debug', action='store_true', help='Enable debug output')
+    parser.add_argument('--max-workers', type=int, default=5,
+                        help='Maximum concurrent requests when creating carousel items (default: 5)')
+    parser.add_argument('--background-refresh', action='store_true',
+                        help='Renew tokens ahead of expiry in a background thread (useful for bulk runs)')
+    parser.add_argument('--batch', action='store_true',
+                        help='Create and publish image/carousel posts in a single Graph batch request')
+    parser.add_argument('--skip-preflight', action='store_true',
+                        help='Do not check media URLs before creating containers')
+    parser.add_argument('--metrics-file', help='Write Graph API metrics in Prometheus text format to this file')
+    parser.add_argument('--metrics-port', type=int, help='Serve Graph API metrics at http://127.0.0.1:PORT/metrics')
+    parser.add_argument('--log-json', metavar='PATH',
+                        help='Write every Graph API call and trace span as a JSON line (- for stderr)')
+    parser.add_argument('--profile', nargs='?', const='-', metavar='REPORT',
+                        help='Break the command down by phase (wall/CPU time, requests); print a table to '
+                             'stderr and, if REPORT is given, write the report as JSON')
+    parser.add_argument('--profile-pstats', metavar='PATH',
+                        help='With --profile, also record a cProfile of the main thread to PATH')
+    parser.add_argument('--profile-baseline', metavar='REPORT',
+                        help='With --profile, exit non-zero if a phase is more than 20%% slower than in REPORT')
     
     return parser.parse_args()
 
@@ -450,6 +1299,44 @@ def main():
     """Main entry point for the script"""
     args = parse_args()
     
+    if args.metrics_file or args.metrics_port or args.log_json:
+        from src.metrics import configure
+        configure(args.metrics_file, args.metrics_port, args.log_json)
+    
+    if not (args.profile or args.profile_pstats or args.profile_baseline):
+        return run_command(args)
+    return profile_command(args)
+
+
+def profile_command(args):
+    """Run the command under the phase profiler and report where the time went"""
+    import json
+    from src.profiler import PhaseProfiler, format_report, compare_reports, write_report
+    
+    profiler = PhaseProfiler(args.command, args.profile_pstats, origin=_IMPORT_STARTED).start()
+    status = run_command(args)
+    report = profiler.stop()
+    
+    print(format_report(report), file=sys.stderr)
+    if args.profile and args.profile != '-':
+        write_report(report, args.profile)
+        print(f"分析報告已保存至: {args.profile}", file=sys.stderr)
+    if args.profile_pstats:
+        print(f"cProfile 統計已保存至: {args.profile_pstats}", file=sys.stderr)
+    
+    if args.profile_baseline:
+        with open(args.profile_baseline) as f:
+            slower = compare_reports(json.load(f), report)
+        if slower:
+            print("以下階段比基準慢:", file=sys.stderr)
+            for name, before, after in slower:
+                print(f"  {name}: {after:.1f} ms（基準 {before:.1f} ms）", file=sys.stderr)
+            return status or 1
+    return status
+
+
+def run_command(args):
+    """Run the parsed command, returning the exit status"""
     try:
         # Tokens management command
         if args.command == 'tokens':
@@ -458,24 +1345,65 @@ def main():
             
             if args.refresh:
                 print("強制刷新所有令牌...")
-                page_id = os.getenv('PAGE_ID')
                 user_token = token_manager.get_valid_user_token(refresh=True)
-                page_token = token_manager.get_valid_page_token(page_id, refresh=True)
+                pages = token_manager.refresh_page_tokens(user_token)
                 app_token = token_manager.get_valid_app_token(refresh=True)
-                print("所有令牌已刷新")
+                print(f"所有令牌已刷新（{len(pages)} 個頁面）")
+            
+            if args.validate:
+                from src.token_refresher import TokenRefresher
+                print("驗證所有令牌...")
+                TokenRefresher(token_manager).run_once()
             
             token_manager.print_token_info()
             return 0
+        
+        # Scheduler queue command
+        if args.command == 'jobs':
+            from src.publish_scheduler import JobQueue
+            
+            queue = JobQueue(args.queue)
+            if args.cancel is not None:
+                if not queue.cancel(args.cancel):
+                    print(f"無法取消任務 {args.cancel}（不存在或已開始發布）")
+                    return 1
+                print(f"已取消任務 {args.cancel}")
+                return 0
+            counts = queue.counts()
+            print("任務數量: " + (", ".join(f"{state} {count}" for state, count in sorted(counts.items())) or "0"))
+            for job in queue.jobs(args.state, args.limit):
+                publish_at = datetime.datetime.fromtimestamp(job['publish_at']).strftime('%Y-%m-%d %H:%M:%S')
+                line = f"{job['id']}: {publish_at} {job['media_type']} [{job['state']}]"
+                if job['media_id']:
+                    line += f" 媒體 ID: {job['media_id']}"
+                if job['error']:
+                    line += f" 錯誤: {job['error']}"
+                print(line)
+            return 0
+        
+        # Account cache command
+        if args.command == 'cache':
+            account_cache = AccountCache()
+            if args.clear:
+                account_cache.invalidate(args.page_id)
+                print(f"已清除帳戶快取: {args.page_id or '全部'}")
+            else:
+                for page_id, entry in account_cache.entries().items():
+                    print(f"{page_id}: {entry.get('instagram_business_account_id')} (@{entry.get('username')})")
+            return 0
             
         # Initialize the Instagram publisher for other commands
-        publisher = InstagramPublisher(debug=args.debug)
+        registry = PublisherRegistry(debug=args.debug, max_workers=args.max_workers,
+                                     background_refresh=args.background_refresh,
+                                     preflight=not args.skip_preflight)
+        publisher = registry.get()
         
         # Process commands
         if args.command == 'view':
             publisher.print_recent_posts(args.limit)
             
         elif args.command == 'image':
-            response = publisher.create_and_publish('IMAGE', args.url, args.caption)
+            response = publisher.create_and_publish('IMAGE', args.url, args.caption, use_batch=args.batch)
             print(f"已發布圖片貼文，ID: {response.get('id')}")
             
         elif args.command == 'video':
@@ -484,7 +1412,7 @@ def main():
             print(f"已發布影片貼文，ID: {response.get('id')}")
             
         elif args.command == 'carousel':
-            response = publisher.create_and_publish('CAROUSEL', args.urls, args.caption)
+            response = publisher.create_and_publish('CAROUSEL', args.urls, args.caption, use_batch=args.batch)
             print(f"已發布輪播貼文，ID: {response.get('id')}")
             
         elif args.command == 'schedule':
@@ -496,19 +1424,106 @@ def main():
                     kwargs['cover_url'] = args.cover
                 kwargs['upload_type'] = args.upload_type
             
-            creation_response = publisher.schedule_post(
-                args.type, content, args.caption, args.time, **kwargs
-            )
-            
             scheduled_time = args.time or (int(time.time()) + 86400)
-            print(f"已排程貼文，creation_id: {creation_response.get('id')}")
+            if args.local:
+                from src.publish_scheduler import JobQueue
+                
+                job = JobQueue(args.queue).add(publisher.page_id, args.type, content, args.caption,
+                                               scheduled_time, **kwargs)
+                print(f"已加入本地排程佇列，任務 ID: {job['id']}")
+            else:
+                creation_response = publisher.schedule_post(
+                    args.type, content, args.caption, args.time, **kwargs
+                )
+                print(f"已排程貼文，creation_id: {creation_response.get('id')}")
             print(f"排程發布時間: {datetime.datetime.fromtimestamp(scheduled_time).strftime('%Y-%m-%d %H:%M:%S')}")
             
+        elif args.command == 'bulk':
+            from src.bulk_publisher import BulkPublisher, read_manifest
+            
+            bulk = BulkPublisher(
+                publisher,
+                registry=registry,
+                workers=args.workers,
+                results_path=args.results or f"{args.manifest}.results.jsonl",
+                checkpoint_path=args.checkpoint or f"{args.manifest}.checkpoint",
+                ready_timeout=args.ready_timeout,
+                max_pending=args.max_pending,
+                on_quota=args.on_quota,
+            )
+            summary = bulk.run(read_manifest(args.manifest))
+            print(f"批量發布完成: 已發布 {summary['published']}，已排程 {summary['scheduled']}，"
+                  f"配額不足延後 {summary['deferred']}，已跳過 {summary['skipped']}，失敗 {summary['failed']}")
+            if summary['failed']:
+                return 1
+            
+        elif args.command == 'daemon':
+            import signal
+            from src.publish_scheduler import JobQueue, PublishScheduler, STAGE_AHEAD
+            
+            scheduler = PublishScheduler(
+                registry, JobQueue(args.queue),
+                stage_ahead=args.stage_ahead if args.stage_ahead is not None else STAGE_AHEAD,
+                workers=args.workers, debug=args.debug,
+            )
+            signal.signal(signal.SIGTERM, lambda signum, frame: scheduler.stop())
+            print(f"排程器已啟動，佇列: {scheduler.queue.path}（按 Ctrl+C 停止）")
+            try:
+                scheduler.run()
+            except KeyboardInterrupt:
+                scheduler.stop()
+            print("排程器已停止")
+            
+        elif args.command == 'quota':
+            if args.all_pages:
+                publishers = [registry.get(page_id) for page_id in registry.page_ids()]
+            else:
+                publishers = [publisher]
+            for account in publishers:
+                status = account.publishing_quota(refresh=True)
+                next_slot = datetime.datetime.fromtimestamp(status['next_slot']).strftime('%Y-%m-%d %H:%M:%S')
+                print(f"{account.ig_account_id}: 已使用 {status['used']}/{status['limit']}，"
+                      f"剩餘 {status['remaining']}，下一個名額: {next_slot}")
+            
+        elif args.command == 'export':
+            summary = publisher.export_media(
+                args.output, format=args.format, fields=args.fields, page_size=args.page_size,
+                checkpoint_path=args.checkpoint, restart=args.restart,
+            )
+            print(f"導出完成: 本次 {summary['exported']} 個，累計 {summary['total']} 個媒體")
+            
+        elif args.command == 'insights':
+            from src.insights_sync import InsightsSync, DEFAULT_WINDOW_DAYS
+            
+            if args.all_pages:
+                publishers = [registry.get(page_id) for page_id in registry.page_ids()]
+            else:
+                publishers = [publisher]
+            window_days = args.window_days if args.window_days is not None else DEFAULT_WINDOW_DAYS
+            sync = InsightsSync(args.state, window_days=window_days, debug=args.debug)
+            summary = sync.sync(publishers, args.output, workers=args.workers, full=args.full)
+            print(f"洞察同步完成: {summary['accounts']} 個帳戶，{summary['synced']} 個媒體，"
+                  f"失敗 {summary['failed']}")
+            for page_id, error in summary['errors'].items():
+                print(f"  頁面 {page_id}: {error}")
+            if summary['errors']:
+                return 1
+            
         else:
-            print("請指定命令: view, image, video, carousel, schedule, 或 tokens")
+            print("請指定命令: view, image, video, carousel, schedule, daemon, jobs, bulk, quota, export, insights, cache, 或 tokens")
             return 1
+        
+        if args.debug:
+            governor = registry.token_manager.governor
+            print(f"API 用量: {governor.utilization:.0f}%，目前速率: {governor.rate:.1f} 次/秒")
             
     except Exception as e:
+        from src.publish_ledger import AlreadyPublishedError
+        
+        if isinstance(e, AlreadyPublishedError):
+            # 內容已發布，不會重複發布；只是無法顯示媒體 ID
+            print(f"⚠️ {e}")
+            return 0
         print(f"錯誤: {e}")
         return 1
         
@@ -6,91 +6,153 @@ A simple API script to list all Facebook Pages associated with your business acc
 
 import sys
 import os
+import csv
 import json
+import argparse
 from pathlib import Path
-from tabulate import tabulate
 
 # Add the project root directory to the Python path
 project_root = Path(__file__).parent.parent
 sys.path.insert(0, str(project_root))
 
-from src.meta_client import MetaBusinessClient
+
+# CSV 導出的欄位
+CSV_COLUMNS = ['id', 'name', 'username', 'category', 'fan_count', 'verification_status',
+               'instagram_account_id', 'instagram_username', 'link', 'source']
+
+
+def parse_args():
+    """Parse command line arguments"""
+    parser = argparse.ArgumentParser(description='List Facebook Pages owned or managed by the business')
+    parser.add_argument('--format', choices=['table', 'json', 'csv'], default='table',
+                        help='Output format (default: table)')
+    parser.add_argument('--output', '-o', help='Write JSON/CSV to this file instead of stdout')
+    parser.add_argument('--business-id', help='Business ID (default: BUSINESS_ID env var)')
+    parser.add_argument('--refresh', action='store_true', help='Ignore the cached page list')
+    parser.add_argument('--owned-only', action='store_true', help='Only list pages owned by the business')
+    return parser.parse_args()
+
+
+def is_verified(page):
+    """verification_status is a string such as blue_verified or not_verified"""
+    return page.get('verification_status') in ('blue_verified', 'gray_verified', 'verified')
+
+
+def flatten(page):
+    """Return a CSV row for a page, with the linked Instagram account as plain columns"""
+    ig_account = page.get('instagram_business_account') or {}
+    row = {column: page.get(column) for column in CSV_COLUMNS}
+    row['instagram_account_id'] = ig_account.get('id')
+    row['instagram_username'] = ig_account.get('username')
+    return row
+
+
+def export(pages, fmt, output=None):
+    """Write pages as JSON or CSV to a file or stdout"""
+    stream = open(output, 'w', encoding='utf-8', newline='') if output else sys.stdout
+    try:
+        if fmt == 'json':
+            json.dump(pages, stream, ensure_ascii=False, indent=2)
+            stream.write('\n')
+        else:
+            writer = csv.DictWriter(stream, fieldnames=CSV_COLUMNS)
+            writer.writeheader()
+            writer.writerows(flatten(page) for page in pages)
+    finally:
+        if output:
+            stream.close()
+
+
+def print_table(pages):
+    """Display pages as a table"""
+    from tabulate import tabulate
+    
+    table_data = []
+    for page in pages:
+        # Format fan count for display
+        fan_count = page.get('fan_count') or 0
+        if fan_count >= 1000000:
+            fan_display = f"{fan_count/1000000:.1f}M"
+        elif fan_count >= 1000:
+            fan_display = f"{fan_count/1000:.1f}K"
+        else:
+            fan_display = str(fan_count)
+        
+        ig_account = page.get('instagram_business_account') or {}
+        
+        # Create a row for the table
+        row = [
+            page.get('id', 'N/A'),
+            page.get('name', 'N/A'),
+            f"@{page.get('username', '')}" if page.get('username') else "N/A",
+            page.get('category', 'N/A'),
+            fan_display,
+            "✓" if is_verified(page) else "✗",
+            f"@{ig_account['username']}" if ig_account.get('username') else ig_account.get('id', 'N/A'),
+            "自有" if page.get('source') == 'owned' else "客戶",
+        ]
+        table_data.append(row)
+    
+    headers = ["專頁 ID", "專頁名稱", "使用者名稱", "類別", "粉絲數", "已驗證", "Instagram", "來源"]
+    print(f"✅ 找到 {len(pages)} 個 Facebook 專頁:")
+    print(tabulate(table_data, headers, tablefmt="pretty"))
 
 
 def main():
     """Find and display all pages associated with the business account"""
-    print("正在查詢您的商業帳戶所擁有的 Facebook 專頁...\n")
+    args = parse_args()
+    # JSON/CSV 輸出到標準輸出時，提示信息寫到標準錯誤輸出
+    log = sys.stderr if args.format != 'table' else sys.stdout
+    print("正在查詢您的商業帳戶所擁有的 Facebook 專頁...\n", file=log)
     
     try:
+        from src.meta_client import MetaBusinessClient, EDGES
+        
         # Initialize the Meta Business Client
-        client = MetaBusinessClient()
+        client = MetaBusinessClient(business_id=args.business_id)
         
-        # Get pages owned by the business
-        pages = client.get_business_pages()
+        # Get pages owned by (and, unless --owned-only, managed for) the business
+        edges = ('owned_pages',) if args.owned_only else EDGES
+        pages = client.get_business_pages(refresh=args.refresh, edges=edges)
         
         if not pages:
-            print("❌ 找不到與此商業帳戶關聯的 Facebook 專頁。")
-            print("請確保您的商業帳戶已連接 Facebook 專頁並且有適當的權限。")
-            return
+            print("❌ 找不到與此商業帳戶關聯的 Facebook 專頁。", file=log)
+            print("請確保您的商業帳戶已連接 Facebook 專頁並且有適當的權限。", file=log)
+            return 1
         
-        # Format the data for display
-        table_data = []
-        for page in pages:
-            # Format fan count for display
-            fan_count = page.get('fan_count', 0)
-            if fan_count >= 1000000:
-                fan_display = f"{fan_count/1000000:.1f}M"
-            elif fan_count >= 1000:
-                fan_display = f"{fan_count/1000:.1f}K"
-            else:
-                fan_display = str(fan_count)
-                
-            verification = "✓" if page.get('verification_status') else "✗"
-            
-            # Create a row for the table
-            row = [
-                page.get('id', 'N/A'),
-                page.get('name', 'N/A'),
-                f"@{page.get('username', '')}" if page.get('username') else "N/A",
-                page.get('category', 'N/A'),
-                fan_display,
-                verification
-            ]
-            table_data.append(row)
+        if args.format != 'table':
+            export(pages, args.format, args.output)
+            if args.output:
+                print(f"已導出 {len(pages)} 個專頁至: {args.output}", file=log)
+            return 0
         
-        # Display the results in a table format
-        headers = ["專頁 ID", "專頁名稱", "使用者名稱", "類別", "粉絲數", "已驗證"]
-        print(f"✅ 找到 {len(pages)} 個 Facebook 專頁:")
-        print(tabulate(table_data, headers, tablefmt="pretty"))
+        print_table(pages)
         
-        # Option to save as JSON
-        save_option = input("\n是否要將結果保存為 JSON 文件? (y/n): ")
-        if save_option.lower() == 'y':
-            output_path = os.path.join(project_root, "business_pages.json")
-            
-            # Convert the page objects to dictionaries
-            pages_data = []
-            for page in pages:
-                page_dict = {}
-                for key, value in dict(page).items():
-                    page_dict[key] = value
-                pages_data.append(page_dict)
-                
-            with open(output_path, 'w', encoding='utf-8') as f:
-                json.dump(pages_data, f, ensure_ascii=False, indent=2)
-            print(f"結果已保存至: {output_path}")
+        if args.output:
+            export(pages, 'json', args.output)
+            print(f"結果已保存至: {args.output}")
+        elif sys.stdin.isatty():
+            # Option to save as JSON
+            save_option = input("\n是否要將結果保存為 JSON 文件? (y/n): ")
+            if save_option.lower() == 'y':
+                output_path = os.path.join(project_root, "business_pages.json")
+                export(pages, 'json', output_path)
+                print(f"結果已保存至: {output_path}")
+        return 0
             
     except ValueError as e:
-        print(f"❌ 錯誤: {e}")
-        print("\n⚠️ 請確保您已在 .env 文件中設置了有效的 API 憑證。")
-        print("1. 複製模板: cp config/.env.template config/.env")
-        print("2. 編輯文件: config/.env")
-        print("3. 添加您的 APP_ID, APP_SECRET, ACCESS_TOKEN 和 BUSINESS_ID")
+        print(f"❌ 錯誤: {e}", file=log)
+        print("\n⚠️ 請確保您已在 .env 文件中設置了有效的 API 憑證。", file=log)
+        print("1. 複製模板: cp config/.env.template config/.env", file=log)
+        print("2. 編輯文件: config/.env", file=log)
+        print("3. 添加您的 APP_ID, APP_SECRET, ACCESS_TOKEN 和 BUSINESS_ID", file=log)
+        return 1
     except Exception as e:
-        print(f"❌ 意外錯誤: {e}")
-        print("\n⚠️ 如果這是權限錯誤，請檢查您的訪問令牌是否具有必要的權限:")
-        print("   所需權限: pages_read_engagement, pages_show_list")
+        print(f"❌ 意外錯誤: {e}", file=log)
+        print("\n⚠️ 如果這是權限錯誤，請檢查您的訪問令牌是否具有必要的權限:", file=log)
+        print("   所需權限: business_management, pages_read_engagement, pages_show_list", file=log)
+        return 1
 
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    sys.exit(main())
\ No newline at end of file
@@ -13,6 +13,7 @@ from facebook_business.adobjects.iguserforigonlyapi import IGUserForIGOnlyAPI
 # 添加src目錄到路徑
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 from src.token_manager import TokenManager
+from src.graph_api import GraphApi
 
 # 載入環境變數
 from dotenv import load_dotenv
@@ -34,8 +35,8 @@ try:
     # 獲取有效的頁面令牌(會自動刷新)
     page_token = token_manager.get_valid_page_token(my_page_id)
     
-    # 使用頁面token初始化API
-    FacebookAdsApi.init(my_app_id, my_app_secret, page_token)
+    # 使用頁面token初始化API（共用連線池）
+    FacebookAdsApi.set_default_api(GraphApi.create(my_app_id, my_app_secret, page_token))
     
     # 顯示令牌信息
     token_manager.print_token_info()
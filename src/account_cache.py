@@ -0,0 +1,57 @@
+import os
+import time
+from pathlib import Path
+
+from src.json_store import JsonFileStore
+
+# 默認快取 7 天
+DEFAULT_TTL = int(os.getenv('ACCOUNT_CACHE_TTL', str(7 * 86400)))
+
+
+class AccountCache:
+    """頁面 → Instagram 商業帳戶對應關係及帳戶基本信息的磁盤快取
+
+    每個頁面一個條目，包含 `instagram_business_account_id`、帳戶元數據和
+    `cached_at`。超過 TTL 的條目視為不存在。以 JsonFileStore 的鎖文件和
+    原子寫入保存，多個進程可以安全共用。
+    """
+
+    def __init__(self, path=None, ttl=DEFAULT_TTL):
+        """初始化帳戶快取
+
+        Args:
+            path: 快取文件路徑，默認為 config/account_cache.json
+            ttl: 條目有效秒數
+        """
+        if path is None:
+            base_dir = Path(__file__).parent.parent
+            path = os.getenv('ACCOUNT_CACHE_FILE') or os.path.join(base_dir, 'config', 'account_cache.json')
+        self.path = path
+        self.ttl = ttl
+        self._store = JsonFileStore(path)
+
+    def get(self, page_id):
+        """返回未過期的條目，沒有或已過期時返回 None"""
+        entry = self._store.get(str(page_id))
+        if not entry or entry.get('cached_at', 0) + self.ttl <= time.time():
+            return None
+        return entry
+
+    def set(self, page_id, info):
+        """寫入或合併一個頁面的條目"""
+        entry = dict(self._store.get(str(page_id)) or {})
+        entry.update(info)
+        entry['cached_at'] = int(time.time())
+        self._store.set(str(page_id), entry)
+        return entry
+
+    def entries(self):
+        """返回所有條目（包括已過期的），鍵為頁面 ID"""
+        return self._store.all()
+
+    def invalidate(self, page_id=None):
+        """刪除一個頁面的條目；page_id 為 None 時清空整個快取"""
+        if page_id is None:
+            self._store.clear()
+        else:
+            self._store.delete(str(page_id))
@@ -0,0 +1,457 @@
+import os
+import json
+import time
+import queue
+import datetime
+import threading
+from collections import Counter, deque
+from concurrent.futures import ThreadPoolExecutor
+
+from src.metrics import traced
+from src.media_export import WRITERS, detect_format, field_names
+
+# 默認以廣告層級、每天一行的粒度請求的欄位
+DEFAULT_FIELDS = ('account_id,campaign_id,campaign_name,adset_id,adset_name,ad_id,ad_name,'
+                  'date_start,date_stop,impressions,reach,frequency,clicks,spend,cpm,ctr,actions')
+
+# 轉為數值欄位的指標（API 以字串返回數字）
+NUMERIC_FIELDS = ('impressions', 'reach', 'frequency', 'clicks', 'spend', 'cpm', 'cpc', 'ctr',
+                  'inline_link_clicks', 'unique_clicks')
+
+# 報告任務狀態（AdReportRun.async_status）
+COMPLETED_STATUS = 'Job Completed'
+FAILED_STATUSES = ('Job Failed', 'Job Skipped')
+
+# 每個廣告帳戶和全部帳戶同時執行的報告任務數量
+JOBS_PER_ACCOUNT = int(os.getenv('ADS_INSIGHTS_JOBS_PER_ACCOUNT', '3'))
+MAX_JOBS = int(os.getenv('ADS_INSIGHTS_MAX_JOBS', '30'))
+
+# 報告狀態輪詢退避設定: (首次檢查延遲, 倍數, 最大間隔) 秒
+POLL_BACKOFF = (2, 1.5, 30)
+
+# 單次多 ID 狀態查詢最多包含的報告數量
+MAX_IDS_PER_REQUEST = 50
+
+# 每個報告任務最多提交的次數，以及單次執行的最長等待秒數
+MAX_JOB_ATTEMPTS = 3
+JOB_TIMEOUT = int(os.getenv('ADS_INSIGHTS_JOB_TIMEOUT', '1800'))
+
+# 結果的每頁行數
+RESULT_PAGE_SIZE = 500
+
+_DONE = object()
+
+
+def ad_account_id(account_id):
+    """返回 act_ 開頭的廣告帳戶 ID"""
+    account_id = str(account_id)
+    return account_id if account_id.startswith('act_') else f"act_{account_id}"
+
+
+def split_range(since, until, days=None):
+    """將日期範圍切分為每段最多 `days` 天的 (since, until) ISO 日期列表
+
+    Args:
+        since: 開始日期（含），date 或 YYYY-MM-DD 字串
+        until: 結束日期（含）
+        days: 每段的天數；None 表示不切分
+    """
+    since = datetime.date.fromisoformat(str(since))
+    until = datetime.date.fromisoformat(str(until))
+    if until < since:
+        raise ValueError(f"結束日期 {until} 早於開始日期 {since}")
+    if not days:
+        return [(since.isoformat(), until.isoformat())]
+
+    ranges = []
+    start = since
+    while start <= until:
+        end = min(until, start + datetime.timedelta(days=days - 1))
+        ranges.append((start.isoformat(), end.isoformat()))
+        start = end + datetime.timedelta(days=1)
+    return ranges
+
+
+def _scalar(value):
+    if isinstance(value, (dict, list)):
+        return json.dumps(value, ensure_ascii=False)
+    return value
+
+
+def to_frame(rows, columns=None):
+    """將一頁結果轉為 pandas DataFrame
+
+    巢狀欄位（例如 actions）轉為 JSON 字串，數值指標轉為數字，使每一頁
+    的欄位類型一致。
+    """
+    import pandas as pd
+
+    if columns is None:
+        columns = list(dict.fromkeys(key for row in rows for key in row))
+    frame = pd.DataFrame([{column: _scalar(row.get(column)) for column in columns} for row in rows],
+                         columns=columns)
+    for column in columns:
+        if column in NUMERIC_FIELDS:
+            frame[column] = pd.to_numeric(frame[column], errors='coerce')
+    return frame
+
+
+class ReportJob:
+    """一個廣告帳戶在一段日期範圍內的非同步報告（AdReportRun）"""
+
+    def __init__(self, account_id, since, until, attempt=1):
+        self.account_id = ad_account_id(account_id)
+        self.since = since
+        self.until = until
+        self.attempt = attempt
+        self.report_run_id = None
+        self.status = None
+        self.percent = 0
+        self.delay = POLL_BACKOFF[0]
+        self.next_poll = 0.0
+        self.started = None
+        self.rows = 0
+
+    @property
+    def label(self):
+        return f"{self.account_id} {self.since}..{self.until}"
+
+    @property
+    def days(self):
+        return (datetime.date.fromisoformat(self.until) - datetime.date.fromisoformat(self.since)).days + 1
+
+    def split(self):
+        """失敗時切分為兩個較短的任務（只有一天時返回空列表）"""
+        if self.days < 2:
+            return []
+        middle = datetime.date.fromisoformat(self.since) + datetime.timedelta(days=self.days // 2 - 1)
+        return [ReportJob(self.account_id, self.since, middle.isoformat(), self.attempt + 1),
+                ReportJob(self.account_id, (middle + datetime.timedelta(days=1)).isoformat(), self.until,
+                          self.attempt + 1)]
+
+
+class AdsInsightsPool:
+    """以非同步報告任務並行獲取多個廣告帳戶的廣告洞察
+
+    每個 (廣告帳戶, 日期範圍) 是一個 AdReportRun。任務以批次請求提交
+    （每個 HTTP 請求 50 個），每個帳戶和全部帳戶同時執行的任務數量有上限。
+    執行中的任務以 `?ids=` 多 ID 查詢合併輪詢，按退避間隔重新檢查。
+    完成的任務在下載執行緒中逐頁讀取結果，放入有界佇列由調用方串流
+    處理，因此記憶體用量只取決於佇列長度，與帳戶數量和報告大小無關。
+    失敗或逾時的任務重新提交；跨多天的任務會切分為兩半再提交。
+    """
+
+    def __init__(self, api, level='ad', fields=DEFAULT_FIELDS, time_increment=1, breakdowns=None,
+                 jobs_per_account=JOBS_PER_ACCOUNT, max_jobs=MAX_JOBS, download_workers=4,
+                 page_size=RESULT_PAGE_SIZE, buffer_pages=8, job_timeout=JOB_TIMEOUT, debug=False):
+        """初始化任務池
+
+        Args:
+            api: 綁定有 ads_read 權限令牌的 GraphApi 實例
+            level: 報告層級（account, campaign, adset, ad）
+            fields: 要請求的欄位
+            time_increment: 每行的天數（1 為每天一行），或 monthly、all_days
+            breakdowns: 細分維度列表，例如 ['age', 'gender']（可選）
+            jobs_per_account: 每個廣告帳戶同時執行的任務數
+            max_jobs: 全部帳戶同時執行的任務數
+            download_workers: 同時下載結果的任務數
+            page_size: 結果的每頁行數
+            buffer_pages: 等待調用方處理的最大頁數
+            job_timeout: 單次執行的最長等待秒數，逾時後重新提交
+            debug: 顯示調試信息
+        """
+        self.api = api
+        self.level = level
+        self.fields = fields
+        self.time_increment = time_increment
+        self.breakdowns = list(breakdowns or [])
+        self.jobs_per_account = max(1, jobs_per_account)
+        self.max_jobs = max(1, max_jobs)
+        self.download_workers = max(1, download_workers)
+        self.page_size = page_size
+        self.buffer_pages = max(1, buffer_pages)
+        self.job_timeout = job_timeout
+        self.debug = debug
+        self.summary = None
+        self._summary_lock = threading.Lock()
+
+    @property
+    def columns(self):
+        """輸出的欄位（請求的欄位加上細分維度）"""
+        return field_names(self.fields) + [b for b in self.breakdowns if b not in field_names(self.fields)]
+
+    def iter_pages(self, accounts, since, until, days_per_job=None, deadline=None):
+        """並行執行所有報告任務，逐頁返回完成的結果
+
+        Args:
+            accounts: 廣告帳戶 ID 列表（可省略 act_ 前綴）
+            since: 開始日期（含）
+            until: 結束日期（含）
+            days_per_job: 每個任務的天數；None 表示每個帳戶一個任務
+            deadline: 最長執行秒數，超過後不再等待未完成的任務（可選）
+
+        Yields:
+            (ReportJob, 行列表) 元組；完成後 `self.summary` 為
+            {'jobs', 'completed', 'failed', 'rows', 'errors'} 摘要，
+            errors 為 {任務: 錯誤信息}
+        """
+        jobs = deque(ReportJob(account, start, end)
+                     for account in dict.fromkeys(accounts)
+                     for start, end in split_range(since, until, days_per_job))
+        self.summary = {'jobs': len(jobs), 'completed': 0, 'failed': 0, 'rows': 0, 'errors': {}}
+        output = queue.Queue(maxsize=self.buffer_pages)
+        stop = threading.Event()
+        ends_at = time.monotonic() + deadline if deadline else None
+        scheduler = threading.Thread(target=self._schedule, args=(jobs, output, stop, ends_at),
+                                     name='ads-insights-scheduler', daemon=True)
+        scheduler.start()
+        try:
+            while True:
+                item = output.get()
+                if item is _DONE:
+                    return
+                if isinstance(item, BaseException):
+                    raise item
+                yield item
+        finally:
+            stop.set()
+            scheduler.join()
+
+    def iter_frames(self, accounts, since, until, **kwargs):
+        """同 iter_pages，但每一頁以 pandas DataFrame 返回（參數同 iter_pages）"""
+        columns = self.columns
+        for _, rows in self.iter_pages(accounts, since, until, **kwargs):
+            yield to_frame(rows, columns)
+
+    def export(self, accounts, since, until, output, format=None, progress=None, **kwargs):
+        """將所有結果串流寫入 JSONL、CSV 或 parquet（parquet 為每頁一個 part 文件的目錄）
+
+        Args:
+            accounts, since, until: 同 iter_pages
+            output: 輸出文件路徑
+            format: jsonl, csv 或 parquet；省略時根據擴展名判斷
+            progress: 每寫完一頁以累計行數調用的函數（可選）
+            **kwargs: 傳給 iter_pages 的其他參數
+
+        Returns:
+            同 `self.summary`
+        """
+        format = format or detect_format(output)
+        if format not in WRITERS:
+            raise ValueError(f"不支持的導出格式: {format}")
+
+        # 每次導出都重新寫入輸出文件
+        writer = WRITERS[format](output, self.columns, 0)
+        written = 0
+        try:
+            for _, rows in self.iter_pages(accounts, since, until, **kwargs):
+                writer.write(rows)
+                written += len(rows)
+                if progress:
+                    progress(written)
+        finally:
+            writer.close()
+        return self.summary
+
+    def _record(self, job, error=None):
+        with self._summary_lock:
+            if error is None:
+                self.summary['completed'] += 1
+            else:
+                self.summary['failed'] += 1
+                self.summary['errors'][job.label] = error
+        if self.debug:
+            outcome = f"失敗: {error}" if error else f"完成，{job.rows} 行"
+            print(f"報告 {job.label}: {outcome}")
+
+    def _put(self, output, item, stop):
+        """放入輸出佇列；佇列已滿時等待調用方，調用方停止時返回 False"""
+        while not stop.is_set():
+            try:
+                output.put(item, timeout=0.5)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _schedule(self, jobs, output, stop, ends_at):
+        running = {}
+        active = Counter()
+        downloads = set()
+        try:
+            with ThreadPoolExecutor(max_workers=self.download_workers,
+                                    thread_name_prefix='ads-insights') as executor:
+                while not stop.is_set() and (jobs or running or downloads):
+                    if ends_at and time.monotonic() >= ends_at:
+                        for job in list(jobs) + list(running.values()):
+                            self._record(job, "超過執行時限，任務未完成")
+                        jobs.clear()
+                        running.clear()
+                        break
+
+                    self._submit_ready(jobs, running, active)
+
+                    now = time.monotonic()
+                    due = [job for job in running.values() if job.next_poll <= now + 1.0]
+                    for start in range(0, len(due), MAX_IDS_PER_REQUEST):
+                        for job, result in self._fetch_status(due[start:start + MAX_IDS_PER_REQUEST]):
+                            done = self._handle_status(job, result, jobs)
+                            if done:
+                                del running[job.report_run_id]
+                                active[job.account_id] -= 1
+                                if job.status == COMPLETED_STATUS:
+                                    downloads.add(executor.submit(self._download, job, output, stop))
+
+                    downloads = {future for future in downloads if not future.done()}
+                    if running:
+                        wait = min(job.next_poll for job in running.values()) - time.monotonic()
+                    else:
+                        wait = 0.2 if downloads and not jobs else 0.0
+                    if wait > 0:
+                        stop.wait(min(wait, 5.0))
+            self._put(output, _DONE, stop)
+        except BaseException as e:
+            self._put(output, e, stop)
+            stop.set()
+
+    def _submit_ready(self, jobs, running, active):
+        """在並行上限內提交等待中的任務"""
+        ready = []
+        for job in list(jobs):
+            if len(running) + len(ready) >= self.max_jobs:
+                break
+            if active[job.account_id] < self.jobs_per_account:
+                active[job.account_id] += 1
+                ready.append(job)
+                jobs.remove(job)
+        if ready:
+            self._submit(ready, jobs, running, active)
+
+    @traced('ads.insights.submit')
+    def _submit(self, ready, jobs, running, active):
+        """以批次請求提交一組任務（每個 HTTP 請求最多 50 個）"""
+        batch = self.api.new_batch()
+        names = [batch.add('POST', f"{job.account_id}/insights", self._report_params(job)) for job in ready]
+        try:
+            batch.execute()
+        except Exception as e:
+            # 整個批次失敗時任務放回隊列，超過次數的任務記為失敗
+            for job in ready:
+                active[job.account_id] -= 1
+                job.attempt += 1
+                if job.attempt > MAX_JOB_ATTEMPTS:
+                    self._record(job, f"提交報告任務失敗: {e}")
+                else:
+                    jobs.appendleft(job)
+            return
+
+        now = time.monotonic()
+        for job, name in zip(ready, names):
+            response = batch.result(name)
+            report_run_id = response.get('report_run_id') if response.ok else None
+            if not report_run_id:
+                active[job.account_id] -= 1
+                error = response.error
+                message = error.api_error_message() if error else "回應中沒有 report_run_id"
+                self._record(job, f"提交報告任務失敗: {message}")
+                continue
+            job.report_run_id = str(report_run_id)
+            job.status = None
+            job.delay = POLL_BACKOFF[0]
+            job.next_poll = now + POLL_BACKOFF[0]
+            job.started = now
+            running[job.report_run_id] = job
+
+    def _report_params(self, job):
+        params = {
+            'level': self.level,
+            'fields': self.fields,
+            'time_range': {'since': job.since, 'until': job.until},
+            'time_increment': self.time_increment,
+            'limit': self.page_size,
+        }
+        if self.breakdowns:
+            params['breakdowns'] = self.breakdowns
+        return params
+
+    def _fetch_status(self, due):
+        """查詢多個報告的狀態，返回 [(任務, 狀態字典或異常)]"""
+        from facebook_business.exceptions import FacebookRequestError
+
+        ids = [job.report_run_id for job in due]
+        try:
+            response = self.api.call(
+                'GET', (), params={'ids': ','.join(ids), 'fields': 'async_status,async_percent_completion'}
+            )
+            data = response.json()
+            return [(job, data.get(job.report_run_id, {})) for job in due]
+        except FacebookRequestError as e:
+            if len(due) == 1:
+                return [(due[0], e)]
+
+        # 多 ID 查詢中只要有一個 ID 無效整個請求就會失敗，改為逐一查詢
+        results = []
+        for job in due:
+            results.extend(self._fetch_status([job]))
+        return results
+
+    def _handle_status(self, job, result, jobs):
+        """更新任務狀態，任務結束（完成、失敗或重新排隊）時返回 True"""
+        now = time.monotonic()
+        error = None
+        if isinstance(result, Exception):
+            error = f"獲取報告狀態時出錯: {result}"
+        else:
+            job.status = result.get('async_status')
+            job.percent = result.get('async_percent_completion') or 0
+            if job.status == COMPLETED_STATUS and job.percent >= 100:
+                return True
+            if job.status in FAILED_STATUSES:
+                error = f"報告任務 {job.report_run_id} 狀態: {job.status}"
+            elif now - job.started >= self.job_timeout:
+                error = f"報告任務 {job.report_run_id} 逾時，目前進度 {job.percent}%"
+
+        if error is None:
+            job.next_poll = now + job.delay
+            job.delay = min(job.delay * POLL_BACKOFF[1], POLL_BACKOFF[2])
+            return False
+
+        if job.attempt >= MAX_JOB_ATTEMPTS:
+            job.status = None
+            self._record(job, error)
+            return True
+
+        # 大範圍的任務較容易失敗，切分後重新提交
+        retries = job.split() or [ReportJob(job.account_id, job.since, job.until, job.attempt + 1)]
+        if self.debug:
+            print(f"報告 {job.label}: {error}，重新提交 {len(retries)} 個任務")
+        with self._summary_lock:
+            self.summary['jobs'] += len(retries) - 1
+        jobs.extendleft(reversed(retries))
+        job.status = None
+        return True
+
+    @traced('ads.insights.download')
+    def _download(self, job, output, stop):
+        """逐頁讀取完成報告的結果並放入輸出佇列"""
+        params = {'limit': self.page_size}
+        try:
+            while True:
+                data = self.api.call('GET', (job.report_run_id, 'insights'), params=params).json()
+                rows = data.get('data') or []
+                if rows:
+                    if not self._put(output, (job, rows), stop):
+                        return
+                    job.rows += len(rows)
+                    with self._summary_lock:
+                        self.summary['rows'] += len(rows)
+                paging = data.get('paging') or {}
+                cursor = (paging.get('cursors') or {}).get('after') if paging.get('next') else None
+                if not cursor:
+                    break
+                params = {'limit': self.page_size, 'after': cursor}
+        except Exception as e:
+            # 已輸出的行無法撤回，因此不重新提交，只記錄失敗
+            self._record(job, f"讀取報告結果時出錯（已輸出 {job.rows} 行）: {e}")
+            return
+        self._record(job)
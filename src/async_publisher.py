@@ -0,0 +1,918 @@
+import os
+import hmac
+import json
+import time
+import heapq
+import asyncio
+import hashlib
+import datetime
+import functools
+import contextvars
+from urllib.parse import urlencode
+from concurrent.futures import ThreadPoolExecutor
+
+from requests.exceptions import ConnectionError as RequestsConnectionError, Timeout
+
+from src.graph_batch import GRAPH_URL, GRAPH_API_VERSION
+from src.metrics import get_default_metrics, traced, current_span
+from src.resilience import endpoint_key, is_idempotent, get_default_resilience
+from src.container_poller import (
+    BACKOFF, SUCCESS_STATUSES, FAILURE_STATUSES, MAX_IDS_PER_REQUEST, ContainerError,
+)
+from src.errors import carousel_error
+
+# 同時進行中的 HTTP 請求上限，可通過環境變量調整
+MAX_CONCURRENCY = int(os.getenv('GRAPH_ASYNC_CONCURRENCY', '100'))
+
+# 發布帳本和帳戶快取（本地 SQLite/JSON）操作使用的執行緒數
+STORE_WORKERS = int(os.getenv('ASYNC_STORE_WORKERS', '4'))
+
+# 同步網絡調用（令牌刷新、發布配額查詢）使用的執行緒數
+BLOCKING_WORKERS = int(os.getenv('ASYNC_BLOCKING_WORKERS', '4'))
+
+
+def _form_value(value):
+    """將參數值轉為 Graph API 表單字串"""
+    if isinstance(value, bool):
+        return 'true' if value else 'false'
+    if isinstance(value, (list, tuple)):
+        return ','.join(str(v) for v in value)
+    if isinstance(value, dict):
+        return json.dumps(value)
+    return str(value)
+
+
+class AsyncGraphClient:
+    """以 aiohttp 發送 Graph API 請求的 asyncio 客戶端
+
+    所有請求共用一個連線池，並經過速率控制器；同時進行中的請求數由
+    信號量限制。重試、退避和熔斷使用與同步客戶端相同的 Resilience。失敗時拋出與同步客戶端相同的異常：API 錯誤為
+    FacebookRequestError，連線失敗和逾時為 requests 的 ConnectionError 和
+    Timeout。需要安裝 `aiohttp`（可選依賴）。
+    """
+
+    def __init__(self, access_token, app_secret=None, governor=None, max_concurrency=MAX_CONCURRENCY,
+                 api_version=GRAPH_API_VERSION, graph_url=GRAPH_URL, timeout=60, resilience=None):
+        """初始化客戶端
+
+        Args:
+            access_token: 訪問令牌
+            app_secret: 應用密鑰，提供時附加 appsecret_proof
+            governor: 速率控制器，默認使用進程共用的實例
+            max_concurrency: 同時進行中的請求上限
+            api_version: Graph API 版本
+            graph_url: Graph API 基本 URL
+            timeout: 每個請求的逾時秒數
+            resilience: 重試與熔斷設定，默認使用進程共用的實例
+        """
+        from src.rate_governor import get_default_governor
+
+        self.access_token = access_token
+        self.appsecret_proof = hmac.new(
+            app_secret.encode(), access_token.encode(), hashlib.sha256
+        ).hexdigest() if app_secret and access_token else None
+        self.governor = governor or get_default_governor()
+        self.resilience = resilience or get_default_resilience()
+        self.max_concurrency = max(1, max_concurrency)
+        self.base_url = f"{graph_url.rstrip('/')}/{api_version}"
+        self.timeout = timeout
+        self._session = None
+        self._semaphore = None
+
+    def _ensure_session(self):
+        if self._session is None or self._session.closed:
+            import aiohttp
+
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=self.max_concurrency),
+                timeout=aiohttp.ClientTimeout(total=self.timeout),
+            )
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        return self._session
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    @staticmethod
+    async def _send(session, method, url, params):
+        """發送請求並返回 (回應文字, 標頭, 狀態碼)
+
+        aiohttp 的連線錯誤和逾時轉為 requests 的 ConnectionError 和 Timeout，
+        與同步客戶端相同，由 classify() 歸類為暫時性錯誤。
+        """
+        import aiohttp
+
+        if method == 'GET':
+            request = session.request(method, url, params=params)
+        else:
+            request = session.request(method, url, data=params)
+        try:
+            async with request as response:
+                return await response.text(), dict(response.headers), response.status
+        except asyncio.TimeoutError as e:
+            raise Timeout(f"Graph API 請求逾時: {method} {url}") from e
+        except aiohttp.ClientError as e:
+            raise RequestsConnectionError(f"Graph API 連線失敗: {e}") from e
+
+    async def call(self, method, path, params=None):
+        """發送一個 Graph API 請求並返回解析後的 JSON
+
+        Args:
+            method: HTTP 方法
+            path: 相對於 API 版本的路徑，例如 `{ig-user-id}/media`
+            params: 請求參數
+
+        Returns:
+            回應 JSON（字典）
+
+        Raises:
+            FacebookRequestError: API 返回錯誤
+            requests.exceptions.ConnectionError: 連線失敗
+            requests.exceptions.Timeout: 請求逾時
+            CircuitOpenError: 端點已熔斷，請求未發送
+        """
+        session = self._ensure_session()
+        method = method.upper()
+        params = {key: _form_value(value) for key, value in (params or {}).items() if value is not None}
+        params['access_token'] = self.access_token
+        if self.appsecret_proof:
+            params['appsecret_proof'] = self.appsecret_proof
+        url = f"{self.base_url}/{path.lstrip('/')}" if path else f"{self.base_url}/"
+
+        return await self.resilience.call_async(
+            endpoint_key(method, path or '/'),
+            lambda: self._call_once(session, method, path, url, params),
+            idempotent=is_idempotent(method, path or '/'),
+        )
+
+    async def _call_once(self, session, method, path, url, params):
+        from facebook_business.exceptions import FacebookRequestError
+
+        # 退避等待期間不佔用信號量
+        async with self._semaphore:
+            await self.governor.acquire_async()
+            text, headers, status = await self._send(session, method, url, params)
+        metrics = get_default_metrics()
+        if metrics.enabled:
+            metrics.record_bytes(endpoint_key(method, path or '/'),
+                                 0 if method == 'GET' else len(urlencode(params)), len(text))
+
+        try:
+            body = json.loads(text) if text else {}
+        except ValueError:
+            body = text
+
+        if not 200 <= status < 300 or (isinstance(body, dict) and 'error' in body):
+            error = FacebookRequestError(
+                "Call was not successful",
+                {'method': method, 'path': url, 'params': {k: v for k, v in params.items()
+                                                           if k not in ('access_token', 'appsecret_proof')}},
+                status,
+                headers,
+                text,
+            )
+            self.governor.observe(headers, error_code=error.api_error_code())
+            raise error
+        self.governor.observe(headers)
+        return body
+
+
+class AsyncContainerPoller:
+    """ContainerPoller 的 asyncio 版本
+
+    在事件循環中以單一任務追蹤所有待處理的容器：到期的檢查合併為
+    `?ids=a,b,c` 查詢（每個請求最多 50 個 ID），並按上傳類型的退避設定
+    重新排程。數千個容器只需要一個任務和少量請求。
+    """
+
+    def __init__(self, client, timeout=600, coalesce=1.0):
+        self.client = client
+        self.timeout = timeout
+        self.coalesce = coalesce
+        self._heap = []
+        self._watches = {}
+        self._wakeup = asyncio.Event()
+        self._task = None
+
+    def watch(self, creation_id, upload_type='FEED', timeout=None):
+        """開始追蹤一個容器，返回結果為最終狀態碼的 asyncio.Future"""
+        initial, factor, max_delay = BACKOFF.get(upload_type, BACKOFF['FEED'])
+        loop = asyncio.get_running_loop()
+        now = loop.time()
+
+        watch = self._watches.get(creation_id)
+        if watch is None or watch['future'].done():
+            future = loop.create_future()
+            # 等待者可能已被取消，避免未取得的異常產生警告
+            future.add_done_callback(lambda f: f.cancelled() or f.exception())
+            watch = {
+                'future': future,
+                'delay': initial or 1,
+                'factor': factor,
+                'max_delay': max_delay,
+                'deadline': now + (timeout or self.timeout),
+                'status': None,
+            }
+            self._watches[creation_id] = watch
+            heapq.heappush(self._heap, (now + initial, creation_id))
+            self._wakeup.set()
+            if self._task is None or self._task.done():
+                self._task = loop.create_task(self._run())
+        return watch['future']
+
+    async def wait(self, creation_id, upload_type='FEED', timeout=None):
+        """等待容器處理完成並返回最終狀態碼
+
+        取消等待不會影響其他等待同一容器的調用者。
+        """
+        return await asyncio.shield(self.watch(creation_id, upload_type, timeout))
+
+    def pending(self):
+        return len(self._watches)
+
+    async def close(self):
+        """停止輪詢任務，未完成的容器以 ContainerError 結束"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        watches, self._watches, self._heap = self._watches, {}, []
+        for creation_id, watch in watches.items():
+            if not watch['future'].done():
+                watch['future'].set_exception(ContainerError("輪詢器已關閉", creation_id, watch['status']))
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while self._watches and self._heap:
+            delay = self._heap[0][0] - loop.time()
+            if delay > 0:
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), delay)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            horizon = loop.time() + self.coalesce
+            due = []
+            while self._heap and self._heap[0][0] <= horizon and len(due) < MAX_IDS_PER_REQUEST:
+                _, creation_id = heapq.heappop(self._heap)
+                if creation_id in self._watches and creation_id not in due:
+                    due.append(creation_id)
+            if due:
+                for creation_id, result in (await self._fetch(due)).items():
+                    self._handle(creation_id, result, loop.time())
+
+    async def _fetch(self, creation_ids):
+        """查詢多個容器的狀態，返回 {creation_id: 狀態字典或異常}"""
+        from facebook_business.exceptions import FacebookRequestError
+
+        try:
+            data = await self.client.call('GET', '', {'ids': ','.join(creation_ids),
+                                                      'fields': 'status_code,status'})
+            return {cid: data.get(cid, {}) for cid in creation_ids}
+        except FacebookRequestError as e:
+            if len(creation_ids) == 1:
+                return {creation_ids[0]: e}
+        except Exception as e:
+            return {cid: e for cid in creation_ids}
+
+        # 多 ID 查詢中只要有一個 ID 無效整個請求就會失敗，改為逐一查詢
+        results = await asyncio.gather(*(self._fetch([cid]) for cid in creation_ids))
+        return {cid: result for partial in results for cid, result in partial.items()}
+
+    def _handle(self, creation_id, result, now):
+        watch = self._watches.get(creation_id)
+        if watch is None:
+            return
+
+        error = None
+        status = None
+        if isinstance(result, Exception):
+            error = ContainerError(f"獲取媒體容器狀態時出錯: {result}", creation_id)
+        else:
+            status = result.get('status_code')
+            watch['status'] = status
+            if status in FAILURE_STATUSES:
+                detail = f" ({result['status']})" if result.get('status') else ""
+                error = ContainerError(
+                    f"媒體容器 {creation_id} 處理失敗，狀態: {status}{detail}", creation_id, status
+                )
+            elif status not in SUCCESS_STATUSES and now >= watch['deadline']:
+                error = ContainerError(
+                    f"等待媒體容器 {creation_id} 處理完成逾時，目前狀態: {status}", creation_id, status
+                )
+
+        if error is None and status not in SUCCESS_STATUSES:
+            # 仍在處理中，按退避設定重新排程
+            delay = min(watch['delay'], watch['max_delay'], max(0.0, watch['deadline'] - now))
+            heapq.heappush(self._heap, (now + delay, creation_id))
+            watch['delay'] = min(watch['delay'] * watch['factor'], watch['max_delay'])
+            return
+
+        del self._watches[creation_id]
+        if watch['future'].done():
+            return
+        if error is not None:
+            watch['future'].set_exception(error)
+        else:
+            watch['future'].set_result(status)
+
+
+class AsyncInstagramPublisher:
+    """InstagramPublisher 的 asyncio 版本
+
+    方法與 InstagramPublisher 同名、參數和錯誤信息相同，但都是協程，
+    可以在一個事件循環中同時處理數千個媒體容器。令牌和帳戶查詢使用
+    同一個 TokenManager 和 AccountCache；發布帳本、發布配額和媒體 URL
+    預檢也與同步版本共用。媒體預檢以客戶端的 aiohttp 連線池發送請求；
+    帳本等本地存儲和同步的網絡調用分別在兩個有上限的執行緒池中運行，
+    不佔用 asyncio 的默認執行器，較慢的網絡調用也不會阻塞帳本操作。
+
+    用法:
+        async with AsyncInstagramPublisher() as publisher:
+            await publisher.create_and_publish('IMAGE', url, caption)
+
+    取消任何協程都會取消其尚未完成的請求；輪播貼文中一個項目失敗或被
+    取消時，其他尚未完成的項目也會被取消。
+    """
+
+    def __init__(self, debug=False, max_concurrency=MAX_CONCURRENCY, page_id=None,
+                 token_manager=None, account_cache=None, ledger=None, preflight=True, quota=None):
+        """初始化發布器
+
+        Args:
+            debug: 顯示調試信息
+            max_concurrency: 同時進行中的 HTTP 請求上限
+            page_id: 要發布的 Facebook 頁面（默認為 PAGE_ID 環境變量）
+            token_manager: 共用的 TokenManager（默認建立新的）
+            account_cache: 共用的頁面 → Instagram 帳戶快取（默認建立新的）
+            ledger: 記錄發布進度的 PublishLedger（默認為進程共用的帳本）
+            preflight: 創建容器之前檢查媒體 URL
+            quota: 追蹤發布配額的 PublishQuota（默認為進程共用的實例）
+        """
+        from dotenv import load_dotenv
+        from src.token_manager import TokenManager
+        from src.account_cache import AccountCache
+
+        load_dotenv()
+        load_dotenv('config/.env')
+
+        self.app_id = os.getenv('APP_ID')
+        self.app_secret = os.getenv('APP_SECRET')
+        self.page_id = page_id or os.getenv('PAGE_ID')
+        self.debug = debug
+        self.max_concurrency = max(1, max_concurrency)
+        self.token_manager = token_manager or TokenManager(app_id=self.app_id, app_secret=self.app_secret)
+        self.account_cache = account_cache or AccountCache()
+        self.page_token = None
+        self.ig_account_id = None
+        self.api = None
+        self.client = None
+        self.poller = None
+        self._ledger = ledger
+        self._quota = quota
+        self.preflight = preflight
+        self._setup_lock = None
+        self._executors = {}
+
+    @property
+    def ledger(self):
+        """使 create_and_publish 冪等的 PublishLedger"""
+        if self._ledger is None:
+            from src.publish_ledger import get_default_ledger
+
+            self._ledger = get_default_ledger()
+        return self._ledger
+
+    @property
+    def quota(self):
+        """避免超出 24 小時發布上限的 PublishQuota"""
+        if self._quota is None:
+            from src.publish_quota import get_default_quota
+
+            self._quota = get_default_quota()
+        return self._quota
+
+    async def __aenter__(self):
+        await self.setup()
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    async def setup(self):
+        """取得頁面令牌和 Instagram 帳戶（只在第一次調用時執行）"""
+        if self.client is not None:
+            return
+        if self._setup_lock is None:
+            self._setup_lock = asyncio.Lock()
+        async with self._setup_lock:
+            if self.client is not None:
+                return
+            if self.debug:
+                print("初始化 API...")
+
+            # TokenManager 是同步的，在執行緒中運行以免阻塞事件循環
+            page_token = await self._blocking_call(self.token_manager.get_valid_page_token, self.page_id)
+            client = AsyncGraphClient(page_token, self.app_secret, governor=self.token_manager.governor,
+                                      max_concurrency=self.max_concurrency)
+            try:
+                self.ig_account_id = await self._get_instagram_account(client)
+            except BaseException:
+                await client.close()
+                raise
+            from src.graph_api import GraphApi
+
+            self.page_token = page_token
+            # PublishQuota 以同步 API 查詢配額，在 _blocking_call 的執行緒池中使用
+            self.api = GraphApi.create(self.app_id, self.app_secret, page_token,
+                                       governor=self.token_manager.governor)
+            self.poller = AsyncContainerPoller(client)
+            self.client = client
+
+    async def close(self):
+        """關閉輪詢任務和連線池"""
+        if self.poller is not None:
+            await self.poller.close()
+            self.poller = None
+        if self.client is not None:
+            await self.client.close()
+            self.client = None
+        for executor in self._executors.values():
+            executor.shutdown(wait=False)
+        self._executors = {}
+
+    async def _run_in_executor(self, kind, workers, func, *args, **kwargs):
+        executor = self._executors.get(kind)
+        if executor is None:
+            executor = self._executors[kind] = ThreadPoolExecutor(
+                max_workers=workers, thread_name_prefix=f"async-publisher-{kind}"
+            )
+        # 與 asyncio.to_thread 相同，在執行緒中保留目前的 contextvars（追蹤 span）
+        call = functools.partial(contextvars.copy_context().run, func, *args, **kwargs)
+        return await asyncio.get_running_loop().run_in_executor(executor, call)
+
+    async def _store_call(self, func, *args, **kwargs):
+        """在本地存儲的執行緒池中調用發布帳本或帳戶快取"""
+        return await self._run_in_executor('store', STORE_WORKERS, func, *args, **kwargs)
+
+    async def _blocking_call(self, func, *args, **kwargs):
+        """在另一個執行緒池中運行同步的網絡調用（令牌刷新、配額查詢）"""
+        return await self._run_in_executor('blocking', BLOCKING_WORKERS, func, *args, **kwargs)
+
+    async def _get_instagram_account(self, client):
+        """依次從帳戶快取、TokenManager 的頁面信息和 Graph API 取得 Instagram 帳戶 ID"""
+        if self.debug:
+            print("獲取與頁面關聯的 Instagram 帳戶...")
+
+        try:
+            cached = await self._store_call(self.account_cache.get, self.page_id)
+            if not cached:
+                page_info = self.token_manager.get_page_info(self.page_id) or {}
+                if page_info.get('instagram_business_account_id'):
+                    cached = await self._store_call(self.account_cache.set, self.page_id, {
+                        'instagram_business_account_id': page_info['instagram_business_account_id'],
+                        'username': page_info.get('instagram_username'),
+                    })
+
+            if not cached:
+                page_data = await client.call('GET', str(self.page_id), {
+                    'fields': 'instagram_business_account{id,username,biography,followers_count}'
+                })
+                if 'instagram_business_account' not in page_data:
+                    raise ValueError("此頁面沒有關聯的 Instagram 商業帳戶")
+                account = page_data['instagram_business_account']
+                cached = await self._store_call(self.account_cache.set, self.page_id, {
+                    'instagram_business_account_id': account['id'],
+                    'username': account.get('username'),
+                    'biography': account.get('biography'),
+                    'followers_count': account.get('followers_count'),
+                })
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            raise Exception(f"獲取 Instagram 帳戶時出錯: {e}")
+
+        if self.debug:
+            print(f"找到關聯的 Instagram 帳戶 ID: {cached['instagram_business_account_id']}")
+        return cached['instagram_business_account_id']
+
+    async def validate_media(self, urls, media_type='IMAGE'):
+        """創建容器之前檢查媒體 URL，有問題時拋出 MediaValidationError"""
+        if not self.preflight:
+            return
+        from src.media_preflight import get_default_preflight
+
+        await self.setup()
+        # 與同步版本共用結果快取，請求經由客戶端的 aiohttp 連線池發送
+        await get_default_preflight().validate_async(self.client._ensure_session(), urls, media_type)
+
+    async def _create_media(self, params):
+        await self.setup()
+        return await self.client.call('POST', f"{self.ig_account_id}/media", params)
+
+    @traced('container.create.image')
+    async def post_image(self, image_url, caption, is_carousel_item=False):
+        """創建圖片貼文的媒體容器，返回包含 creation_id 的回應"""
+        from facebook_business.exceptions import FacebookRequestError
+
+        params = {
+            'image_url': image_url,
+            'caption': caption,
+        }
+        if is_carousel_item:
+            params['is_carousel_item'] = True
+        else:
+            # 輪播項目已在 _create_carousel_items 中一併檢查
+            await self.validate_media(image_url, 'IMAGE')
+
+        try:
+            response = await self._create_media(params)
+            if self.debug:
+                print(f"媒體容器已創建，creation_id: {response.get('id')}")
+            return response
+        except FacebookRequestError as e:
+            raise Exception(f"創建媒體容器時出錯: {e}")
+
+    @traced('container.create.video')
+    async def post_video(self, video_url, caption, cover_url=None, upload_type='FEED'):
+        """創建影片貼文的媒體容器，返回包含 creation_id 的回應"""
+        from facebook_business.exceptions import FacebookRequestError
+
+        params = {
+            'video_url': video_url,
+            'caption': caption,
+            'upload_type': upload_type
+        }
+        # REELS 不再接受 media_type 參數
+        if upload_type != 'REELS':
+            params['media_type'] = 'VIDEO'
+        if cover_url:
+            params['cover_url'] = cover_url
+
+        await self.validate_media(video_url, upload_type if upload_type in ('REELS', 'STORIES') else 'VIDEO')
+        if cover_url:
+            await self.validate_media(cover_url, 'IMAGE')
+
+        if self.debug:
+            print(f"準備上傳影片，參數: {params}")
+
+        try:
+            response = await self._create_media(params)
+            if self.debug:
+                print(f"影片媒體容器已創建，creation_id: {response.get('id')}")
+            return response
+        except FacebookRequestError as e:
+            if "drive.google.com" in video_url and "Invalid parameter" in str(e):
+                raise Exception(f"Google Drive 連結無法直接使用。請提供直接可下載的影片URL。Google Drive 需要額外的身份驗證，API 無法直接訪問。")
+            raise Exception(f"創建影片媒體容器時出錯: {e}")
+
+    @traced('container.create.carousel')
+    async def post_carousel(self, image_urls, caption):
+        """創建輪播貼文的媒體容器，返回包含 creation_id 的回應"""
+        from facebook_business.exceptions import FacebookRequestError
+
+        children_ids = await self._create_carousel_items(image_urls)
+        params = {
+            'caption': caption,
+            'children': children_ids,
+            'media_type': 'CAROUSEL'
+        }
+
+        try:
+            response = await self._create_media(params)
+            if self.debug:
+                print(f"輪播媒體容器已創建，creation_id: {response.get('id')}")
+            return response
+        except FacebookRequestError as e:
+            raise Exception(f"創建輪播媒體容器時出錯: {e}")
+
+    async def _create_carousel_items(self, image_urls):
+        """同時創建所有輪播項目，按輸入順序返回 creation_id
+
+        任何項目失敗時取消其餘尚未完成的項目，並以 CarouselItemError
+        報告已創建的項目（未發布的容器會在 24 小時後自動過期）。
+        """
+        # 在創建任何項目之前並行檢查所有 URL
+        await self.validate_media(image_urls, 'IMAGE')
+
+        children_ids = [None] * len(image_urls)
+        failed = {}
+        tasks = {
+            asyncio.ensure_future(self.post_image(url, "", True)): index
+            for index, url in enumerate(image_urls)
+        }
+
+        try:
+            pending = set(tasks)
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_EXCEPTION)
+                for task in done:
+                    index = tasks[task]
+                    if task.cancelled():
+                        continue
+                    if task.exception() is not None:
+                        failed[index] = task.exception()
+                    else:
+                        children_ids[index] = task.result()['id']
+                        if self.debug:
+                            print(f"輪播項目已創建: {children_ids[index]}")
+                if failed:
+                    for task in pending:
+                        task.cancel()
+                    await asyncio.gather(*pending, return_exceptions=True)
+                    break
+        finally:
+            # 調用者被取消時不留下仍在運行的項目
+            for task in tasks:
+                task.cancel()
+
+        if failed:
+            raise carousel_error(children_ids, failed)
+        return children_ids
+
+    async def schedule_post(self, media_type, content_url, caption, scheduled_time=None,
+                            idempotency_key=None, **kwargs):
+        """創建排程貼文的媒體容器，返回包含 creation_id 的回應
+
+        排程時間之前 24 小時內的配額已用完時拋出 QuotaExceededError，
+        不會創建容器；創建的容器以冪等鍵記錄在發布帳本中。
+        """
+        from facebook_business.exceptions import FacebookRequestError
+        from src.publish_ledger import SCHEDULED
+
+        await self.setup()
+        # 沒有指定時間時默認為 24 小時後
+        if not scheduled_time:
+            scheduled_time = int(time.time()) + 86400
+        await self._blocking_call(self.quota.check_scheduled, self, scheduled_time)
+
+        base_params = {
+            'caption': caption,
+            'publish_type': 'SCHEDULED',
+            'scheduled_publish_time': scheduled_time
+        }
+
+        try:
+            if media_type == 'IMAGE':
+                await self.validate_media(content_url, 'IMAGE')
+                response = await self._create_media({**base_params, 'image_url': content_url})
+            elif media_type == 'VIDEO':
+                upload_type = kwargs.get('upload_type') or 'FEED'
+                await self.validate_media(content_url,
+                                          upload_type if upload_type in ('REELS', 'STORIES') else 'VIDEO')
+                params = {**base_params, 'video_url': content_url}
+                if kwargs.get('upload_type') != 'REELS':
+                    params['media_type'] = 'VIDEO'
+                if 'cover_url' in kwargs:
+                    params['cover_url'] = kwargs['cover_url']
+                if 'upload_type' in kwargs:
+                    params['upload_type'] = kwargs['upload_type']
+                response = await self._create_media(params)
+            elif media_type == 'CAROUSEL':
+                if not isinstance(content_url, list):
+                    raise ValueError("輪播貼文需要提供URL列表")
+                children_ids = await self._create_carousel_items(content_url)
+                response = await self._create_media({
+                    **base_params,
+                    'children': children_ids,
+                    'media_type': 'CAROUSEL'
+                })
+            else:
+                raise ValueError(f"不支持的媒體類型: {media_type}")
+
+            if self.debug:
+                print(f"排程貼文媒體容器已創建，creation_id: {response.get('id')}")
+                print(f"排程發布時間: {datetime.datetime.fromtimestamp(scheduled_time).strftime('%Y-%m-%d %H:%M:%S')}")
+
+            key = idempotency_key or await self.publish_key(content_url, caption, scheduled_time)
+            await self._store_call(self.ledger.record, key, SCHEDULED, ig_account_id=self.ig_account_id,
+                                    media_type=media_type, container_id=response.get('id'),
+                                    scheduled_time=scheduled_time)
+            return response
+
+        except FacebookRequestError as e:
+            raise Exception(f"排程貼文時出錯: {e}")
+
+    async def get_container_status(self, creation_id):
+        """返回媒體容器的處理狀態碼"""
+        from facebook_business.exceptions import FacebookRequestError
+
+        await self.setup()
+        try:
+            response = await self.client.call('GET', creation_id, {'fields': 'status_code'})
+            return response.get('status_code')
+        except FacebookRequestError as e:
+            raise Exception(f"獲取媒體容器狀態時出錯: {e}")
+
+    @traced('container.wait')
+    async def wait_until_ready(self, creation_id, upload_type='FEED', timeout=600):
+        """等待媒體容器處理完成，返回最終狀態碼（FINISHED 或 PUBLISHED）"""
+        await self.setup()
+        if self.debug:
+            print(f"等待媒體容器 {creation_id} 處理完成...")
+        status = await self.poller.wait(creation_id, upload_type, timeout)
+        if self.debug:
+            print(f"媒體容器 {creation_id} 狀態: {status}")
+        return status
+
+    @traced('media.publish')
+    async def publish_media(self, creation_id, idempotency_key=None, reservation=None):
+        """發布媒體容器，返回包含已發布媒體 ID 的回應
+
+        Args:
+            creation_id: 媒體容器 ID
+            idempotency_key: 在帳本中記錄此次發布的冪等鍵（可選）
+            reservation: 先前以 quota.reserve() 取得的配額預留（默認現在預留）
+        """
+        from facebook_business.exceptions import FacebookRequestError
+        from src.publish_ledger import PUBLISHING, PUBLISHED, FAILED
+        from src.publish_quota import is_quota_error
+
+        await self.setup()
+        reservation = reservation or await self._blocking_call(self.quota.reserve, self)
+        try:
+            if idempotency_key:
+                await self._store_call(self.ledger.record, idempotency_key, PUBLISHING,
+                                        container_id=creation_id)
+            response = await self.client.call('POST', f"{self.ig_account_id}/media_publish",
+                                              {'creation_id': creation_id})
+        except FacebookRequestError as e:
+            reservation.release()
+            if is_quota_error(e):
+                self.quota.exhausted(self)
+            if idempotency_key:
+                await self._store_call(self.ledger.record, idempotency_key, FAILED,
+                                        error=str(e.api_error_message() or e))
+            raise Exception(f"發布媒體時出錯: {e}")
+        except BaseException:
+            reservation.release()
+            raise
+
+        reservation.commit()
+        if idempotency_key:
+            await self._store_call(self.ledger.record, idempotency_key, PUBLISHED, media_id=response.get('id'))
+        if self.debug:
+            print(f"媒體已發布，ID: {response.get('id')}")
+        return response
+
+    async def publish_key(self, content, caption, scheduled_time=None):
+        """在此帳戶發布這些內容的冪等鍵"""
+        from src.publish_ledger import idempotency_key
+
+        await self.setup()
+        return idempotency_key(self.ig_account_id, content, caption, scheduled_time)
+
+    async def find_published_media(self, caption, since=0):
+        """按標題和發布時間在最近的媒體中查找已發布貼文的媒體 ID
+
+        媒體容器不會記錄發布後的媒體 ID，只能從帳戶的媒體中查找。只有
+        恰好一個貼文符合時返回其 ID，否則返回 None。
+        """
+        from src.insights_sync import parse_timestamp
+
+        await self.setup()
+        matches = []
+        # 容許本機與 API 之間幾分鐘的時鐘誤差
+        cutoff = since - 300
+        params = {'fields': 'id,caption,timestamp', 'limit': 50}
+        while True:
+            page = await self.client.call('GET', f"{self.ig_account_id}/media", params)
+            for item in page.get('data') or []:
+                if item.get('timestamp') and parse_timestamp(item['timestamp']) < cutoff:
+                    return matches[0] if len(matches) == 1 else None
+                if (item.get('caption') or '') == (caption or ''):
+                    matches.append(item['id'])
+            paging = page.get('paging') or {}
+            after = (paging.get('cursors') or {}).get('after')
+            if not paging.get('next') or not after:
+                return matches[0] if len(matches) == 1 else None
+            params = {**params, 'after': after}
+
+    async def published_media(self, key, caption, container_id=None):
+        """記錄已發布的內容並返回 {'id': 媒體 ID}
+
+        帳本中沒有媒體 ID 時從帳戶的媒體中查找，仍找不到時拋出
+        AlreadyPublishedError。
+        """
+        from src.publish_ledger import PUBLISHED, AlreadyPublishedError
+
+        entry = await self._store_call(self.ledger.get, key) or {}
+        container_id = container_id or entry.get('container_id')
+        media_id = entry.get('media_id') if entry.get('state') == PUBLISHED else None
+        if not media_id:
+            media_id = await self.find_published_media(caption, entry.get('container_created_at') or 0)
+        if media_id:
+            await self._store_call(self.ledger.record, key, PUBLISHED, media_id=media_id)
+            return {'id': media_id}
+        await self._store_call(self.ledger.record, key, PUBLISHED)
+        raise AlreadyPublishedError(key, container_id)
+
+    async def _resume_from_ledger(self, key, caption):
+        """查詢冪等鍵先前的嘗試，返回 (已發布的回應, 可重用的容器 ID)"""
+        from src.publish_ledger import PUBLISHED, PUBLISHING
+
+        entry = await self._store_call(self.ledger.get, key)
+        if not entry:
+            return None, None
+        if entry['state'] == PUBLISHED:
+            response = await self.published_media(key, caption)
+            if self.debug:
+                print(f"此內容已發布過（媒體 ID: {response['id']}），不會重複發布")
+            return response, None
+
+        container_id = self.ledger.reusable_container(entry)
+        if container_id and entry['state'] == PUBLISHING:
+            # 上一次發布請求的結果未知，先確認容器是否已經發布
+            if await self.get_container_status(container_id) == 'PUBLISHED':
+                print(f"媒體容器 {container_id} 已在先前的嘗試中發布，不會重複發布")
+                return await self.published_media(key, caption, container_id), None
+        if container_id and self.debug:
+            print(f"重用先前創建的媒體容器: {container_id}")
+        return None, container_id
+
+    @traced('publish')
+    async def create_and_publish(self, media_type, content, caption, idempotency_key=None, **kwargs):
+        """創建並立即發布內容，返回發布操作的回應
+
+        與 InstagramPublisher.create_and_publish 相同：進度以冪等鍵記錄在
+        發布帳本中，重複調用返回先前的結果或重用未過期的容器；同一內容
+        同時只有一個嘗試能認領發布權，其他嘗試拋出 PublishInProgressError；
+        創建容器之前先預留發布配額，配額用完時拋出 QuotaExceededError。
+        """
+        from src.publish_ledger import PUBLISHED, PublishInProgressError
+
+        key = idempotency_key or await self.publish_key(content, caption)
+        current_span().set(media_type=media_type, ig_account_id=self.ig_account_id)
+        claim = await self._store_call(self.ledger.claim, key)
+        if claim is None:
+            entry = await self._store_call(self.ledger.get, key)
+            if not entry or entry['state'] != PUBLISHED:
+                raise PublishInProgressError(key)
+        try:
+            return await self._create_and_publish(media_type, content, caption, key, **kwargs)
+        finally:
+            if claim:
+                # 不經過執行緒，被取消時也一定會釋放
+                self.ledger.release(key, claim)
+
+    async def _create_and_publish(self, media_type, content, caption, key, **kwargs):
+        from src.publish_ledger import CREATING, CREATED, FAILED
+
+        published, creation_id = await self._resume_from_ledger(key, caption)
+        if published:
+            return published
+
+        reservation = await self._blocking_call(self.quota.reserve, self)
+        creation_response = None
+        try:
+            # 創建媒體容器，先前的嘗試留下未過期的容器時直接重用
+            if creation_id:
+                creation_response = {'id': creation_id}
+            else:
+                await self._store_call(self.ledger.record, key, CREATING, ig_account_id=self.ig_account_id,
+                                        media_type=media_type)
+                if media_type == 'IMAGE':
+                    creation_response = await self.post_image(content, caption)
+                elif media_type == 'VIDEO':
+                    creation_response = await self.post_video(
+                        content, caption, kwargs.get('cover_url'), kwargs.get('upload_type', 'FEED')
+                    )
+                elif media_type == 'CAROUSEL':
+                    if not isinstance(content, list):
+                        raise ValueError("輪播貼文需要提供URL列表")
+                    creation_response = await self.post_carousel(content, caption)
+                else:
+                    raise ValueError(f"不支持的媒體類型: {media_type}")
+                creation_id = creation_response['id']
+                await self._store_call(self.ledger.record, key, CREATED, container_id=creation_id)
+
+            # 影片需要處理完成後才能發布
+            if media_type == 'VIDEO':
+                try:
+                    await self.wait_until_ready(creation_id, kwargs.get('upload_type') or 'FEED')
+                except ContainerError as e:
+                    if e.status in ('ERROR', 'EXPIRED'):
+                        # 處理失敗或過期的容器不能再使用
+                        await self._store_call(self.ledger.record, key, FAILED, container_id=None,
+                                                error=str(e))
+                    raise
+
+            return await self.publish_media(creation_id, idempotency_key=key, reservation=reservation)
+
+        except asyncio.CancelledError:
+            reservation.release()
+            raise
+        except Exception as e:
+            reservation.release()
+            if creation_response and 'id' in creation_response:
+                print(f"創建了媒體容器 {creation_response['id']}，但發布失敗: {e}")
+            else:
+                await self._store_call(self.ledger.record, key, FAILED, error=str(e))
+            raise Exception(f"創建並發布媒體時出錯: {e}")
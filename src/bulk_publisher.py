@@ -0,0 +1,410 @@
+import os
+import csv
+import json
+import time
+import hashlib
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+from src.container_poller import ContainerError
+from src.publish_ledger import (CONTAINER_TTL, CREATING, CREATED, SCHEDULED, FAILED, DONE_STATES,
+                                AlreadyPublishedError, PublishInProgressError)
+from src.publish_quota import QuotaExceededError
+
+# 配額用完時的處理方式：defer 留待下次運行，schedule 改為在下一個名額可用時排程發布
+QUOTA_ACTIONS = ('defer', 'schedule')
+
+# 排程發布時間至少在未來 10 分鐘
+MIN_SCHEDULE_DELAY = 600
+
+MEDIA_TYPES = ('IMAGE', 'VIDEO', 'CAROUSEL')
+
+
+def read_manifest(path):
+    """逐行讀取批量發布清單（JSONL 或 CSV），不會一次載入整個文件
+
+    每個項目包含以下欄位：
+        id: 項目 ID（可選，省略時以內容雜湊代替）
+        type: IMAGE, VIDEO 或 CAROUSEL
+        url / urls: 媒體 URL；CSV 中的多個 URL 以 `|` 分隔
+        caption: 貼文標題
+        scheduled_time: 排程發布的 Unix 時間戳（可選）
+        upload_type: 影片上傳類型 FEED, REELS, STORIES（可選）
+        cover_url: 影片封面 URL（可選）
+        page_id / ig_account_id: 發布目標帳戶（可選，默認為發布器的帳戶）
+        idempotency_key: 發布帳本的冪等鍵（可選，默認以帳戶、URL、標題和排程時間計算）
+
+    無效的行不會中斷整個批次：產生一個帶有 `manifest_error` 欄位的項目，
+    由 BulkPublisher 記錄為失敗後繼續處理其他項目。
+    """
+    if path.lower().endswith('.csv'):
+        with open(path, newline='', encoding='utf-8') as f:
+            reader = csv.DictReader(f)
+            for row in reader:
+                yield _read_item({k: v for k, v in row.items() if v not in (None, '')}, reader.line_num)
+    else:
+        with open(path, encoding='utf-8') as f:
+            for line_no, line in enumerate(f, start=1):
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    raw = json.loads(line)
+                except ValueError as e:
+                    yield _invalid_item({}, line_no, f"無法解析 JSON: {e}")
+                    continue
+                yield _read_item(raw, line_no)
+
+
+def _read_item(raw, line_no):
+    if not isinstance(raw, dict):
+        return _invalid_item(raw, line_no, "清單項目必須是 JSON 物件")
+    try:
+        return _normalize_item(raw)
+    except (TypeError, ValueError) as e:
+        return _invalid_item(raw, line_no, e)
+
+
+def _invalid_item(raw, line_no, error):
+    """無效的清單行，沒有 id 欄位時以行號作為項目 ID"""
+    raw = raw if isinstance(raw, dict) else {}
+    return {
+        'id': str(raw.get('id') or f"line-{line_no}"),
+        'type': str(raw.get('type', '')).upper(),
+        'manifest_error': f"清單第 {line_no} 行無效: {error}",
+    }
+
+
+def _normalize_item(raw):
+    item = dict(raw)
+    item['type'] = str(item.get('type', 'IMAGE')).upper()
+    if item['type'] not in MEDIA_TYPES:
+        raise ValueError(f"不支持的媒體類型: {item['type']}")
+
+    urls = item.pop('urls', None) or item.pop('url', None)
+    if isinstance(urls, str):
+        urls = [u.strip() for u in urls.split('|') if u.strip()]
+    if not urls:
+        raise ValueError(f"清單項目缺少 URL: {raw}")
+    item['content'] = urls if item['type'] == 'CAROUSEL' else urls[0]
+
+    item['caption'] = item.get('caption', '')
+    if item.get('scheduled_time'):
+        item['scheduled_time'] = int(item['scheduled_time'])
+
+    if not item.get('id'):
+        digest = json.dumps([item['type'], item['content'], item['caption'],
+                             item.get('scheduled_time')], sort_keys=True)
+        item['id'] = hashlib.sha1(digest.encode('utf-8')).hexdigest()
+    item['id'] = str(item['id'])
+    return item
+
+
+class Checkpoint:
+    """只追加的進度文件，記錄每個項目已完成的階段
+
+    每行一個 JSON 記錄：`created` 保存容器 ID，`published`/`scheduled` 表示完成。
+    中斷後重新運行時，已完成的項目會被跳過，已創建容器的項目直接從發布步驟繼續。
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._state = {}
+        if os.path.exists(path):
+            with open(path, encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        # 最後一行可能在中斷時只寫了一半
+                        continue
+                    self._state.setdefault(record['id'], {}).update(record)
+        self._file = open(path, 'a', encoding='utf-8')
+
+    def get(self, item_id):
+        return self._state.get(item_id, {})
+
+    def is_done(self, item_id):
+        return self.get(item_id).get('stage') in ('published', 'scheduled')
+
+    def record(self, item_id, stage, **fields):
+        record = {'id': item_id, 'stage': stage, 'at': int(time.time()), **fields}
+        with self._lock:
+            self._state.setdefault(item_id, {}).update(record)
+            self._file.write(json.dumps(record, ensure_ascii=False) + '\n')
+            self._file.flush()
+            os.fsync(self._file.fileno())
+
+    def close(self):
+        self._file.close()
+
+
+class BulkPublisher:
+    """以工作執行緒池批量發布清單中的貼文
+
+    每個項目經過 創建容器 → 等待處理完成 → 發布 三個步驟。等待階段由發布器的
+    容器輪詢器統一處理，不佔用工作執行緒；容器就緒後才把發布步驟交回執行緒池。
+    結果會在完成時立即寫入結果文件。
+
+    每個步驟同時記錄在發布器的帳本中，因此即使換了清單或檢查點文件，
+    已經發布過的相同內容也會被跳過，而不會重複發文。
+
+    創建容器前先預留帳戶的發布配額。配額用完的項目不會發出任何請求，
+    而是按帳戶依次安排到之後釋放的名額：結果中記錄為 `deferred` 並附上
+    `not_before`（下次運行時重新處理），或直接改為在該時間排程發布。
+    """
+
+    def __init__(self, publisher, workers=4, results_path=None, checkpoint_path=None,
+                 ready_timeout=600, max_pending=None, registry=None, on_quota='defer'):
+        """初始化批量發布器
+
+        Args:
+            publisher: 已初始化的 InstagramPublisher
+            workers: 同時執行 API 請求的執行緒數量
+            results_path: 逐項結果的 JSONL 文件路徑
+            checkpoint_path: 進度文件路徑
+            ready_timeout: 等待容器處理完成的最長秒數
+            max_pending: 同時處理中（含等待容器就緒）的最大項目數，默認為 workers * 10
+            registry: PublisherRegistry，用於發布到項目指定的其他帳戶（可選）
+            on_quota: 配額用完時的處理方式，defer 或 schedule
+        """
+        if on_quota not in QUOTA_ACTIONS:
+            raise ValueError(f"不支持的配額處理方式: {on_quota}")
+        self.publisher = publisher
+        self.workers = max(1, workers)
+        self.results_path = results_path
+        self.checkpoint_path = checkpoint_path
+        self.ready_timeout = ready_timeout
+        self.max_pending = max_pending or self.workers * 10
+        self.registry = registry
+        self.on_quota = on_quota
+        self._results_lock = threading.Lock()
+        self._deferred = {}
+        self._deferred_lock = threading.Lock()
+
+    def run(self, items):
+        """處理所有項目
+
+        Args:
+            items: 清單項目的可迭代對象（例如 read_manifest() 的結果）
+
+        Returns:
+            統計字典，包含 published, scheduled, deferred, skipped, failed 的數量
+        """
+        summary = {'published': 0, 'scheduled': 0, 'deferred': 0, 'skipped': 0, 'failed': 0}
+        checkpoint = Checkpoint(self.checkpoint_path)
+        results_file = open(self.results_path, 'a', encoding='utf-8')
+
+        try:
+            with ThreadPoolExecutor(max_workers=self.workers) as executor:
+                in_flight = set()
+                for item in items:
+                    if item.get('manifest_error'):
+                        self._write_result(results_file, {'id': item['id'], 'type': item['type'],
+                                                          'status': 'failed', 'error': item['manifest_error'],
+                                                          'elapsed': 0})
+                        summary['failed'] += 1
+                        continue
+                    if checkpoint.is_done(item['id']):
+                        summary['skipped'] += 1
+                        continue
+
+                    # 限制處理中的項目數量，使記憶體用量不隨清單大小增長
+                    if len(in_flight) >= self.max_pending:
+                        done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                        self._collect(done, summary)
+
+                    in_flight.add(self._start(executor, item, checkpoint, results_file))
+
+                self._collect(wait(in_flight).done, summary)
+        finally:
+            results_file.close()
+            checkpoint.close()
+
+        return summary
+
+    @staticmethod
+    def _collect(futures, summary):
+        for future in futures:
+            summary[future.result()] += 1
+
+    def _start(self, executor, item, checkpoint, results_file):
+        """開始處理一個項目，返回結果為最終狀態的 Future"""
+        outcome = Future()
+        started = time.time()
+        result = {'id': item['id'], 'type': item['type']}
+
+        def finish(status, error=None):
+            if claim is not None:
+                claim[0].ledger.release(ledger_key, claim[1])
+            result['status'] = status
+            if error is not None:
+                result['error'] = str(error)
+            result['elapsed'] = round(time.time() - started, 3)
+            self._write_result(results_file, result)
+            outcome.set_result(status)
+
+        ledger_key = None
+        reservation = None
+        claim = None
+
+        def publish(ready):
+            try:
+                publisher = self._publisher_for(item)
+                if ready.result() == 'PUBLISHED':
+                    # 上一次運行已發出發布請求且已成功
+                    try:
+                        response = publisher.published_media(ledger_key, item['caption'], result['creation_id'])
+                    except AlreadyPublishedError as e:
+                        checkpoint.record(item['id'], 'published', creation_id=result['creation_id'])
+                        finish('skipped', e)
+                        return
+                else:
+                    response = publisher.publish_media(result['creation_id'], idempotency_key=ledger_key,
+                                                       reservation=reservation)
+                result['media_id'] = response.get('id')
+                checkpoint.record(item['id'], 'published', creation_id=result['creation_id'],
+                                  media_id=result['media_id'])
+            except ContainerError as e:
+                if e.status in ('ERROR', 'EXPIRED'):
+                    # 容器已失效，下次運行必須重新創建而不是繼續使用它
+                    publisher.ledger.record(ledger_key, FAILED, container_id=None, error=str(e))
+                    checkpoint.record(item['id'], 'failed', creation_id=None)
+                finish('failed', e)
+                return
+            except Exception as e:
+                finish('failed', e)
+                return
+            finally:
+                if reservation is not None:
+                    reservation.release()
+            finish('published')
+
+        def create():
+            nonlocal ledger_key, reservation, claim
+            publisher = None
+            try:
+                publisher = self._publisher_for(item)
+                ledger_key = item.get('idempotency_key') or publisher.publish_key(
+                    item['content'], item['caption'], item.get('scheduled_time')
+                )
+                # 同時處理相同內容的其他嘗試（其他進程或清單中的重複項目）不能同時發布
+                token = publisher.ledger.claim(ledger_key)
+                if token:
+                    claim = (publisher, token)
+                entry = publisher.ledger.get(ledger_key)
+                if entry and entry['state'] in DONE_STATES:
+                    # 相同內容已經發布（或排程）過
+                    result['creation_id'] = entry.get('container_id')
+                    fields = {'creation_id': result['creation_id']}
+                    if entry.get('media_id'):
+                        result['media_id'] = fields['media_id'] = entry['media_id']
+                    checkpoint.record(item['id'], entry['state'], **fields)
+                    finish('skipped')
+                    return
+                if claim is None:
+                    raise PublishInProgressError(ledger_key)
+
+                scheduled_time = item.get('scheduled_time')
+                try:
+                    if scheduled_time:
+                        publisher.quota.check_scheduled(publisher, scheduled_time)
+                    else:
+                        reservation = publisher.quota.reserve(publisher)
+                except QuotaExceededError as e:
+                    not_before = e.retry_at if scheduled_time else self._next_slot(publisher)
+                    if self.on_quota == 'defer' or scheduled_time:
+                        result['not_before'] = not_before
+                        finish('deferred', e)
+                        return
+                    # 改為在下一個名額可用時排程發布
+                    scheduled_time = max(not_before, int(time.time()) + MIN_SCHEDULE_DELAY)
+                    result['scheduled_time'] = scheduled_time
+
+                state = checkpoint.get(item['id'])
+                creation_id = state.get('creation_id')
+                created_at = state.get('at', 0)
+                if creation_id and created_at + CONTAINER_TTL <= time.time():
+                    creation_id = None
+                if not creation_id:
+                    creation_id = publisher.ledger.reusable_container(entry)
+                    created_at = entry and entry['container_created_at']
+
+                if not creation_id:
+                    publisher.ledger.record(ledger_key, CREATING, ig_account_id=publisher.ig_account_id,
+                                            media_type=item['type'])
+                    creation_id = self._create_container(item, scheduled_time, ledger_key)
+                    created_at = int(time.time())
+                    checkpoint.record(item['id'], 'created', creation_id=creation_id)
+                if not entry or entry.get('container_id') != creation_id:
+                    publisher.ledger.record(ledger_key, CREATED, ig_account_id=publisher.ig_account_id,
+                                            media_type=item['type'], container_id=creation_id,
+                                            container_created_at=created_at)
+                result['creation_id'] = creation_id
+
+                if scheduled_time:
+                    publisher.ledger.record(ledger_key, SCHEDULED, container_id=creation_id,
+                                            scheduled_time=scheduled_time)
+                    checkpoint.record(item['id'], 'scheduled', creation_id=creation_id)
+                    finish('scheduled')
+                    return
+
+                upload_type = (item.get('upload_type') or 'FEED') if item['type'] == 'VIDEO' else item['type']
+                publisher.watch_container(
+                    creation_id, upload_type, self.ready_timeout,
+                    callback=lambda ready: executor.submit(publish, ready)
+                )
+            except Exception as e:
+                if reservation is not None:
+                    reservation.release()
+                if claim is not None:
+                    publisher.ledger.record(ledger_key, FAILED, error=str(e))
+                finish('failed', e)
+
+        executor.submit(create)
+        return outcome
+
+    def _publisher_for(self, item):
+        """返回項目目標帳戶的發布器"""
+        if self.registry is not None:
+            if item.get('page_id'):
+                return self.registry.get(str(item['page_id']))
+            if item.get('ig_account_id'):
+                return self.registry.for_instagram_account(str(item['ig_account_id']))
+        elif item.get('page_id') or item.get('ig_account_id'):
+            raise ValueError("清單項目指定了目標帳戶，但沒有提供 PublisherRegistry")
+        return self.publisher
+
+    def _next_slot(self, publisher):
+        """為帳戶下一個配額用完的項目安排可發布的時間（依次排入之後釋放的名額）"""
+        with self._deferred_lock:
+            position = self._deferred.get(publisher.ig_account_id, 0)
+            self._deferred[publisher.ig_account_id] = position + 1
+        return publisher.quota.plan(publisher, 1, offset=position)[0]
+
+    def _create_container(self, item, scheduled_time=None, ledger_key=None):
+        publisher = self._publisher_for(item)
+        media_type = item['type']
+        kwargs = {}
+        if item.get('cover_url'):
+            kwargs['cover_url'] = item['cover_url']
+        if item.get('upload_type'):
+            kwargs['upload_type'] = item['upload_type']
+
+        if scheduled_time:
+            response = publisher.schedule_post(media_type, item['content'], item['caption'],
+                                               scheduled_time, idempotency_key=ledger_key, **kwargs)
+        elif media_type == 'IMAGE':
+            response = publisher.post_image(item['content'], item['caption'])
+        elif media_type == 'VIDEO':
+            response = publisher.post_video(item['content'], item['caption'],
+                                            kwargs.get('cover_url'), kwargs.get('upload_type', 'FEED'))
+        else:
+            response = publisher.post_carousel(item['content'], item['caption'])
+        return response['id']
+
+    def _write_result(self, results_file, result):
+        with self._results_lock:
+            results_file.write(json.dumps(result, ensure_ascii=False) + '\n')
+            results_file.flush()
@@ -0,0 +1,210 @@
+import time
+import heapq
+import threading
+from concurrent.futures import Future
+
+SUCCESS_STATUSES = ('FINISHED', 'PUBLISHED')
+FAILURE_STATUSES = ('ERROR', 'EXPIRED')
+
+# 每種上傳類型的輪詢退避設定: (首次檢查延遲, 倍數, 最大間隔) 秒
+BACKOFF = {
+    'IMAGE': (0, 1.5, 5),
+    'CAROUSEL': (0, 1.5, 5),
+    'FEED': (5, 1.5, 30),
+    'VIDEO': (5, 1.5, 30),
+    'REELS': (5, 1.5, 30),
+    'STORIES': (3, 1.5, 20),
+}
+
+# 單次多 ID 查詢最多包含的容器數量
+MAX_IDS_PER_REQUEST = 50
+
+
+class ContainerError(Exception):
+    """媒體容器處理失敗、過期或等待逾時"""
+
+    def __init__(self, message, creation_id, status=None):
+        super().__init__(message)
+        self.creation_id = creation_id
+        self.status = status
+
+
+class ContainerPoller:
+    """以單一背景執行緒同時追蹤多個媒體容器的處理狀態
+
+    到期需要檢查的容器會合併為 `?ids=a,b,c&fields=status_code` 查詢，
+    每個請求最多 50 個 ID。每個容器按其上傳類型的退避設定重新排程，
+    直到狀態變為 FINISHED/PUBLISHED（結果）或 ERROR/EXPIRED（異常）。
+    """
+
+    def __init__(self, api, timeout=600, coalesce=1.0, idle_timeout=30):
+        """初始化輪詢器
+
+        Args:
+            api: 用於查詢的 FacebookAdsApi 實例
+            timeout: 每個容器的默認最長等待秒數
+            coalesce: 將此秒數內即將到期的檢查合併到同一請求
+            idle_timeout: 沒有追蹤任何容器時，背景執行緒在此秒數後退出
+        """
+        self.api = api
+        self.timeout = timeout
+        self.coalesce = coalesce
+        self.idle_timeout = idle_timeout
+        self._condition = threading.Condition()
+        self._heap = []
+        self._watches = {}
+        self._thread = None
+        self._closed = False
+
+    def watch(self, creation_id, upload_type='FEED', timeout=None, callback=None):
+        """開始追蹤一個容器
+
+        Args:
+            creation_id: 媒體容器 ID
+            upload_type: IMAGE, CAROUSEL, FEED, VIDEO, REELS 或 STORIES
+            timeout: 最長等待秒數，默認使用輪詢器的設定
+            callback: 完成時以 Future 為參數調用的函數（可選）
+
+        Returns:
+            完成時結果為最終狀態碼的 Future
+        """
+        initial, factor, max_delay = BACKOFF.get(upload_type, BACKOFF['FEED'])
+        now = time.monotonic()
+
+        with self._condition:
+            if self._closed:
+                raise RuntimeError("輪詢器已關閉")
+            watch = self._watches.get(creation_id)
+            if watch is None:
+                watch = {
+                    'future': Future(),
+                    'delay': initial or 1,
+                    'factor': factor,
+                    'max_delay': max_delay,
+                    'deadline': now + (timeout or self.timeout),
+                    'status': None,
+                }
+                self._watches[creation_id] = watch
+                heapq.heappush(self._heap, (now + initial, creation_id))
+                self._ensure_thread()
+                self._condition.notify()
+
+        if callback:
+            watch['future'].add_done_callback(callback)
+        return watch['future']
+
+    def wait(self, creation_id, upload_type='FEED', timeout=None):
+        """阻塞等待容器處理完成並返回最終狀態碼"""
+        return self.watch(creation_id, upload_type, timeout).result()
+
+    def pending(self):
+        """目前正在追蹤的容器數量"""
+        with self._condition:
+            return len(self._watches)
+
+    def close(self):
+        """停止背景執行緒，未完成的容器以 ContainerError 結束"""
+        with self._condition:
+            self._closed = True
+            watches, self._watches, self._heap = self._watches, {}, []
+            self._condition.notify()
+        for creation_id, watch in watches.items():
+            watch['future'].set_exception(ContainerError("輪詢器已關閉", creation_id, watch['status']))
+
+    def _ensure_thread(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._run, name='container-poller', daemon=True)
+            self._thread.start()
+
+    def _next_due(self):
+        """等待並取出所有已到期（含合併窗口內）的容器 ID"""
+        with self._condition:
+            while not self._closed:
+                if not self._heap:
+                    # 閒置時讓執行緒退出，下一次 watch() 會重新啟動
+                    if not self._condition.wait(self.idle_timeout) and not self._heap:
+                        self._thread = None
+                        return None
+                    continue
+                delay = self._heap[0][0] - time.monotonic()
+                if delay > 0:
+                    self._condition.wait(delay)
+                    continue
+
+                horizon = time.monotonic() + self.coalesce
+                due = []
+                while self._heap and self._heap[0][0] <= horizon and len(due) < MAX_IDS_PER_REQUEST:
+                    _, creation_id = heapq.heappop(self._heap)
+                    if creation_id in self._watches and creation_id not in due:
+                        due.append(creation_id)
+                if due:
+                    return due
+            return None
+
+    def _run(self):
+        while True:
+            due = self._next_due()
+            if due is None:
+                return
+            for creation_id, result in self._fetch(due).items():
+                self._handle(creation_id, result)
+
+    def _fetch(self, creation_ids):
+        """查詢多個容器的狀態，返回 {creation_id: 狀態字典或異常}"""
+        from facebook_business.exceptions import FacebookRequestError
+
+        try:
+            response = self.api.call(
+                'GET', (), params={'ids': ','.join(creation_ids), 'fields': 'status_code,status'}
+            )
+            data = response.json()
+            return {cid: data.get(cid, {}) for cid in creation_ids}
+        except FacebookRequestError as e:
+            if len(creation_ids) == 1:
+                return {creation_ids[0]: e}
+        except Exception as e:
+            return {cid: e for cid in creation_ids}
+
+        # 多 ID 查詢中只要有一個 ID 無效整個請求就會失敗，改為逐一查詢
+        results = {}
+        for creation_id in creation_ids:
+            results.update(self._fetch([creation_id]))
+        return results
+
+    def _handle(self, creation_id, result):
+        with self._condition:
+            watch = self._watches.get(creation_id)
+            if watch is None:
+                return
+
+            now = time.monotonic()
+            error = None
+            status = None
+            if isinstance(result, Exception):
+                error = ContainerError(f"獲取媒體容器狀態時出錯: {result}", creation_id)
+            else:
+                status = result.get('status_code')
+                watch['status'] = status
+                if status in FAILURE_STATUSES:
+                    detail = f" ({result['status']})" if result.get('status') else ""
+                    error = ContainerError(
+                        f"媒體容器 {creation_id} 處理失敗，狀態: {status}{detail}", creation_id, status
+                    )
+                elif status not in SUCCESS_STATUSES and now >= watch['deadline']:
+                    error = ContainerError(
+                        f"等待媒體容器 {creation_id} 處理完成逾時，目前狀態: {status}", creation_id, status
+                    )
+
+            if error is None and status not in SUCCESS_STATUSES:
+                # 仍在處理中，按退避設定重新排程
+                delay = min(watch['delay'], watch['max_delay'], max(0.0, watch['deadline'] - now))
+                heapq.heappush(self._heap, (now + delay, creation_id))
+                watch['delay'] = min(watch['delay'] * watch['factor'], watch['max_delay'])
+                return
+
+            del self._watches[creation_id]
+
+        if error is not None:
+            watch['future'].set_exception(error)
+        else:
+            watch['future'].set_result(status)
@@ -0,0 +1,25 @@
+from typing import Dict, List
+
+
+class CarouselItemError(Exception):
+    """Raised when one or more carousel children could not be created
+    
+    Attributes:
+        created_ids: Creation IDs of the children that were created, in input order
+        failed: Mapping of input index to the error raised for that item
+    """
+    
+    def __init__(self, message: str, created_ids: List[str], failed: Dict[int, Exception]):
+        super().__init__(message)
+        self.created_ids = created_ids
+        self.failed = failed
+
+
+def carousel_error(children_ids: List, failed: Dict[int, Exception]) -> CarouselItemError:
+    """Build the CarouselItemError for a partially created carousel"""
+    created_ids = [child_id for child_id in children_ids if child_id]
+    first_index = min(failed)
+    message = f"創建輪播項目時出錯 (第 {first_index + 1} 項): {failed[first_index]}"
+    if created_ids:
+        message += f"；已創建但未使用的輪播項目: {', '.join(created_ids)}"
+    return CarouselItemError(message, created_ids, failed)
@@ -0,0 +1,526 @@
+import re
+import json
+import time
+import datetime
+import random
+import threading
+from collections import Counter, deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qsl
+
+_VERSION_PREFIX = re.compile(r'^v\d+\.\d+/?')
+_RESULT_REF = re.compile(r'\{result=([^:}]+):\$\.([^}]+)\}')
+_EDGE_FIELD = re.compile(r'(owned_pages|client_pages|owned_ad_accounts|client_ad_accounts)(?:\.limit\((\d+)\))?')
+_AD_ACCOUNT = re.compile(r'^act_\d+$')
+
+# 假伺服器使用的 ID 起點（與真實 ID 一樣是數字字串）
+PAGE_ID_BASE = 1000
+BUSINESS_ID = '5000'
+IG_ACCOUNT_ID_BASE = 17841400000000000
+CONTAINER_ID_BASE = 18000000000000000
+MEDIA_ID_BASE = 17900000000000000
+AD_ACCOUNT_ID_BASE = 6000
+REPORT_RUN_ID_BASE = 19000000000000000
+
+MEDIA_TYPES = {'.jpg': 'image/jpeg', '.jpeg': 'image/jpeg', '.mp4': 'video/mp4', '.mov': 'video/quicktime'}
+
+
+class GraphError(Exception):
+    """假伺服器返回的 Graph API 錯誤"""
+
+    def __init__(self, status, code, message, subcode=None, transient=False):
+        super().__init__(message)
+        self.status = status
+        self.body = {'error': {
+            'message': message,
+            'type': 'OAuthException',
+            'code': code,
+            'is_transient': transient,
+            'fbtrace_id': 'fake',
+        }}
+        if subcode:
+            self.body['error']['error_subcode'] = subcode
+
+
+class FakeGraphServer:
+    """在本進程內運行的 Graph API 替身伺服器，用於離線測試和基準測試
+
+    實現發布流程用到的端點：`oauth/access_token`、`debug_token`、
+    `me/accounts`、頁面和 Instagram 帳戶欄位、`{ig-user}/media`（創建容器
+    和列出媒體）、`media_publish`、`content_publishing_limit`、容器狀態
+    （包括 `?ids=` 多 ID 查詢）以及批次請求。每個回應都帶有按請求量計算
+    的 `X-App-Usage` 標頭，並可設定延遲、暫時性錯誤比例和速率限制。
+    `/media/<名稱>.jpg|.mp4` 返回假的媒體文件標頭，供媒體預檢使用。
+    商業帳戶 `BUSINESS_ID` 的 `owned_pages`、`client_pages` 和
+    `owned_ad_accounts` 邊支援游標翻頁和欄位展開。廣告帳戶支援非同步
+    洞察報告：`POST act_<id>/insights` 創建報告任務，任務在
+    `report_processing` 秒後完成，之後可以從 `<report_run_id>/insights`
+    翻頁讀取每個廣告每天一行的結果。
+
+    將 `GRAPH_API_URL` 環境變量設為 `server.url`（在導入發布器模組之前）
+    即可讓所有 Graph API 請求發送到此伺服器。
+    """
+
+    def __init__(self, pages=1, latency=0.0, jitter=0.0, error_rate=0.0, rate_limit=None,
+                 usage_window=60.0, video_processing=1.0, quota_total=100, seed=None, client_pages=0,
+                 ad_accounts=0, ads_per_account=10, report_processing=2.0, report_failure_rate=0.0):
+        """初始化假伺服器
+
+        Args:
+            pages: 頁面數量（每個頁面關聯一個 Instagram 帳戶）
+            latency: 每個請求的基本延遲秒數（批次請求只計一次）
+            jitter: 額外隨機延遲的上限秒數
+            error_rate: 返回暫時性錯誤（HTTP 500，代碼 2）的請求比例
+            rate_limit: `usage_window` 秒內允許的請求數，超過時返回限流錯誤（代碼 4）；
+                None 表示不限制，但仍按 1000 次計算用量標頭
+            usage_window: 計算用量的滑動窗口秒數
+            video_processing: 影片容器從創建到處理完成的秒數
+            quota_total: 每個帳戶 24 小時內可發布的貼文數
+            seed: 隨機數種子（使錯誤注入可重現）
+            client_pages: 商業帳戶代管的客戶頁面數量（另外 `pages` 個是自有頁面）
+            ad_accounts: 商業帳戶擁有的廣告帳戶數量
+            ads_per_account: 每個廣告帳戶的廣告數量（報告中每個廣告每天一行）
+            report_processing: 洞察報告任務從創建到完成的秒數
+            report_failure_rate: 報告任務以 Job Failed 結束的比例
+        """
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.rate_limit = rate_limit
+        self.usage_window = usage_window
+        self.video_processing = video_processing
+        self.quota_total = quota_total
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._requests = deque()
+        self._counts = Counter()
+        self._next_id = 0
+        self.pages = {}
+        self.accounts = {}
+        for index in range(pages + client_pages):
+            page_id = str(PAGE_ID_BASE + index)
+            ig_account_id = str(IG_ACCOUNT_ID_BASE + index)
+            self.pages[page_id] = {'id': page_id, 'name': f"Fake Page {index + 1}",
+                                   'access_token': f"fake-page-token-{page_id}",
+                                   'instagram_business_account_id': ig_account_id,
+                                   'edge': 'owned_pages' if index < pages else 'client_pages'}
+            self.accounts[ig_account_id] = {'id': ig_account_id, 'username': f"fake_account_{index + 1}",
+                                            'name': f"Fake Account {index + 1}", 'biography': '',
+                                            'followers_count': 0, 'published': []}
+        self.ad_accounts = [f"act_{AD_ACCOUNT_ID_BASE + index}" for index in range(ad_accounts)]
+        self.ads_per_account = ads_per_account
+        self.report_processing = report_processing
+        self.report_failure_rate = report_failure_rate
+        self.reports = {}
+        self.containers = {}
+        self.media = {}
+        self._server = None
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    @property
+    def page_ids(self):
+        return list(self.pages)
+
+    def media_url(self, name):
+        """返回假媒體文件的 URL，例如 media_url('a.jpg')"""
+        return f"{self.url}/media/{name}"
+
+    def start(self):
+        """在背景執行緒中啟動伺服器（監聽 127.0.0.1 的隨機端口）"""
+        server = self
+
+        class Handler(_Handler):
+            fake = server
+
+        self._server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self._server.daemon_threads = True
+        self._server.request_queue_size = 1024
+        self._thread = threading.Thread(target=self._server.serve_forever, name='fake-graph', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc, tb):
+        self.stop()
+
+    def stats(self):
+        """返回 {端點: 請求次數}（批次中的操作分別計算）"""
+        with self._lock:
+            return dict(self._counts)
+
+    def _new_id(self, base):
+        with self._lock:
+            self._next_id += 1
+            return str(base + self._next_id)
+
+    def _admit(self):
+        """記錄一個請求並返回目前用量百分比；超過速率限制時拋出限流錯誤"""
+        now = time.monotonic()
+        with self._lock:
+            while self._requests and self._requests[0] <= now - self.usage_window:
+                self._requests.popleft()
+            limit = self.rate_limit or 1000
+            if self.rate_limit and len(self._requests) >= limit:
+                raise GraphError(400, 4, "(#4) Application request limit reached", transient=True)
+            self._requests.append(now)
+            usage = min(100, int(len(self._requests) * 100 / limit))
+        if self.error_rate and self._random.random() < self.error_rate:
+            raise GraphError(500, 2, "An unexpected error has occurred. Please retry your request later.",
+                             transient=True)
+        return usage
+
+    def _delay(self):
+        delay = self.latency + (self._random.uniform(0, self.jitter) if self.jitter else 0)
+        if delay > 0:
+            time.sleep(delay)
+
+    def handle(self, method, path, params):
+        """處理一個 Graph API 請求，返回 (HTTP 狀態, 回應內容)"""
+        path = _VERSION_PREFIX.sub('', path.strip('/'))
+        parts = [part for part in path.split('/') if part]
+        endpoint = '/'.join('{id}' if part.isdigit() else '{act}' if _AD_ACCOUNT.match(part) else part
+                            for part in parts) or '/'
+        with self._lock:
+            self._counts[f"{method} {endpoint}"] += 1
+        try:
+            return 200, self._route(method, parts, params)
+        except GraphError as e:
+            return e.status, e.body
+
+    def _route(self, method, parts, params):
+        if not parts:
+            if method == 'POST' and 'batch' in params:
+                return self._batch(json.loads(params['batch']))
+            if method == 'GET' and params.get('ids'):
+                return {node_id: self._node(node_id) for node_id in params['ids'].split(',')}
+        elif parts == ['oauth', 'access_token']:
+            return {'access_token': f"fake-token-{self._new_id(0)}", 'token_type': 'bearer',
+                    'expires_in': 60 * 86400}
+        elif parts == ['debug_token']:
+            return {'data': {'is_valid': True, 'expires_at': int(time.time()) + 60 * 86400}}
+        elif parts == ['me']:
+            return {'id': 'fake-user', 'name': 'Fake User'}
+        elif parts == ['me', 'accounts']:
+            return {'data': [self._page(page_id) for page_id in self.pages]}
+        elif parts[0] == BUSINESS_ID and method == 'GET':
+            return self._business(parts[1:], params)
+        elif len(parts) == 1 and method == 'GET':
+            return self._node(parts[0])
+        elif parts[1:] == ['insights'] and parts[0] in self.ad_accounts and method == 'POST':
+            return self._create_report(parts[0], params)
+        elif parts[1:] == ['insights'] and parts[0] in self.reports and method == 'GET':
+            return self._report_rows(self.reports[parts[0]], int(params.get('limit') or 25),
+                                     int(params.get('after') or 0))
+        elif len(parts) == 2 and parts[0] in self.accounts:
+            return self._account_edge(method, parts[0], parts[1], params)
+        elif len(parts) == 2 and parts[1] == 'insights' and parts[0] in self.media:
+            metrics = (params.get('metric') or '').split(',')
+            return {'data': [{'name': name, 'period': 'lifetime', 'values': [{'value': 0}]}
+                             for name in metrics if name]}
+        raise GraphError(400, 100, f"Unsupported {method} request to /{'/'.join(parts)}")
+
+    def _page(self, page_id):
+        page = self.pages[page_id]
+        account = self.accounts[page['instagram_business_account_id']]
+        return {'id': page_id, 'name': page['name'], 'access_token': page['access_token'],
+                'instagram_business_account': {key: account[key] for key in
+                                               ('id', 'username', 'biography', 'followers_count')}}
+
+    def _business(self, edge, params):
+        """商業帳戶節點（欄位展開）或其頁面邊"""
+        if not edge:
+            result = {'id': BUSINESS_ID}
+            for match in _EDGE_FIELD.finditer(params.get('fields') or ''):
+                result[match.group(1)] = _paged(self._business_edge(match.group(1)), int(match.group(2) or 25), 0)
+            return result
+        if edge[0] not in ('owned_pages', 'client_pages', 'owned_ad_accounts', 'client_ad_accounts'):
+            raise GraphError(400, 100, f"Unsupported get request to /{BUSINESS_ID}/{edge[0]}")
+        return _paged(self._business_edge(edge[0]), int(params.get('limit') or 25), int(params.get('after') or 0))
+
+    def _business_edge(self, edge):
+        """返回商業帳戶一個邊的所有項目"""
+        if edge == 'owned_ad_accounts':
+            return [{'id': account_id, 'account_id': account_id[len('act_'):], 'name': f"Fake Ad Account {index + 1}",
+                     'account_status': 1, 'currency': 'USD', 'timezone_name': 'UTC'}
+                    for index, account_id in enumerate(self.ad_accounts)]
+        if edge == 'client_ad_accounts':
+            return []
+
+        items = []
+        for page_id, page in self.pages.items():
+            if page['edge'] != edge:
+                continue
+            account = self.accounts[page['instagram_business_account_id']]
+            items.append({'id': page_id, 'name': page['name'], 'username': f"fakepage{page_id}",
+                          'category': 'Brand', 'fan_count': int(page_id) * 10,
+                          'verification_status': 'not_verified',
+                          'link': f"https://www.facebook.com/{page_id}",
+                          'instagram_business_account': {'id': account['id'], 'username': account['username']}})
+        return items
+
+    def _create_report(self, account_id, params):
+        time_range = json.loads(params.get('time_range') or '{}')
+        try:
+            since = datetime.date.fromisoformat(time_range['since'])
+            until = datetime.date.fromisoformat(time_range['until'])
+        except (KeyError, ValueError):
+            raise GraphError(400, 100, "Invalid parameter: time_range")
+        report_run_id = self._new_id(REPORT_RUN_ID_BASE)
+        with self._lock:
+            failed = bool(self.report_failure_rate) and self._random.random() < self.report_failure_rate
+            self.reports[report_run_id] = {'id': report_run_id, 'account_id': account_id, 'since': since,
+                                           'days': (until - since).days + 1, 'failed': failed,
+                                           'created_at': time.monotonic()}
+        return {'report_run_id': report_run_id}
+
+    def _report_status(self, report):
+        progress = (time.monotonic() - report['created_at']) / self.report_processing if self.report_processing else 1
+        if progress < 1:
+            return {'id': report['id'], 'async_status': 'Job Running',
+                    'async_percent_completion': int(progress * 100)}
+        status = 'Job Failed' if report['failed'] else 'Job Completed'
+        return {'id': report['id'], 'async_status': status, 'async_percent_completion': 100}
+
+    def _report_rows(self, report, limit, start):
+        if self._report_status(report)['async_status'] != 'Job Completed':
+            raise GraphError(400, 100, "Report is not ready")
+        total = report['days'] * self.ads_per_account
+        data = []
+        for index in range(start, min(start + limit, total)):
+            day = (report['since'] + datetime.timedelta(days=index // self.ads_per_account)).isoformat()
+            ad = index % self.ads_per_account + 1
+            account = report['account_id'][len('act_'):]
+            data.append({'account_id': account, 'campaign_id': f"{account}1", 'campaign_name': 'Fake Campaign',
+                         'adset_id': f"{account}2", 'adset_name': 'Fake Ad Set',
+                         'ad_id': f"{account}3{ad:04d}", 'ad_name': f"Fake Ad {ad}",
+                         'date_start': day, 'date_stop': day, 'impressions': str(1000 * ad), 'reach': str(800 * ad),
+                         'frequency': '1.25', 'clicks': str(10 * ad), 'spend': f"{ad * 1.5:.2f}", 'cpm': '1.5',
+                         'ctr': '1', 'actions': [{'action_type': 'link_click', 'value': str(10 * ad)}]})
+        result = {'data': data}
+        if start + limit < total:
+            result['paging'] = {'cursors': {'after': str(start + limit)}, 'next': 'fake'}
+        return result
+
+    def _node(self, node_id):
+        if node_id in self.pages:
+            return self._page(node_id)
+        if node_id in self.accounts:
+            account = self.accounts[node_id]
+            return {**{key: value for key, value in account.items() if key != 'published'},
+                    'media_count': len(account['published'])}
+        if node_id in self.containers:
+            status = self._container_status(self.containers[node_id])
+            return {'id': node_id, 'status_code': status, 'status': status}
+        if node_id in self.media:
+            return self.media[node_id]
+        if node_id in self.reports:
+            return self._report_status(self.reports[node_id])
+        raise GraphError(400, 100, f"Unsupported get request. Object with ID '{node_id}' does not exist")
+
+    def _container_status(self, container):
+        if container['media_id']:
+            return 'PUBLISHED'
+        if time.monotonic() < container['ready_at']:
+            return 'IN_PROGRESS'
+        return 'FINISHED'
+
+    def _account_edge(self, method, ig_account_id, edge, params):
+        account = self.accounts[ig_account_id]
+        if edge == 'media' and method == 'POST':
+            return self._create_container(ig_account_id, params)
+        if edge == 'media' and method == 'GET':
+            limit = int(params.get('limit') or 25)
+            start = int(params.get('after') or 0)
+            ids = list(reversed(account['published']))[start:start + limit]
+            result = {'data': [self.media[media_id] for media_id in ids]}
+            if start + limit < len(account['published']):
+                result['paging'] = {'cursors': {'after': str(start + limit)}, 'next': 'fake'}
+            return result
+        if edge == 'media_publish' and method == 'POST':
+            return self._publish(ig_account_id, params.get('creation_id'))
+        if edge == 'content_publishing_limit':
+            return {'data': [{'config': {'quota_total': self.quota_total, 'quota_duration': 86400},
+                              'quota_usage': self._quota_usage(account)}]}
+        raise GraphError(400, 100, f"Unsupported {method} request to /{ig_account_id}/{edge}")
+
+    @staticmethod
+    def _quota_usage(account):
+        since = time.time() - 86400
+        return sum(1 for published_at in account.get('published_at', []) if published_at > since)
+
+    def _create_container(self, ig_account_id, params):
+        media_type = params.get('media_type') or ('VIDEO' if params.get('video_url') else 'IMAGE')
+        if params.get('upload_type') == 'REELS' or params.get('media_type') == 'REELS':
+            media_type = 'REELS'
+        children = [child for child in (params.get('children') or '').strip('[]').replace('"', '').split(',')
+                    if child]
+        if media_type == 'CAROUSEL':
+            missing = [child for child in children if child not in self.containers]
+            if not children or missing:
+                raise GraphError(400, 100, "Invalid parameter: children")
+        elif not params.get('image_url') and not params.get('video_url'):
+            raise GraphError(400, 100, "Invalid parameter: image_url or video_url is required")
+
+        processing = self.video_processing if params.get('video_url') else 0
+        container_id = self._new_id(CONTAINER_ID_BASE)
+        with self._lock:
+            self.containers[container_id] = {
+                'id': container_id,
+                'ig_account_id': ig_account_id,
+                'media_type': media_type,
+                'caption': params.get('caption', ''),
+                'media_url': params.get('image_url') or params.get('video_url'),
+                'ready_at': time.monotonic() + processing,
+                'media_id': None,
+            }
+        return {'id': container_id}
+
+    def _publish(self, ig_account_id, creation_id):
+        container = self.containers.get(creation_id)
+        if not container or container['ig_account_id'] != ig_account_id:
+            raise GraphError(400, 100, f"Invalid parameter: creation_id {creation_id}")
+        account = self.accounts[ig_account_id]
+        with self._lock:
+            status = self._container_status(container)
+            if status == 'IN_PROGRESS':
+                raise GraphError(400, 9007, "Media ID is not available", subcode=2207027)
+            if status == 'PUBLISHED':
+                raise GraphError(400, 100, "The media has already been published")
+            if self._quota_usage(account) >= self.quota_total:
+                raise GraphError(400, 9, "Application request limit reached", subcode=2207042)
+            media_id = str(MEDIA_ID_BASE + len(self.media) + 1)
+            container['media_id'] = media_id
+            self.media[media_id] = {
+                'id': media_id,
+                'caption': container['caption'],
+                'media_type': 'VIDEO' if container['media_type'] == 'REELS' else container['media_type'],
+                'media_product_type': 'REELS' if container['media_type'] == 'REELS' else 'FEED',
+                'media_url': container['media_url'],
+                'permalink': f"https://www.instagram.com/p/{media_id}/",
+                'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S+0000', time.gmtime()),
+                'like_count': 0,
+                'comments_count': 0,
+            }
+            account['published'].append(media_id)
+            account.setdefault('published_at', []).append(time.time())
+        return {'id': media_id}
+
+    def _batch(self, operations):
+        """按順序執行批次操作，支援 `{result=name:$.id}` 引用"""
+        results = []
+        named = {}
+        failed = set()
+        for op in operations:
+            body = op.get('body') or ''
+            url = op.get('relative_url') or ''
+            references = set(match.group(1) for match in _RESULT_REF.finditer(body + url))
+            if references & failed:
+                failed.add(op.get('name'))
+                results.append(None)
+                continue
+
+            def resolve(text):
+                return _RESULT_REF.sub(lambda m: str((named.get(m.group(1)) or {}).get(m.group(2), '')), text)
+
+            parsed = urlparse(resolve(url))
+            params = dict(parse_qsl(parsed.query))
+            params.update(parse_qsl(resolve(body)))
+            status, response = self.handle(op['method'], parsed.path, params)
+            if op.get('name'):
+                named[op['name']] = response
+                if status >= 400:
+                    failed.add(op['name'])
+            omit = op.get('name') and status < 400 and op.get('omit_response_on_success', True)
+            results.append({
+                'code': status,
+                'headers': [{'name': 'Content-Type', 'value': 'application/json'}],
+                'body': None if omit else json.dumps(response),
+            })
+        return results
+
+
+def _paged(items, limit, start):
+    """以偏移量作為游標返回一頁"""
+    result = {'data': items[start:start + limit]}
+    if start + limit < len(items):
+        result['paging'] = {'cursors': {'after': str(start + limit)}, 'next': 'fake'}
+    return result
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    fake = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self, status, body=b'', headers=None):
+        self.send_response(status)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        if self.command != 'HEAD':
+            self.wfile.write(body)
+
+    def _handle(self):
+        parsed = urlparse(self.path)
+        if parsed.path.startswith('/media/'):
+            self._serve_media(parsed)
+            return
+        params = dict(parse_qsl(parsed.query))
+        if self.command == 'POST':
+            length = int(self.headers.get('Content-Length') or 0)
+            params.update(parse_qsl(self.rfile.read(length).decode('utf-8')))
+
+        fake = self.fake
+        fake._delay()
+        try:
+            usage = fake._admit()
+            status, body = fake.handle(self.command, parsed.path, params)
+        except GraphError as e:
+            usage = 100 if e.body['error']['code'] == 4 else 0
+            status, body = e.status, e.body
+        self._send(status, json.dumps(body).encode('utf-8'), {
+            'Content-Type': 'application/json; charset=UTF-8',
+            'X-App-Usage': json.dumps({'call_count': usage, 'total_cputime': usage // 2,
+                                       'total_time': usage // 2}),
+        })
+
+    def _serve_media(self, parsed):
+        name = parsed.path.rsplit('/', 1)[-1].lower()
+        content_type = next((value for ext, value in MEDIA_TYPES.items() if name.endswith(ext)), None)
+        if content_type is None:
+            self._send(404)
+            return
+        size = 2 * 1024 * 1024 if content_type.startswith('image') else 20 * 1024 * 1024
+        headers = {'Content-Type': content_type, 'ETag': f'"{name}"'}
+        if self.command == 'HEAD':
+            self.send_response(200)
+            for key, value in headers.items():
+                self.send_header(key, value)
+            self.send_header('Content-Length', str(size))
+            self.end_headers()
+            return
+        # 只返回開頭的字節（預檢以 Range 請求嗅探類型）
+        head = b'\xff\xd8\xff\xe0' + b'\0' * 12 if content_type == 'image/jpeg' \
+            else b'\0\0\0\x18ftypmp42' + b'\0' * 4
+        self._send(206, head, {**headers, 'Content-Range': f"bytes 0-15/{size}"})
+
+    do_GET = _handle
+    do_POST = _handle
+    do_DELETE = _handle
+    do_HEAD = _handle
@@ -0,0 +1,57 @@
+from facebook_business.api import FacebookAdsApi
+from facebook_business.session import FacebookSession
+from facebook_business.exceptions import FacebookRequestError
+
+from src.rate_governor import get_default_governor
+from src.graph_batch import GRAPH_URL, GraphBatch
+from src.http_session import mount_pool
+from src.resilience import get_default_resilience, endpoint_key, is_idempotent
+
+
+class GraphApi(FacebookAdsApi):
+    """每次調用都經過速率控制器、重試和熔斷器的 FacebookAdsApi"""
+
+    def __init__(self, session, api_version=None, enable_debug_logger=False, governor=None,
+                 resilience=None):
+        super().__init__(session, api_version, enable_debug_logger=enable_debug_logger)
+        self.governor = governor or get_default_governor()
+        self.resilience = resilience or get_default_resilience()
+
+    @classmethod
+    def create(cls, app_id, app_secret, access_token, api_version=None, governor=None):
+        """建立一個使用共用連線池的 API 實例（不會設置為全局默認 API）
+
+        Args:
+            app_id: Facebook 應用 ID
+            app_secret: Facebook 應用密鑰
+            access_token: 訪問令牌
+            api_version: Graph API 版本（可選）
+            governor: 速率控制器，默認使用進程共用的實例
+        """
+        session = FacebookSession(app_id, app_secret, access_token)
+        session.GRAPH = GRAPH_URL
+        mount_pool(session.requests)
+        return cls(session, api_version, governor=governor)
+
+    def new_batch(self):
+        """建立一個使用此實例令牌、速率控制器和重試設定的批次請求"""
+        return GraphBatch(self._session.access_token, governor=self.governor, resilience=self.resilience)
+
+    def call(self, method, path, params=None, headers=None, files=None,
+             url_override=None, api_version=None):
+        return self.resilience.call(
+            endpoint_key(method, path),
+            lambda: self._call_once(method, path, params, headers, files, url_override, api_version),
+            idempotent=is_idempotent(method, path) and not files,
+        )
+
+    def _call_once(self, method, path, params, headers, files, url_override, api_version):
+        self.governor.acquire()
+        try:
+            response = super().call(method, path, params=params, headers=headers, files=files,
+                                    url_override=url_override, api_version=api_version)
+        except FacebookRequestError as e:
+            self.governor.observe(e.http_headers(), error_code=e.api_error_code())
+            raise
+        self.governor.observe(response.headers())
+        return response
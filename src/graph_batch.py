@@ -0,0 +1,291 @@
+import os
+import re
+import json
+from urllib.parse import quote
+
+from src.rate_governor import get_default_governor
+from src.resilience import get_default_resilience, is_idempotent
+
+# Graph API 單次批次請求最多 50 個操作
+MAX_BATCH_SIZE = 50
+
+# GRAPH_API_URL 可指向本地的替身伺服器（見 src/fake_graph.py）
+GRAPH_URL = os.getenv('GRAPH_API_URL', "https://graph.facebook.com").rstrip('/')
+GRAPH_API_VERSION = "v22.0"
+
+# {result=name:$.path} 形式的 JSONPath 引用
+_RESULT_REF = re.compile(r'\{result=([^:}]+):([^}]+)\}')
+
+
+def result_ref(name, path='$.id'):
+    """產生引用同批次中其他操作結果的 JSONPath 佔位符
+
+    Args:
+        name: 被引用操作的名稱
+        path: 結果中的 JSONPath，預設為 `$.id`
+    """
+    return f"{{result={name}:{path}}}"
+
+
+def _encode_value(value):
+    """將參數值編碼為 Graph API 可接受的字串，保留 JSONPath 佔位符不轉義"""
+    if isinstance(value, bool):
+        value = 'true' if value else 'false'
+    elif isinstance(value, (list, tuple)):
+        value = ','.join(str(v) for v in value)
+    elif isinstance(value, dict):
+        value = json.dumps(value)
+    else:
+        value = str(value)
+
+    parts = []
+    last = 0
+    for match in _RESULT_REF.finditer(value):
+        parts.append(quote(value[last:match.start()], safe=','))
+        parts.append(match.group(0))
+        last = match.end()
+    parts.append(quote(value[last:], safe=','))
+    return ''.join(parts)
+
+
+def _encode_params(params):
+    return '&'.join(f"{quote(str(key))}={_encode_value(value)}"
+                    for key, value in params.items() if value is not None)
+
+
+def _resolve_path(body, path):
+    """對已取得的結果計算簡單的 JSONPath（支援 `$.a.b` 與 `*` 展開）"""
+    values = [body]
+    for key in path.lstrip('$').strip('.').split('.'):
+        if not key:
+            continue
+        next_values = []
+        for value in values:
+            if key == '*' and isinstance(value, list):
+                next_values.extend(value)
+            elif isinstance(value, dict) and key in value:
+                next_values.append(value[key])
+        values = next_values
+    return ','.join(str(v) for v in values)
+
+
+class BatchResponse:
+    """批次中單個操作的回應"""
+
+    def __init__(self, name, method, relative_url, raw):
+        self.name = name
+        self.method = method
+        self.relative_url = relative_url
+        raw = raw or {}
+        self.status = raw.get('code')
+        self.headers = {h['name']: h['value'] for h in raw.get('headers') or []}
+        try:
+            self.body = json.loads(raw['body']) if raw.get('body') else None
+        except ValueError:
+            self.body = raw.get('body')
+
+    @property
+    def ok(self):
+        return self.status is not None and 200 <= self.status < 300
+
+    @property
+    def error(self):
+        """失敗時返回 FacebookRequestError，成功時返回 None"""
+        if self.ok:
+            return None
+
+        from facebook_business.exceptions import FacebookRequestError
+
+        body = self.body if isinstance(self.body, dict) else {
+            'error': {'message': '批次操作沒有返回結果（可能因為依賴的操作失敗）'}
+        }
+        return FacebookRequestError(
+            "Batch operation failed",
+            {'method': self.method, 'path': self.relative_url},
+            self.status or 0,
+            self.headers,
+            json.dumps(body),
+        )
+
+    def get(self, key, default=None):
+        if isinstance(self.body, dict):
+            return self.body.get(key, default)
+        return default
+
+    def __getitem__(self, key):
+        return self.body[key]
+
+
+class GraphBatch:
+    """將多個 Graph API 操作打包成批次請求
+
+    每次 HTTP 請求最多包含 50 個操作。操作之間可以使用 `result_ref()`
+    引用同一批次中先前操作的結果；若被引用的操作在超過 50 個的上限後
+    被分到較早的請求中，佔位符會在本地以其結果替換。
+    """
+
+    def __init__(self, access_token, api_version=GRAPH_API_VERSION, graph_url=GRAPH_URL,
+                 session=None, max_batch_size=MAX_BATCH_SIZE, governor=None, resilience=None):
+        """初始化批次
+
+        Args:
+            access_token: 用於整個批次的訪問令牌
+            api_version: Graph API 版本
+            graph_url: Graph API 基本 URL
+            session: 用於發送請求的 requests.Session，默認使用共用連線池
+            max_batch_size: 每個 HTTP 請求包含的最大操作數
+            governor: 速率控制器，默認使用進程共用的實例
+            resilience: 重試與熔斷設定，默認使用進程共用的實例
+        """
+        self.access_token = access_token
+        self.api_version = api_version
+        self.graph_url = graph_url.rstrip('/')
+        if session is None:
+            from src.http_session import get_session
+            session = get_session()
+        self.session = session
+        self.max_batch_size = min(max_batch_size, MAX_BATCH_SIZE)
+        self.governor = governor or get_default_governor()
+        self.resilience = resilience or get_default_resilience()
+        self._operations = []
+        self._results = {}
+        self._next_index = 0
+
+    def __len__(self):
+        return len(self._operations)
+
+    def add(self, method, relative_url, params=None, name=None):
+        """加入一個操作
+
+        Args:
+            method: HTTP 方法（GET, POST, DELETE）
+            relative_url: 相對於 API 版本的路徑，例如 `{ig-user-id}/media`
+            params: 請求參數，值中可以包含 `result_ref()` 佔位符
+            name: 操作名稱；省略時自動產生
+
+        Returns:
+            操作名稱，可用於 `result_ref()` 和 `result()`
+        """
+        name = name or f"op{self._next_index}"
+        if name in self._results or any(op['name'] == name for op in self._operations):
+            raise ValueError(f"批次操作名稱重複: {name}")
+        self._next_index += 1
+        self._operations.append({
+            'name': name,
+            'method': method.upper(),
+            'relative_url': relative_url,
+            'params': dict(params or {}),
+        })
+        return name
+
+    def result(self, name):
+        """返回已執行操作的 BatchResponse"""
+        return self._results[name]
+
+    def first_error(self, names=None):
+        """返回已執行操作中的第一個錯誤，沒有錯誤時返回 None
+
+        Args:
+            names: 只檢查這些操作；省略時檢查所有已執行的操作
+        """
+        for name in names or self._results:
+            response = self._results[name]
+            if not response.ok:
+                return response.error
+        return None
+
+    def execute(self):
+        """執行所有已加入的操作
+
+        Returns:
+            按加入順序排列的 BatchResponse 列表
+        """
+        responses = []
+        pending = self._operations
+        self._operations = []
+
+        for start in range(0, len(pending), self.max_batch_size):
+            chunk = pending[start:start + self.max_batch_size]
+            responses.extend(self._send(chunk))
+
+        return responses
+
+    def _resolve_params(self, params):
+        """替換引用較早請求中操作結果的佔位符"""
+        def replace(match):
+            name, path = match.group(1), match.group(2)
+            if name not in self._results:
+                return match.group(0)
+            response = self._results[name]
+            if not response.ok:
+                raise Exception(f"批次操作 {name} 失敗，無法解析引用: {response.error}")
+            return _resolve_path(response.body, path)
+
+        resolved = {}
+        for key, value in params.items():
+            if isinstance(value, (list, tuple)):
+                value = ','.join(str(v) for v in value)
+            if isinstance(value, str):
+                value = _RESULT_REF.sub(replace, value)
+            resolved[key] = value
+        return resolved
+
+    def _post(self, batch):
+        """發送一個批次請求，返回各操作的原始結果列表"""
+        from facebook_business.exceptions import FacebookRequestError
+
+        # 批次中的每個操作都會計入 API 用量
+        self.governor.acquire(cost=len(batch))
+        response = self.session.post(
+            f"{self.graph_url}/{self.api_version}/",
+            data={
+                'access_token': self.access_token,
+                'batch': json.dumps(batch),
+                'include_headers': 'true',
+            },
+        )
+        try:
+            data = response.json()
+        except ValueError:
+            data = {'error': {'message': response.text[:200] or f"HTTP {response.status_code}"}}
+        if isinstance(data, dict) and 'error' in data:
+            self.governor.observe(response.headers, error_code=data['error'].get('code'))
+            raise FacebookRequestError(
+                "批次請求失敗",
+                {'method': 'POST', 'path': f"{self.graph_url}/{self.api_version}/"},
+                response.status_code,
+                response.headers,
+                json.dumps(data),
+            )
+        self.governor.observe(response.headers)
+        return data
+
+    def _send(self, chunk):
+        batch = []
+        for op in chunk:
+            params = self._resolve_params(op['params'])
+            entry = {'method': op['method'], 'name': op['name']}
+            encoded = _encode_params(params)
+            if op['method'] == 'POST':
+                entry['relative_url'] = op['relative_url']
+                entry['body'] = encoded
+            else:
+                separator = '&' if '?' in op['relative_url'] else '?'
+                entry['relative_url'] = op['relative_url'] + (separator + encoded if encoded else '')
+            # 有名稱的操作預設不返回成功結果，但調用者需要從 result() 讀取
+            entry['omit_response_on_success'] = False
+            batch.append(entry)
+
+        # 只有所有操作都可以安全重複時，暫時性錯誤才重試整個批次
+        idempotent = all(is_idempotent(op['method'], op['relative_url']) for op in chunk)
+        data = self.resilience.call('POST batch', lambda: self._post(batch), idempotent=idempotent)
+
+        results = []
+        for op, raw in zip(chunk, data):
+            result = BatchResponse(op['name'], op['method'], op['relative_url'], raw)
+            if result.headers:
+                error_code = result.get('error', {}).get('code') if not result.ok else None
+                self.governor.observe(result.headers, error_code=error_code)
+            self._results[op['name']] = result
+            results.append(result)
+        return results
@@ -0,0 +1,201 @@
+import os
+import threading
+import requests
+from requests.adapters import BaseAdapter, HTTPAdapter
+from requests.structures import CaseInsensitiveDict
+from requests.utils import get_encoding_from_headers, select_proxy
+from urllib3.util.retry import Retry
+
+from src.metrics import transfer_hook
+
+# 連線池設定，可通過環境變量調整
+POOL_SIZE = int(os.getenv('GRAPH_POOL_SIZE', '20'))
+MAX_RETRIES = int(os.getenv('GRAPH_MAX_RETRIES', '3'))
+HTTP2 = os.getenv('GRAPH_HTTP2', '').lower() in ('1', 'true', 'yes')
+
+
+class Http2Adapter(BaseAdapter):
+    """以 httpx 的 HTTP/2 連線實現的 requests 傳輸適配器
+
+    需要安裝 `httpx[http2]`。每個主機只保持一條多工的 HTTP/2 連線。
+    requests 的 verify、cert 和 proxies 參數按組合各自使用一個 httpx
+    客戶端；httpx 的連線錯誤和逾時轉為對應的 requests 異常。
+    """
+
+    def __init__(self, pool_size=POOL_SIZE, max_retries=MAX_RETRIES):
+        super().__init__()
+        import httpx
+
+        self._httpx = httpx
+        self.pool_size = pool_size
+        self.max_retries = max_retries
+        self._clients = {}
+        self._lock = threading.Lock()
+        # 立即建立默認客戶端，未安裝 h2 時在這裡拋出 ImportError 並改用 HTTP/1.1
+        self._client(True, None, None)
+
+    def _client(self, verify, cert, proxy):
+        """返回指定 TLS 和代理設定的客戶端（第一次使用時建立）"""
+        httpx = self._httpx
+        if isinstance(cert, list):
+            cert = tuple(cert)
+        key = (verify, cert, proxy)
+        with self._lock:
+            client = self._clients.get(key)
+            if client is None:
+                # 連線池大小和 TLS 設定都屬於傳輸層，傳給 Client 的同名參數在指定 transport 時無效
+                transport = httpx.HTTPTransport(
+                    http2=True,
+                    retries=self.max_retries,
+                    limits=httpx.Limits(max_connections=self.pool_size,
+                                        max_keepalive_connections=self.pool_size),
+                    verify=_ssl_verify(verify, cert),
+                    proxy=proxy,
+                    trust_env=False,
+                )
+                # requests 已經合併了環境變量中的代理和 CA 設定
+                client = httpx.Client(transport=transport, trust_env=False)
+                self._clients[key] = client
+            return client
+
+    def send(self, request, stream=False, timeout=None, verify=True, cert=None, proxies=None):
+        httpx = self._httpx
+        client = self._client(verify, cert, select_proxy(request.url, proxies))
+        if isinstance(timeout, tuple):
+            connect_timeout, read_timeout = timeout
+            timeout = httpx.Timeout(read_timeout, connect=connect_timeout)
+
+        try:
+            response = client.request(
+                request.method,
+                request.url,
+                headers=dict(request.headers),
+                content=request.body,
+                timeout=timeout,
+            )
+        except httpx.ProxyError as e:
+            raise requests.exceptions.ProxyError(e, request=request)
+        except httpx.ConnectTimeout as e:
+            raise requests.exceptions.ConnectTimeout(e, request=request)
+        except httpx.TimeoutException as e:
+            raise requests.exceptions.ReadTimeout(e, request=request)
+        except httpx.UnsupportedProtocol as e:
+            raise requests.exceptions.InvalidSchema(e, request=request)
+        except httpx.TransportError as e:
+            raise requests.exceptions.ConnectionError(e, request=request)
+
+        result = requests.Response()
+        result.status_code = response.status_code
+        result.headers = CaseInsensitiveDict(response.headers)
+        result.encoding = get_encoding_from_headers(result.headers)
+        result.reason = response.reason_phrase
+        result.url = request.url
+        result.request = request
+        result._content = response.content
+        return result
+
+    def close(self):
+        with self._lock:
+            clients, self._clients = self._clients, {}
+        for client in clients.values():
+            client.close()
+
+
+def _ssl_verify(verify, cert):
+    """將 requests 的 verify（布林值或 CA 路徑）和 cert 轉為 httpx 接受的 verify 參數"""
+    if not cert and isinstance(verify, bool):
+        return verify
+    import ssl
+    from requests.certs import where
+
+    if verify is False:
+        context = ssl.create_default_context()
+        context.check_hostname = False
+        context.verify_mode = ssl.CERT_NONE
+    else:
+        ca_path = verify if isinstance(verify, str) else where()
+        if os.path.isdir(ca_path):
+            context = ssl.create_default_context(capath=ca_path)
+        else:
+            context = ssl.create_default_context(cafile=ca_path)
+    if cert:
+        cert_file, key_file = cert if isinstance(cert, tuple) else (cert, None)
+        context.load_cert_chain(cert_file, key_file)
+    return context
+
+
+def _create_adapter(pool_size, max_retries, http2):
+    if http2:
+        try:
+            return Http2Adapter(pool_size, max_retries)
+        except ImportError:
+            print("警告: 未安裝 httpx[http2]，改用 HTTP/1.1 連線池")
+
+    # 連線錯誤任何方法都可以安全重試；讀取時連線被重置只重試冪等方法，
+    # 避免重複發送創建或發布媒體的 POST 請求
+    retry = Retry(total=max_retries, connect=max_retries, read=max_retries, status=0,
+                  backoff_factor=0.2, raise_on_status=False)
+    return HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+
+
+_lock = threading.Lock()
+_adapter = None
+_session = None
+
+
+def configure(pool_size=POOL_SIZE, max_retries=MAX_RETRIES, http2=HTTP2):
+    """重新設置共用的連線池（應在發送任何請求前調用）
+
+    Args:
+        pool_size: 每個主機保持的最大連線數
+        max_retries: 連線錯誤時的重試次數
+        http2: 是否在可用時使用 HTTP/2
+    """
+    global _adapter, _session
+    with _lock:
+        _adapter = _create_adapter(pool_size, max_retries, http2)
+        _session = None
+    return _adapter
+
+
+def get_adapter():
+    """返回整個進程共用的傳輸適配器（連線池）"""
+    global _adapter
+    with _lock:
+        if _adapter is None:
+            _adapter = _create_adapter(POOL_SIZE, MAX_RETRIES, HTTP2)
+        return _adapter
+
+
+def _add_transfer_hook(session):
+    """記錄每個回應的傳輸位元組數（指標停用時 hook 立即返回）"""
+    hooks = session.hooks['response']
+    if transfer_hook not in hooks:
+        hooks.append(transfer_hook)
+
+
+def mount_pool(session):
+    """讓一個 requests.Session 使用共用的連線池
+
+    FacebookSession 在其 requests.Session 上保存訪問令牌等默認參數，
+    因此不同令牌各自保留自己的 Session，只共用底層連線。
+    """
+    adapter = get_adapter()
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    _add_transfer_hook(session)
+    return session
+
+
+def get_session():
+    """返回使用共用連線池的 requests.Session（不帶任何默認參數）"""
+    global _session
+    adapter = get_adapter()
+    with _lock:
+        if _session is None:
+            session = requests.Session()
+            session.mount('https://', adapter)
+            session.mount('http://', adapter)
+            _add_transfer_hook(session)
+            _session = session
+        return _session
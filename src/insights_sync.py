@@ -0,0 +1,189 @@
+import os
+import json
+import time
+import datetime
+import threading
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from src.json_store import JsonFileStore
+from src.media_export import iter_media_pages
+
+# 每種媒體產品類型請求的指標
+# v22.0 起 impressions、plays 和 video_views 已由 views 取代
+METRICS = {
+    'FEED': ('reach', 'views', 'likes', 'comments', 'saved', 'shares', 'total_interactions'),
+    'REELS': ('reach', 'views', 'likes', 'comments', 'saved', 'shares', 'total_interactions',
+              'ig_reels_avg_watch_time', 'ig_reels_video_view_total_time'),
+    'STORY': ('reach', 'views', 'replies', 'shares', 'total_interactions', 'navigation'),
+}
+
+MEDIA_FIELDS = 'id,media_type,media_product_type,timestamp'
+
+# 默認重新同步最近 7 天內仍在變化的貼文
+DEFAULT_WINDOW_DAYS = int(os.getenv('INSIGHTS_WINDOW_DAYS', '7'))
+
+# 每組批次請求處理的媒體數量，結果按組寫入
+CHUNK_SIZE = 500
+
+
+def parse_timestamp(value):
+    """將 Graph API 的時間（例如 2024-05-01T12:00:00+0000）轉為 Unix 時間戳"""
+    return int(datetime.datetime.strptime(value, '%Y-%m-%dT%H:%M:%S%z').timestamp())
+
+
+def _parse_insights(body):
+    """將 insights 回應轉為 {指標: 數值}"""
+    metrics = {}
+    for entry in (body or {}).get('data') or []:
+        if entry.get('total_value') is not None:
+            metrics[entry['name']] = entry['total_value'].get('value')
+        elif entry.get('values'):
+            metrics[entry['name']] = entry['values'][-1].get('value')
+    return metrics
+
+
+class InsightsSync:
+    """增量同步 Instagram 媒體的洞察數據
+
+    每個帳戶在狀態文件中記錄已同步的最新貼文時間（高水位）。每次同步
+    從最新的貼文開始遍歷，直到貼文既早於高水位、又不在最近
+    `window_days` 天內為止；只為這些貼文以批次請求（每個 HTTP 請求
+    50 個媒體）獲取洞察。首次同步會遍歷完整歷史。多個帳戶並行處理。
+    """
+
+    def __init__(self, state_path=None, window_days=DEFAULT_WINDOW_DAYS, metrics=None, debug=False):
+        """初始化同步引擎
+
+        Args:
+            state_path: 高水位狀態文件，默認為 config/insights_state.json
+            window_days: 每次重新同步的最近天數
+            metrics: 覆蓋默認的 {媒體產品類型: 指標列表}
+            debug: 顯示調試信息
+        """
+        if state_path is None:
+            base_dir = Path(__file__).parent.parent
+            state_path = os.getenv('INSIGHTS_STATE_FILE') or os.path.join(base_dir, 'config', 'insights_state.json')
+        self.state = JsonFileStore(state_path)
+        self.window = window_days * 86400
+        self.metrics = {**METRICS, **(metrics or {})}
+        self.debug = debug
+        self._write_lock = threading.Lock()
+
+    def _media_to_sync(self, publisher, full=False):
+        """返回需要同步的媒體列表，以及其中最新的貼文時間"""
+        account_state = {} if full else (self.state.get(publisher.ig_account_id) or {})
+        high_water_mark = account_state.get('high_water_mark')
+        cutoff = time.time() - self.window
+        if high_water_mark is not None:
+            cutoff = min(cutoff, high_water_mark)
+
+        media = []
+        latest = high_water_mark
+        pages = iter_media_pages(publisher.api, publisher.ig_account_id, MEDIA_FIELDS)
+        try:
+            for items, _ in pages:
+                for item in items:
+                    posted_at = parse_timestamp(item['timestamp'])
+                    if high_water_mark is not None and posted_at < cutoff:
+                        return media, latest
+                    media.append(item)
+                    latest = max(latest or 0, posted_at)
+        finally:
+            pages.close()
+        return media, latest
+
+    def _sync_chunk(self, publisher, media, output, synced_at):
+        """以批次請求獲取一組媒體的洞察並寫入結果，返回失敗數量"""
+        batch = publisher.new_batch()
+        names = []
+        for item in media:
+            product_type = item.get('media_product_type') or 'FEED'
+            metric = ','.join(self.metrics.get(product_type, self.metrics['FEED']))
+            names.append(batch.add('GET', f"{item['id']}/insights", {'metric': metric}))
+        batch.execute()
+
+        lines = []
+        failed = 0
+        for item, name in zip(media, names):
+            response = batch.result(name)
+            row = {
+                'ig_account_id': publisher.ig_account_id,
+                'media_id': item['id'],
+                'media_type': item.get('media_type'),
+                'media_product_type': item.get('media_product_type'),
+                'timestamp': item.get('timestamp'),
+                'synced_at': synced_at,
+            }
+            if response.ok:
+                row['metrics'] = _parse_insights(response.body)
+            else:
+                failed += 1
+                row['error'] = (response.get('error') or {}).get('message') or f"HTTP {response.status}"
+            lines.append(json.dumps(row, ensure_ascii=False) + '\n')
+
+        with self._write_lock:
+            output.writelines(lines)
+            output.flush()
+        return failed
+
+    def sync_account(self, publisher, output, full=False):
+        """同步一個帳戶
+
+        Args:
+            publisher: 綁定該帳戶的 InstagramPublisher
+            output: 寫入結果的文件對象（每行一個 JSON）
+            full: 忽略高水位，重新同步完整歷史
+
+        Returns:
+            {'ig_account_id', 'synced', 'failed'} 摘要
+        """
+        if not publisher.ig_account:
+            raise ValueError("Instagram 帳戶未初始化")
+        ig_account_id = publisher.ig_account_id
+        media, latest = self._media_to_sync(publisher, full)
+
+        synced_at = int(time.time())
+        failed = 0
+        for start in range(0, len(media), CHUNK_SIZE):
+            failed += self._sync_chunk(publisher, media[start:start + CHUNK_SIZE], output, synced_at)
+
+        # 結果寫入後才推進高水位，中斷的同步下次會重新處理
+        self.state.set(ig_account_id, {
+            'high_water_mark': latest,
+            'synced_at': synced_at,
+            'media_synced': len(media),
+        })
+        if self.debug:
+            print(f"帳戶 {ig_account_id}: 已同步 {len(media)} 個媒體的洞察，失敗 {failed}")
+        return {'ig_account_id': ig_account_id, 'synced': len(media), 'failed': failed}
+
+    def sync(self, publishers, output_path, workers=8, full=False):
+        """並行同步多個帳戶，結果追加到 JSONL 文件
+
+        Args:
+            publishers: InstagramPublisher 列表
+            output_path: 輸出的 JSONL 文件
+            workers: 同時同步的帳戶數
+            full: 忽略高水位，重新同步完整歷史
+
+        Returns:
+            {'accounts', 'synced', 'failed', 'errors'} 摘要，errors 為 {帳戶: 錯誤信息}
+        """
+        summary = {'accounts': 0, 'synced': 0, 'failed': 0, 'errors': {}}
+        os.makedirs(os.path.dirname(output_path) or '.', exist_ok=True)
+        with open(output_path, 'a', encoding='utf-8') as output, \
+                ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix='insights') as executor:
+            futures = {executor.submit(self.sync_account, publisher, output, full): publisher
+                       for publisher in publishers}
+            for future in as_completed(futures):
+                publisher = futures[future]
+                try:
+                    result = future.result()
+                except Exception as e:
+                    summary['errors'][publisher.page_id] = str(e)
+                    continue
+                summary['accounts'] += 1
+                summary['synced'] += result['synced']
+                summary['failed'] += result['failed']
+        return summary
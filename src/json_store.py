@@ -0,0 +1,159 @@
+import os
+import json
+import time
+import tempfile
+import threading
+from contextlib import contextmanager
+
+from src.metrics import get_default_metrics
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+
+class JsonFileStore:
+    """以 JSON 文件保存鍵值資料，使用鎖文件實現跨進程互斥
+
+    寫入時先獲取排他鎖，重新讀取磁盤上的最新內容再合併修改的鍵，
+    然後寫入臨時文件並以 os.replace 原子替換。讀取時只在文件的
+    修改時間或大小改變時才重新解析。令牌存儲、帳戶快取和各種檢查點
+    都使用此類。
+    """
+
+    # 載入文件時記錄的 span 名稱
+    load_span = 'json_store.load'
+
+    def __init__(self, path):
+        self.path = path
+        self.lock_path = f"{path}.lock"
+        self._thread_lock = threading.RLock()
+        self._lock_depth = 0
+        self._cache = {}
+        self._signature = None
+
+    @contextmanager
+    def _locked(self):
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        with self._thread_lock:
+            if self._lock_depth:
+                # 同一執行緒已持有文件鎖（flock 對同一進程的另一個文件描述符不可重入）
+                self._lock_depth += 1
+                try:
+                    yield
+                finally:
+                    self._lock_depth -= 1
+                return
+            with open(self.lock_path, 'a+') as lock_file:
+                self._flock(lock_file, True)
+                self._lock_depth = 1
+                try:
+                    yield
+                finally:
+                    self._lock_depth = 0
+                    self._flock(lock_file, False)
+
+    @staticmethod
+    def _flock(lock_file, acquire):
+        if fcntl:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX if acquire else fcntl.LOCK_UN)
+        else:
+            lock_file.seek(0)
+            msvcrt.locking(lock_file.fileno(), msvcrt.LK_LOCK if acquire else msvcrt.LK_UNLCK, 1)
+
+    def _stat_signature(self):
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            return None
+        return (stat.st_mtime_ns, stat.st_size, stat.st_ino)
+
+    def _refresh(self):
+        """文件有變化時重新讀取，返回最新內容"""
+        with self._thread_lock:
+            signature = self._stat_signature()
+            if signature == self._signature:
+                return self._cache
+            if signature is None:
+                self._cache, self._signature = {}, None
+                return self._cache
+            try:
+                with get_default_metrics().span(self.load_span), open(self.path, 'r') as f:
+                    self._cache = json.load(f)
+                self._signature = signature
+            except json.JSONDecodeError:
+                self._move_corrupt()
+            return self._cache
+
+    def _move_corrupt(self):
+        """把損壞的文件移開以便下一次寫入，保留上一次成功讀取的內容
+
+        在寫入鎖內重新讀取一次：先前讀到的可能是其他進程寫入前的狀態，
+        只有在鎖內仍然無法解析時才移開，不會移走其他進程剛寫入的有效文件。
+        """
+        with self._locked():
+            signature = self._stat_signature()
+            if signature is None:
+                self._cache, self._signature = {}, None
+                return
+            try:
+                with open(self.path, 'r') as f:
+                    self._cache = json.load(f)
+                self._signature = signature
+                return
+            except json.JSONDecodeError:
+                pass
+            corrupt_path = f"{self.path}.corrupt-{int(time.time())}"
+            os.replace(self.path, corrupt_path)
+            print(f"警告: {self.path} 已損壞，已移至 {corrupt_path}")
+            self._signature = None
+
+    def all(self):
+        return dict(self._refresh())
+
+    def get(self, key, default=None):
+        return self._refresh().get(key, default)
+
+    def set(self, key, value):
+        self.update({key: value})
+
+    def _write(self, tokens):
+        directory = os.path.dirname(self.path) or '.'
+        fd, tmp_path = tempfile.mkstemp(prefix=f".{os.path.basename(self.path)}-", dir=directory)
+        try:
+            with os.fdopen(fd, 'w') as f:
+                json.dump(tokens, f, indent=2)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, self.path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+            raise
+        self._cache = tokens
+        self._signature = self._stat_signature()
+
+    def update(self, tokens):
+        with self._locked():
+            current = dict(self._refresh())
+            current.update(tokens)
+            self._write(current)
+
+    def replace_prefix(self, prefix, tokens):
+        """以 tokens 取代所有以 prefix 開頭的鍵，其他鍵保持不變（一次寫入）"""
+        with self._locked():
+            current = {key: value for key, value in self._refresh().items() if not key.startswith(prefix)}
+            current.update(tokens)
+            self._write(current)
+
+    def delete(self, key):
+        with self._locked():
+            current = dict(self._refresh())
+            if current.pop(key, None) is not None:
+                self._write(current)
+
+    def clear(self):
+        with self._locked():
+            self._write({})
@@ -0,0 +1,258 @@
+import os
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from src.json_store import JsonFileStore
+
+DEFAULT_FIELDS = ('id,caption,media_type,media_product_type,media_url,permalink,'
+                  'thumbnail_url,timestamp,like_count,comments_count')
+DEFAULT_PAGE_SIZE = 100
+
+FORMATS = ('jsonl', 'csv', 'parquet')
+
+
+def field_names(fields):
+    """返回 fields 參數中的頂層欄位名，例如 `id,children{id}` → ['id', 'children']"""
+    names = []
+    depth = 0
+    current = ''
+    for char in fields + ',':
+        if char == '{':
+            depth += 1
+        elif char == '}':
+            depth -= 1
+        elif char == ',' and depth == 0:
+            name = current.split('.')[0].strip()
+            if name:
+                names.append(name)
+            current = ''
+            continue
+        if depth == 0 and char != '}':
+            current += char
+    return names
+
+
+def iter_media_pages(api, ig_account_id, fields=DEFAULT_FIELDS, page_size=DEFAULT_PAGE_SIZE,
+                     after=None, prefetch=True):
+    """逐頁遍歷 Instagram 帳戶的所有媒體
+
+    處理目前頁面時，下一頁已在背景執行緒中請求，因此網絡延遲與處理
+    重疊。任何時候最多只有兩頁在記憶體中。
+
+    Args:
+        api: 綁定頁面令牌的 FacebookAdsApi 實例
+        ig_account_id: Instagram 商業帳戶 ID
+        fields: 要請求的欄位
+        page_size: 每頁的媒體數量
+        after: 從此游標之後開始（用於恢復）
+        prefetch: 是否預先請求下一頁
+
+    Yields:
+        (媒體列表, 下一頁游標) 元組；最後一頁的游標為 None
+    """
+    def fetch(cursor):
+        params = {'fields': fields, 'limit': page_size}
+        if cursor:
+            params['after'] = cursor
+        data = api.call('GET', (ig_account_id, 'media'), params=params).json()
+        paging = data.get('paging') or {}
+        next_cursor = (paging.get('cursors') or {}).get('after') if paging.get('next') else None
+        return data.get('data') or [], next_cursor
+
+    if not prefetch:
+        cursor = after
+        while True:
+            items, cursor = fetch(cursor)
+            yield items, cursor
+            if not cursor:
+                return
+
+    with ThreadPoolExecutor(max_workers=1, thread_name_prefix='media-prefetch') as executor:
+        future = executor.submit(fetch, after)
+        while future is not None:
+            items, cursor = future.result()
+            future = executor.submit(fetch, cursor) if cursor else None
+            try:
+                yield items, cursor
+            except GeneratorExit:
+                if future is not None:
+                    future.cancel()
+                raise
+
+
+def iter_media(api, ig_account_id, **kwargs):
+    """逐項遍歷帳戶的所有媒體（參數同 iter_media_pages）"""
+    for items, _ in iter_media_pages(api, ig_account_id, **kwargs):
+        yield from items
+
+
+def _scalar(value):
+    """將巢狀欄位（例如 children）轉為 JSON 字串，使每一頁的欄位類型一致"""
+    if isinstance(value, (dict, list)):
+        return json.dumps(value, ensure_ascii=False)
+    return value
+
+
+class _AppendWriter:
+    """追加寫入單一文件，position() 返回已確認寫入的字節位置"""
+
+    def __init__(self, path, columns, position=None):
+        self.path = path
+        self.columns = columns
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self._file = open(path, 'a+b')
+        if position is not None:
+            # 丟棄上次中斷時已寫入但未記錄在檢查點中的內容
+            self._file.truncate(position)
+        self._file.seek(0, os.SEEK_END)
+
+    def position(self):
+        return self._file.tell()
+
+    def write(self, items):
+        self._write(items)
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def close(self):
+        self._file.close()
+
+
+class JsonlWriter(_AppendWriter):
+    def _write(self, items):
+        for item in items:
+            self._file.write((json.dumps(item, ensure_ascii=False) + '\n').encode('utf-8'))
+
+
+class CsvWriter(_AppendWriter):
+    def _write(self, items):
+        import pandas as pd
+
+        if not items:
+            return
+        frame = pd.DataFrame([{column: _scalar(item.get(column)) for column in self.columns}
+                              for item in items], columns=self.columns)
+        self._file.write(frame.to_csv(index=False, header=self._file.tell() == 0).encode('utf-8'))
+
+
+class ParquetWriter:
+    """每一頁寫入一個 part 文件：<目錄>/part-00000.parquet（需要 pyarrow）"""
+
+    def __init__(self, path, columns, position=None):
+        self.path = path
+        self.columns = columns
+        os.makedirs(path, exist_ok=True)
+        parts = sorted(name for name in os.listdir(path) if name.startswith('part-'))
+        if position is not None:
+            for name in parts[position:]:
+                os.unlink(os.path.join(path, name))
+            parts = parts[:position]
+        self._parts = len(parts)
+
+    def position(self):
+        return self._parts
+
+    def write(self, items):
+        import pandas as pd
+
+        if not items:
+            return
+        frame = pd.DataFrame([{column: _scalar(item.get(column)) for column in self.columns}
+                              for item in items], columns=self.columns)
+        part_path = os.path.join(self.path, f"part-{self._parts:05d}.parquet")
+        tmp_path = f"{part_path}.tmp"
+        try:
+            frame.to_parquet(tmp_path, index=False)
+        except ImportError as e:
+            raise ImportError(f"寫入 parquet 需要安裝 pyarrow: {e}")
+        os.replace(tmp_path, part_path)
+        self._parts += 1
+
+    def close(self):
+        pass
+
+
+WRITERS = {'jsonl': JsonlWriter, 'csv': CsvWriter, 'parquet': ParquetWriter}
+
+
+def detect_format(path):
+    """根據輸出路徑推斷格式（默認 jsonl）"""
+    extension = os.path.splitext(path)[1].lstrip('.').lower()
+    if extension in ('csv', 'parquet'):
+        return extension
+    return 'jsonl'
+
+
+class MediaExporter:
+    """將帳戶的完整媒體歷史串流寫入 JSONL、CSV 或 parquet
+
+    每寫完一頁就把下一頁游標和輸出位置記錄到檢查點，中斷後重新執行
+    會截掉未記錄的部分並從游標繼續，不會重複或遺漏。記憶體用量與
+    帳戶大小無關。
+    """
+
+    def __init__(self, api, ig_account_id, fields=DEFAULT_FIELDS, page_size=DEFAULT_PAGE_SIZE,
+                 prefetch=True):
+        self.api = api
+        self.ig_account_id = ig_account_id
+        self.fields = fields
+        self.page_size = page_size
+        self.prefetch = prefetch
+
+    def export(self, output, format=None, checkpoint_path=None, restart=False, progress=None):
+        """導出所有媒體
+
+        Args:
+            output: 輸出文件路徑（parquet 為目錄）
+            format: jsonl, csv 或 parquet；省略時根據擴展名判斷
+            checkpoint_path: 檢查點文件，默認為 <output>.checkpoint
+            restart: 忽略檢查點並重新導出
+            progress: 每寫完一頁以累計數量調用的函數（可選）
+
+        Returns:
+            {'exported': 本次導出數量, 'total': 累計數量, 'complete': 是否已到最後一頁}
+        """
+        format = format or detect_format(output)
+        if format not in WRITERS:
+            raise ValueError(f"不支持的導出格式: {format}")
+
+        checkpoint = JsonFileStore(checkpoint_path or f"{output}.checkpoint")
+        state = None if restart else checkpoint.get(self.ig_account_id)
+        if state and (state.get('fields') != self.fields or state.get('format') != format):
+            raise ValueError("檢查點的欄位或格式與本次導出不同，請使用 --restart 重新導出")
+
+        if state and state.get('complete'):
+            return {'exported': 0, 'total': state.get('exported', 0), 'complete': True}
+
+        if restart:
+            position = 0
+        else:
+            position = state.get('position') if state else 0
+        writer = WRITERS[format](output, field_names(self.fields), position)
+        total = state.get('exported', 0) if state else 0
+        exported = 0
+        cursor = state.get('after') if state else None
+
+        try:
+            pages = iter_media_pages(self.api, self.ig_account_id, self.fields, self.page_size,
+                                     after=cursor, prefetch=self.prefetch)
+            for items, cursor in pages:
+                writer.write(items)
+                exported += len(items)
+                total += len(items)
+                checkpoint.set(self.ig_account_id, {
+                    'after': cursor,
+                    'position': writer.position(),
+                    'exported': total,
+                    'fields': self.fields,
+                    'format': format,
+                    'complete': cursor is None,
+                    'updated_at': int(time.time()),
+                })
+                if progress:
+                    progress(total)
+        finally:
+            writer.close()
+
+        return {'exported': exported, 'total': total, 'complete': True}
@@ -0,0 +1,315 @@
+import os
+import time
+import asyncio
+import threading
+from urllib.parse import urljoin, urlparse
+from concurrent.futures import ThreadPoolExecutor
+
+# Instagram 內容發布 API 對媒體文件的限制
+LIMITS = {
+    'IMAGE': {'types': ('image/jpeg',), 'max_size': 8 * 1024 * 1024},
+    'VIDEO': {'types': ('video/mp4', 'video/quicktime'), 'max_size': 300 * 1024 * 1024},
+    'REELS': {'types': ('video/mp4', 'video/quicktime'), 'max_size': 300 * 1024 * 1024},
+    'STORIES': {'types': ('video/mp4', 'video/quicktime', 'image/jpeg'), 'max_size': 100 * 1024 * 1024},
+}
+
+# Instagram 無法直接下載的主機（需要登入或返回網頁）
+BLOCKED_HOSTS = ('drive.google.com', 'docs.google.com')
+
+MAX_REDIRECTS = 5
+TIMEOUT = 10
+WORKERS = 16
+
+# 預檢結果的快取秒數；過期後若有 ETag 則以條件請求重新驗證
+CACHE_TTL = int(os.getenv('MEDIA_PREFLIGHT_TTL', '3600'))
+
+# 暫時性失敗（連線錯誤、逾時、5xx、429）只快取此秒數，之後重新檢查
+ERROR_TTL = int(os.getenv('MEDIA_PREFLIGHT_ERROR_TTL', '30'))
+
+# 表示伺服器暫時無法回應的狀態碼
+TRANSIENT_STATUSES = (408, 429, 500, 502, 503, 504)
+
+REDIRECT_STATUSES = (301, 302, 303, 307, 308)
+
+GOOGLE_DRIVE_MESSAGE = ("Google Drive 連結無法直接使用。請提供直接可下載的影片URL。"
+                        "Google Drive 需要額外的身份驗證，API 無法直接訪問。")
+
+
+class MediaValidationError(ValueError):
+    """媒體 URL 未通過預檢"""
+
+    def __init__(self, message, url):
+        super().__init__(message)
+        self.url = url
+
+
+def _sniff_type(head):
+    """根據文件開頭的字節判斷類型（內容類型標頭不可靠時使用）"""
+    if head.startswith(b'\xff\xd8\xff'):
+        return 'image/jpeg'
+    if head.startswith(b'\x89PNG'):
+        return 'image/png'
+    if len(head) >= 12 and head[4:8] == b'ftyp':
+        return 'video/quicktime' if head[8:10] == b'qt' else 'video/mp4'
+    return None
+
+
+class MediaPreflight:
+    """在創建媒體容器之前並行檢查媒體 URL
+
+    以 HEAD 請求（必要時改用只取前 16 字節的 Range GET）檢查 URL 是否
+    可訪問、重定向次數、內容類型和文件大小是否符合 Instagram 的限制。
+    結果按 URL 快取，過期後以 ETag 條件請求重新驗證，因此重複的 URL
+    （例如重試或清單中的相同圖片）不需要再次下載標頭。連線失敗等暫時性
+    錯誤只快取 `error_ttl` 秒。
+
+    asyncio 程式使用 `validate_async`，以呼叫者的 aiohttp 連線池發送請求，
+    與同步方法共用同一個結果快取。
+    """
+
+    def __init__(self, session=None, ttl=CACHE_TTL, timeout=TIMEOUT, workers=WORKERS, error_ttl=ERROR_TTL):
+        """初始化預檢器
+
+        Args:
+            session: requests.Session，默認使用共用連線池
+            ttl: 結果快取秒數
+            error_ttl: 暫時性失敗的快取秒數
+            timeout: 每個請求的逾時秒數
+            workers: 並行檢查的執行緒數量
+        """
+        self._session = session
+        self.ttl = ttl
+        self.error_ttl = error_ttl
+        self.timeout = timeout
+        self.workers = workers
+        self._cache = {}
+        self._lock = threading.Lock()
+
+    @property
+    def session(self):
+        if self._session is None:
+            from src.http_session import get_session
+            self._session = get_session()
+        return self._session
+
+    def check(self, url, media_type='IMAGE'):
+        """檢查一個 URL，返回 None 表示通過，否則返回錯誤信息
+
+        Args:
+            url: 媒體 URL
+            media_type: IMAGE, VIDEO, REELS 或 STORIES
+        """
+        error = self._precheck(url)
+        if error:
+            return error
+        info, cached = self._lookup(url)
+        if info is None:
+            info = self._remember(url, self._probe(url, cached))
+        return self._evaluate(url, info, media_type)
+
+    async def check_async(self, session, url, media_type='IMAGE'):
+        """check() 的協程版本，以 aiohttp.ClientSession 發送請求"""
+        error = self._precheck(url)
+        if error:
+            return error
+        info, cached = self._lookup(url)
+        if info is None:
+            info = self._remember(url, await self._probe_async(session, url, cached))
+        return self._evaluate(url, info, media_type)
+
+    def check_many(self, urls, media_type='IMAGE'):
+        """並行檢查多個 URL，返回 {url: 錯誤信息}（只包含未通過的 URL）"""
+        unique = list(dict.fromkeys(urls))
+        if len(unique) == 1:
+            error = self.check(unique[0], media_type)
+            return {unique[0]: error} if error else {}
+        with ThreadPoolExecutor(max_workers=min(self.workers, len(unique)) or 1) as executor:
+            errors = dict(zip(unique, executor.map(lambda url: self.check(url, media_type), unique)))
+        return {url: error for url, error in errors.items() if error}
+
+    def validate(self, urls, media_type='IMAGE'):
+        """檢查一個或多個 URL，任何一個未通過時拋出 MediaValidationError"""
+        if isinstance(urls, str):
+            urls = [urls]
+        errors = self.check_many(urls, media_type)
+        for url in urls:
+            if url in errors:
+                raise MediaValidationError(errors[url], url)
+
+    async def validate_async(self, session, urls, media_type='IMAGE'):
+        """validate() 的協程版本，最多同時檢查 `workers` 個 URL"""
+        if isinstance(urls, str):
+            urls = [urls]
+        unique = list(dict.fromkeys(urls))
+        semaphore = asyncio.Semaphore(self.workers)
+
+        async def check(url):
+            async with semaphore:
+                return await self.check_async(session, url, media_type)
+
+        errors = dict(zip(unique, await asyncio.gather(*(check(url) for url in unique))))
+        for url in urls:
+            if errors[url]:
+                raise MediaValidationError(errors[url], url)
+
+    def clear(self):
+        with self._lock:
+            self._cache = {}
+
+    @staticmethod
+    def _precheck(url):
+        """不需要發送請求的檢查（URL 格式和無法直接下載的主機）"""
+        host = (urlparse(url).hostname or '').lower()
+        if urlparse(url).scheme not in ('http', 'https') or not host:
+            return f"不是有效的 HTTP(S) URL: {url}"
+        if host in BLOCKED_HOSTS:
+            return GOOGLE_DRIVE_MESSAGE
+        return None
+
+    def _lookup(self, url):
+        """返回 (仍然有效的快取結果或 None, 可用於條件請求的舊結果)"""
+        with self._lock:
+            cached = self._cache.get(url)
+        ttl = self.error_ttl if cached and cached.get('transient') else self.ttl
+        if cached and cached['checked_at'] + ttl > time.time():
+            return cached, cached
+        return None, cached
+
+    def _remember(self, url, info):
+        with self._lock:
+            self._cache[url] = info
+        return info
+
+    def _request(self, method, url, headers):
+        return self.session.request(method, url, headers=headers, timeout=self.timeout,
+                                    allow_redirects=False, stream=True)
+
+    def _probe(self, url, cached=None):
+        """跟隨重定向並取得最終 URL 的狀態、類型和大小"""
+        info = {'checked_at': time.time(), 'redirects': 0, 'final_url': url}
+        current = url
+        try:
+            for _ in range(MAX_REDIRECTS + 1):
+                headers = self._conditional_headers(cached, current)
+                response = self._request('HEAD', current, headers)
+                response.close()
+                if response.status_code in REDIRECT_STATUSES and response.headers.get('Location'):
+                    current = urljoin(current, response.headers['Location'])
+                    info['redirects'] += 1
+                    continue
+                if response.status_code == 304 and cached:
+                    return {**cached, 'checked_at': time.time()}
+                head = None
+                if self._needs_range_get(response.status_code, response.headers):
+                    response = self._request('GET', current, {**headers, 'Range': 'bytes=0-15'})
+                    head = next(response.iter_content(16), b'') if response.status_code < 300 else b''
+                    response.close()
+                return self._describe(info, current, response.status_code, response.headers, head)
+            info['error'] = f"重定向次數超過 {MAX_REDIRECTS} 次"
+        except Exception as e:
+            info['error'] = f"無法訪問: {e}"
+            info['transient'] = True
+        return info
+
+    async def _probe_async(self, session, url, cached=None):
+        """_probe() 的協程版本"""
+        import aiohttp
+
+        info = {'checked_at': time.time(), 'redirects': 0, 'final_url': url}
+        current = url
+        timeout = aiohttp.ClientTimeout(total=self.timeout)
+        try:
+            for _ in range(MAX_REDIRECTS + 1):
+                headers = self._conditional_headers(cached, current)
+                async with session.head(current, headers=headers, allow_redirects=False,
+                                        timeout=timeout) as response:
+                    status, response_headers = response.status, response.headers
+                if status in REDIRECT_STATUSES and response_headers.get('Location'):
+                    current = urljoin(current, response_headers['Location'])
+                    info['redirects'] += 1
+                    continue
+                if status == 304 and cached:
+                    return {**cached, 'checked_at': time.time()}
+                head = None
+                if self._needs_range_get(status, response_headers):
+                    async with session.get(current, headers={**headers, 'Range': 'bytes=0-15'},
+                                           allow_redirects=False, timeout=timeout) as response:
+                        status, response_headers = response.status, response.headers
+                        head = await response.content.read(16) if status < 300 else b''
+                return self._describe(info, current, status, response_headers, head)
+            info['error'] = f"重定向次數超過 {MAX_REDIRECTS} 次"
+        except Exception as e:
+            info['error'] = f"無法訪問: {e or type(e).__name__}"
+            info['transient'] = True
+        return info
+
+    @staticmethod
+    def _conditional_headers(cached, url):
+        if cached and cached.get('etag') and cached.get('final_url') == url:
+            return {'If-None-Match': cached['etag']}
+        return {}
+
+    @staticmethod
+    def _needs_range_get(status, headers):
+        # 部分伺服器不支持 HEAD 或不返回大小，改用只取開頭字節的 GET
+        return status in (403, 405, 501) or (status < 300 and not headers.get('Content-Length'))
+
+    @classmethod
+    def _describe(cls, info, url, status, headers, head=None):
+        """以最終回應填寫預檢結果；head 是 Range GET 取得的文件開頭"""
+        if head is not None:
+            info['sniffed_type'] = _sniff_type(head)
+        info['final_url'] = url
+        info['status'] = status
+        info['etag'] = headers.get('ETag')
+        info['content_type'] = (headers.get('Content-Type') or '').split(';')[0].strip().lower()
+        info['size'] = cls._content_size(status, headers)
+        info['transient'] = status in TRANSIENT_STATUSES
+        return info
+
+    @staticmethod
+    def _content_size(status, headers):
+        content_range = headers.get('Content-Range', '')
+        if '/' in content_range and content_range.rsplit('/', 1)[1].isdigit():
+            return int(content_range.rsplit('/', 1)[1])
+        length = headers.get('Content-Length')
+        if status != 206 and length and length.isdigit():
+            return int(length)
+        return None
+
+    @staticmethod
+    def _evaluate(url, info, media_type):
+        if info.get('error'):
+            return f"{url}: {info['error']}"
+        if (urlparse(info['final_url']).hostname or '').lower() in BLOCKED_HOSTS:
+            return GOOGLE_DRIVE_MESSAGE
+        if not 200 <= info['status'] < 300:
+            return f"{url}: 無法訪問 (HTTP {info['status']})"
+
+        limits = LIMITS.get(media_type, LIMITS['IMAGE'])
+        content_type = info.get('content_type')
+        if content_type not in limits['types']:
+            if content_type == 'text/html':
+                return f"{url}: 返回的是網頁而不是媒體文件，請提供直接下載的 URL"
+            # 內容類型缺失或為通用類型時以文件開頭判斷
+            content_type = info.get('sniffed_type') or content_type
+        if content_type and content_type not in limits['types'] and \
+                content_type not in ('application/octet-stream', 'binary/octet-stream'):
+            return f"{url}: 不支持的文件類型 {content_type}（支持: {', '.join(limits['types'])}）"
+        if info.get('size') and info['size'] > limits['max_size']:
+            return (f"{url}: 文件大小 {info['size'] / 1024 / 1024:.1f}MB 超過上限 "
+                    f"{limits['max_size'] // 1024 // 1024}MB")
+        return None
+
+
+_default_preflight = None
+_default_lock = threading.Lock()
+
+
+def get_default_preflight():
+    """返回整個進程共用的預檢器（共用結果快取）"""
+    global _default_preflight
+    with _default_lock:
+        if _default_preflight is None:
+            _default_preflight = MediaPreflight()
+        return _default_preflight
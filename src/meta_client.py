@@ -0,0 +1,221 @@
+import os
+import time
+import threading
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+
+from src.token_manager import TokenManager
+from src.json_store import JsonFileStore
+from src.metrics import traced
+
+# 每個頁面請求的欄位；關聯的 Instagram 帳戶以欄位展開在同一個請求中取得
+PAGE_FIELDS = ('id,name,username,category,fan_count,verification_status,link,'
+               'instagram_business_account{id,username}')
+
+# 商業帳戶的頁面邊：自有頁面和代管的客戶頁面
+EDGES = ('owned_pages', 'client_pages')
+
+# 每個廣告帳戶請求的欄位，以及商業帳戶的廣告帳戶邊
+AD_ACCOUNT_FIELDS = 'id,account_id,name,account_status,currency,timezone_name'
+AD_ACCOUNT_EDGES = ('owned_ad_accounts', 'client_ad_accounts')
+
+PAGE_SIZE = int(os.getenv('BUSINESS_PAGES_PAGE_SIZE', '100'))
+
+# 默認快取 1 小時
+CACHE_TTL = int(os.getenv('BUSINESS_PAGES_CACHE_TTL', '3600'))
+
+
+class BusinessPagesCache:
+    """商業帳戶頁面列表的磁盤快取
+
+    每個商業帳戶一個條目，包含頁面列表和 `cached_at`，超過 TTL 的條目
+    視為不存在。與帳戶快取一樣使用鎖文件和原子寫入。
+    """
+
+    def __init__(self, path=None, ttl=CACHE_TTL):
+        """初始化快取
+
+        Args:
+            path: 快取文件路徑，默認為 config/business_pages_cache.json
+            ttl: 條目有效秒數
+        """
+        if path is None:
+            base_dir = Path(__file__).parent.parent
+            path = os.getenv('BUSINESS_PAGES_CACHE_FILE') or os.path.join(
+                base_dir, 'config', 'business_pages_cache.json')
+        self.path = path
+        self.ttl = ttl
+        self._store = JsonFileStore(path)
+
+    def get(self, business_id):
+        """返回未過期的頁面列表，沒有或已過期時返回 None"""
+        entry = self._store.get(str(business_id))
+        if not entry or entry.get('cached_at', 0) + self.ttl <= time.time():
+            return None
+        return entry['pages']
+
+    def set(self, business_id, pages):
+        self._store.set(str(business_id), {'pages': pages, 'cached_at': int(time.time())})
+
+    def invalidate(self, business_id=None):
+        """刪除一個商業帳戶的條目；business_id 為 None 時清空整個快取"""
+        if business_id is None:
+            self._store.clear()
+        else:
+            self._store.delete(str(business_id))
+
+
+def _next_cursor(edge_data):
+    paging = edge_data.get('paging') or {}
+    return (paging.get('cursors') or {}).get('after') if paging.get('next') else None
+
+
+class MetaBusinessClient:
+    """查詢 Meta 商業帳戶資產的客戶端
+
+    頁面（或廣告帳戶）列表的第一頁以一個請求同時取得自有和客戶的邊
+    （欄位展開），之後各個邊在各自的執行緒中並行翻頁。結果存入磁盤快取，
+    TTL 內重複查詢不會發出任何請求。
+    """
+
+    def __init__(self, business_id=None, app_id=None, app_secret=None, token_manager=None,
+                 cache=None, page_size=PAGE_SIZE, fields=PAGE_FIELDS):
+        """初始化客戶端
+
+        Args:
+            business_id: 商業帳戶 ID（默認使用 BUSINESS_ID 環境變量）
+            app_id: Facebook 應用 ID（默認使用 APP_ID 環境變量）
+            app_secret: Facebook 應用密鑰（默認使用 APP_SECRET 環境變量）
+            token_manager: 共用的 TokenManager（默認新建一個）
+            cache: BusinessPagesCache（默認新建一個）
+            page_size: 每個請求的頁面數量
+            fields: 每個頁面請求的欄位
+
+        Raises:
+            ValueError: 缺少商業帳戶 ID 或應用憑證
+        """
+        from dotenv import load_dotenv
+
+        load_dotenv()
+        load_dotenv('config/.env')
+
+        self.business_id = business_id or os.getenv('BUSINESS_ID')
+        if not self.business_id:
+            raise ValueError("缺少 BUSINESS_ID，請檢查環境變量")
+        self.token_manager = token_manager or TokenManager(app_id=app_id, app_secret=app_secret)
+        self.cache = cache or BusinessPagesCache()
+        self.page_size = page_size
+        self.fields = fields
+        self._api = None
+        self._lock = threading.Lock()
+
+    @property
+    def api(self):
+        """以用戶令牌建立的 API 實例（第一次使用時才建立）"""
+        with self._lock:
+            if self._api is None:
+                from src.graph_api import GraphApi
+
+                manager = self.token_manager
+                self._api = GraphApi.create(manager.app_id, manager.app_secret,
+                                            manager.get_valid_user_token(), governor=manager.governor)
+            return self._api
+
+    @traced('business.pages')
+    def get_business_pages(self, refresh=False, edges=EDGES):
+        """返回商業帳戶的所有頁面
+
+        Args:
+            refresh: 忽略快取，重新向 API 查詢
+            edges: 要查詢的邊（owned_pages、client_pages）
+
+        Returns:
+            頁面字典列表；每個頁面包含請求的欄位，以及 `source`
+            （owned 或 client）
+        """
+        key = self.business_id if tuple(edges) == EDGES else f"{self.business_id}:{','.join(edges)}"
+        return self._cached(key, edges, self.fields, refresh)
+
+    @traced('business.ad_accounts')
+    def get_ad_accounts(self, refresh=False, edges=AD_ACCOUNT_EDGES):
+        """返回商業帳戶的所有廣告帳戶
+
+        Args:
+            refresh: 忽略快取，重新向 API 查詢
+            edges: 要查詢的邊（owned_ad_accounts、client_ad_accounts）
+
+        Returns:
+            廣告帳戶字典列表；`id` 為 act_ 開頭的 ID，另包含 `source`
+        """
+        return self._cached(f"{self.business_id}:{','.join(edges)}", edges, AD_ACCOUNT_FIELDS, refresh)
+
+    def _cached(self, key, edges, fields, refresh):
+        if not refresh:
+            items = self.cache.get(key)
+            if items is not None:
+                return items
+
+        items, complete = self._fetch_assets(edges, fields)
+        # 部分邊失敗時不快取，下次重新查詢
+        if complete:
+            self.cache.set(key, items)
+        return items
+
+    def _get(self, path, params):
+        return self.api.call('GET', path, params=params).json()
+
+    def _fetch_first_pages(self, edges, fields):
+        """以一個請求取得每個邊的第一頁"""
+        expanded = ','.join(f"{edge}.limit({self.page_size}){{{fields}}}" for edge in edges)
+        data = self._get((self.business_id,), {'fields': expanded})
+        return {edge: data.get(edge) or {} for edge in edges}
+
+    def _fetch_edge(self, edge, fields, first_page=None):
+        """從第一頁開始按游標翻完一個邊"""
+        page = first_page
+        if page is None:
+            page = self._get((self.business_id, edge), {'fields': fields, 'limit': self.page_size})
+        items = []
+        while True:
+            items.extend(page.get('data') or [])
+            cursor = _next_cursor(page)
+            if not cursor:
+                return items
+            page = self._get((self.business_id, edge),
+                             {'fields': fields, 'limit': self.page_size, 'after': cursor})
+
+    def _fetch_assets(self, edges, fields):
+        """並行查詢所有邊，返回 (去重後的列表, 是否所有邊都成功)"""
+        from facebook_business.exceptions import FacebookRequestError
+
+        try:
+            first_pages = self._fetch_first_pages(edges, fields)
+        except FacebookRequestError:
+            # 例如沒有客戶頁面的權限時整個請求失敗；改為分別查詢，保留可用的邊
+            first_pages = {}
+
+        results = {}
+        errors = {}
+        with ThreadPoolExecutor(max_workers=len(edges), thread_name_prefix='business-pages') as executor:
+            futures = {edge: executor.submit(self._fetch_edge, edge, fields, first_pages.get(edge)) for edge in edges}
+            for edge, future in futures.items():
+                try:
+                    results[edge] = future.result()
+                except FacebookRequestError as e:
+                    errors[edge] = e
+
+        if errors and not results:
+            raise next(iter(errors.values()))
+        for edge, error in errors.items():
+            print(f"警告: 無法查詢 {edge}: {error.api_error_message() or error}")
+
+        items = []
+        seen = set()
+        for edge in edges:
+            source = edge.split('_')[0]
+            for item in results.get(edge, []):
+                if item.get('id') in seen:
+                    continue
+                seen.add(item.get('id'))
+                items.append(dict(item, source=source))
+        return items, not errors
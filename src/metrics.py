@@ -0,0 +1,521 @@
+import os
+import sys
+import json
+import time
+import atexit
+import functools
+import threading
+import contextvars
+from bisect import bisect_left
+
+# 輸出目標，可通過環境變量設置；都未設置時不收集任何數據
+METRICS_FILE = os.getenv('GRAPH_METRICS_FILE')
+METRICS_PORT = int(os.getenv('GRAPH_METRICS_PORT') or 0)
+METRICS_LOG = os.getenv('GRAPH_METRICS_LOG')
+
+# Prometheus 文本文件的寫入間隔秒數
+FLUSH_INTERVAL = float(os.getenv('GRAPH_METRICS_INTERVAL', '15'))
+
+# 延遲直方圖的桶邊界（秒）
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0)
+
+# 指標名稱: (類型, 說明)
+METRICS = {
+    'graph_requests_total': ('counter', 'Graph API 請求次數（每次嘗試），按端點和結果分類'),
+    'graph_request_duration_seconds': ('histogram', 'Graph API 請求延遲'),
+    'graph_errors_total': ('counter', 'Graph API 錯誤次數，按錯誤代碼分類'),
+    'graph_retries_total': ('counter', '重試次數，按錯誤分類'),
+    'graph_circuit_rejections_total': ('counter', '熔斷器開啟時被拒絕的請求數'),
+    'graph_bytes_sent_total': ('counter', '請求內容的位元組數'),
+    'graph_bytes_received_total': ('counter', '回應內容的位元組數'),
+    'graph_rate_wait_seconds_total': ('counter', '在速率控制器中等待的總秒數'),
+    'graph_span_duration_seconds': ('histogram', '發布、容器處理、令牌刷新等操作的耗時'),
+}
+
+# 協程函數的 code flag（inspect.CO_COROUTINE），避免在啟動時載入 asyncio/inspect
+_CO_COROUTINE = 0x80
+
+_current_span = contextvars.ContextVar('graph_span', default=None)
+
+
+def _new_id(size):
+    return os.urandom(size).hex()
+
+
+class Span:
+    """一個被追蹤的操作，結束時記錄耗時並輸出 span 事件
+
+    同一執行緒（或 asyncio 任務）內嵌套的 span 共用 trace_id，
+    期間發出的 Graph API 請求事件也會帶上目前 span 的 ID。
+    """
+
+    def __init__(self, metrics, name, attributes):
+        parent = _current_span.get()
+        self.metrics = metrics
+        self.name = name
+        self.attributes = attributes
+        self.trace_id = parent.trace_id if parent else _new_id(16)
+        self.span_id = _new_id(8)
+        self.parent_id = parent.span_id if parent else None
+        self.parent_name = parent.name if parent else None
+        self.start = None
+        self.duration = None
+        self.cpu = None
+        self._started = None
+        self._cpu_started = None
+        self._token = None
+
+    def set(self, **attributes):
+        """加入或更新 span 的屬性"""
+        self.attributes.update(attributes)
+
+    def __enter__(self):
+        self.start = time.time()
+        self._started = time.perf_counter()
+        self._cpu_started = time.process_time()
+        self._token = _current_span.set(self)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.duration = time.perf_counter() - self._started
+        # 整個進程的 CPU 時間（包括期間其他執行緒的工作）
+        self.cpu = time.process_time() - self._cpu_started
+        _current_span.reset(self._token)
+        self.metrics._end_span(self, exc)
+        return False
+
+
+class _NoopSpan:
+    """停用時使用的 span，不記錄任何內容"""
+
+    def set(self, **attributes):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+_NOOP_SPAN = _NoopSpan()
+
+
+class Sink:
+    """指標輸出目標的基本類別
+
+    attach() 在加入 Metrics 時調用；emit() 接收每個事件（Graph API 請求、
+    重試、span）；close() 在進程結束前調用。
+    """
+
+    def attach(self, metrics):
+        pass
+
+    def emit(self, event):
+        pass
+
+    def close(self):
+        pass
+
+
+class JsonLogSink(Sink):
+    """將每個事件寫成一行 JSON
+
+    Args:
+        target: 文件路徑，`-` 表示標準錯誤輸出
+    """
+
+    def __init__(self, target):
+        self.target = target
+        self._stream = sys.stderr if target == '-' else open(target, 'a', encoding='utf-8')
+        self._lock = threading.Lock()
+
+    def emit(self, event):
+        line = json.dumps(event, ensure_ascii=False, default=str)
+        with self._lock:
+            self._stream.write(line + '\n')
+            self._stream.flush()
+
+    def close(self):
+        if self._stream is not sys.stderr:
+            with self._lock:
+                self._stream.close()
+
+
+class PrometheusFileSink(Sink):
+    """定期將指標寫入 Prometheus 文本格式文件（例如 node_exporter 的 textfile 目錄）
+
+    進程結束時會再寫入一次，短時間運行的命令也能留下完整的數據。
+    """
+
+    def __init__(self, path, interval=FLUSH_INTERVAL):
+        self.path = path
+        self.interval = interval
+        self._metrics = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    def attach(self, metrics):
+        self._metrics = metrics
+        if self.interval > 0:
+            self._thread = threading.Thread(target=self._run, name='metrics-file', daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.write()
+
+    def write(self):
+        """以原子方式寫入目前的指標"""
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        temp_path = f"{self.path}.tmp"
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            f.write(self._metrics.render_prometheus())
+        os.replace(temp_path, self.path)
+
+    def close(self):
+        self._stop.set()
+        if self._metrics is not None:
+            self.write()
+
+
+class PrometheusHttpSink(Sink):
+    """在 HTTP 端點 `/metrics` 提供 Prometheus 文本格式的指標"""
+
+    def __init__(self, port, host='127.0.0.1'):
+        self.port = port
+        self.host = host
+        self._server = None
+
+    def attach(self, metrics):
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split('?')[0] not in ('/', '/metrics'):
+                    self.send_error(404)
+                    return
+                body = metrics.render_prometheus().encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self._server = ThreadingHTTPServer((self.host, self.port), Handler)
+        self._server.daemon_threads = True
+        self.port = self._server.server_address[1]
+        threading.Thread(target=self._server.serve_forever, name='metrics-http', daemon=True).start()
+
+    def close(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+
+class _Histogram:
+    __slots__ = ('counts', 'sum', 'count')
+
+    def __init__(self, size):
+        self.counts = [0] * size
+        self.sum = 0.0
+        self.count = 0
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(labels, extra=None):
+    pairs = list(labels) + ([extra] if extra else [])
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{key}="{_escape(value)}"' for key, value in pairs) + '}'
+
+
+def _format_value(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metrics:
+    """Graph API 調用的計數、延遲直方圖和追蹤 span
+
+    沒有任何輸出目標時 `enabled` 為 False；熱路徑上的調用者先檢查該
+    屬性再記錄，span() 則直接返回不做任何事的空 span。
+    """
+
+    def __init__(self, sinks=None, buckets=BUCKETS):
+        self.buckets = tuple(buckets)
+        self._sinks = []
+        self._counters = {}
+        self._histograms = {}
+        self._lock = threading.Lock()
+        self.enabled = False
+        for sink in sinks or ():
+            self.add_sink(sink)
+
+    def add_sink(self, sink):
+        """加入輸出目標並開始收集數據"""
+        sink.attach(self)
+        with self._lock:
+            self._sinks.append(sink)
+        self.enabled = True
+        return sink
+
+    @property
+    def sinks(self):
+        return list(self._sinks)
+
+    def close(self):
+        """關閉所有輸出目標（會寫出最後一次的指標）"""
+        with self._lock:
+            sinks, self._sinks = self._sinks, []
+        self.enabled = False
+        for sink in sinks:
+            sink.close()
+
+    def inc(self, name, value=1, **labels):
+        """增加計數器"""
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def observe(self, name, value, **labels):
+        """記錄一個直方圖觀測值"""
+        key = (name, tuple(sorted(labels.items())))
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = _Histogram(len(self.buckets) + 1)
+            histogram.counts[index] += 1
+            histogram.sum += value
+            histogram.count += 1
+
+    def emit(self, event):
+        """將事件發送給所有輸出目標，附加時間戳和目前的 span"""
+        span = _current_span.get()
+        if span is not None and 'trace_id' not in event:
+            event['trace_id'] = span.trace_id
+            event['parent_id'] = span.span_id
+        event.setdefault('ts', round(time.time(), 6))
+        for sink in self._sinks:
+            sink.emit(event)
+
+    def record_call(self, endpoint, duration, error=None, kind=None, attempt=1):
+        """記錄一次 Graph API 請求嘗試
+
+        Args:
+            endpoint: 端點名稱（見 resilience.endpoint_key）
+            duration: 耗時秒數
+            error: 失敗時的異常
+            kind: 錯誤分類（transient/throttled/permanent）
+            attempt: 第幾次嘗試
+        """
+        outcome = 'ok' if error is None else (kind or 'error')
+        self.inc('graph_requests_total', endpoint=endpoint, outcome=outcome)
+        self.observe('graph_request_duration_seconds', duration, endpoint=endpoint)
+        event = {'event': 'graph_call', 'endpoint': endpoint, 'outcome': outcome,
+                 'duration_ms': round(duration * 1000, 2), 'attempt': attempt}
+        if error is not None:
+            code = getattr(error, 'api_error_code', None)
+            code = code() if callable(code) else None
+            label = code if code is not None else type(error).__name__
+            self.inc('graph_errors_total', endpoint=endpoint, code=label)
+            event['code'] = label
+            event['error'] = str(getattr(error, 'api_error_message', lambda: None)() or error)[:200]
+        self.emit(event)
+
+    def record_retry(self, endpoint, kind, attempt, delay):
+        """記錄一次重試"""
+        self.inc('graph_retries_total', endpoint=endpoint, kind=kind)
+        self.emit({'event': 'graph_retry', 'endpoint': endpoint, 'kind': kind,
+                   'attempt': attempt, 'delay_ms': round(delay * 1000, 2)})
+
+    def record_circuit_open(self, endpoint):
+        """記錄一次因熔斷而未發送的請求"""
+        self.inc('graph_circuit_rejections_total', endpoint=endpoint)
+        self.emit({'event': 'graph_circuit_open', 'endpoint': endpoint})
+
+    def record_bytes(self, endpoint, sent, received):
+        """記錄傳輸的位元組數"""
+        if sent:
+            self.inc('graph_bytes_sent_total', sent, endpoint=endpoint)
+        if received:
+            self.inc('graph_bytes_received_total', received, endpoint=endpoint)
+
+    def record_transfer(self, response, stream=False):
+        """從 requests 回應記錄傳輸的位元組數（作為 Session 的 response hook）"""
+        from src.graph_batch import GRAPH_URL
+        from src.resilience import endpoint_key
+
+        request = response.request
+        if request.url.startswith(GRAPH_URL):
+            endpoint = endpoint_key(request.method, request.url)
+        else:
+            endpoint = f"{request.method} external"
+        body = request.body
+        sent = len(body) if body is not None and not hasattr(body, 'read') else 0
+        if request.method == 'HEAD':
+            received = 0
+        elif stream:
+            # 串流回應的內容由調用者讀取，只能使用標頭中的長度
+            received = int(response.headers.get('Content-Length') or 0)
+        else:
+            received = len(response.content or b'')
+        self.record_bytes(endpoint, sent, received)
+
+    def span(self, name, **attributes):
+        """返回追蹤一個操作的 context manager
+
+        Example:
+            with metrics.span('publish', media_type='IMAGE') as span:
+                ...
+                span.set(media_id=media_id)
+        """
+        if not self.enabled:
+            return _NOOP_SPAN
+        return Span(self, name, attributes)
+
+    def _end_span(self, span, error):
+        outcome = 'ok' if error is None else 'error'
+        self.observe('graph_span_duration_seconds', span.duration, span=span.name, outcome=outcome)
+        event = {'event': 'span', 'name': span.name, 'trace_id': span.trace_id,
+                 'span_id': span.span_id, 'parent_id': span.parent_id, 'parent': span.parent_name,
+                 'start': round(span.start, 6), 'duration_ms': round(span.duration * 1000, 2),
+                 'cpu_ms': round(span.cpu * 1000, 2), 'outcome': outcome}
+        if error is not None:
+            event['error'] = str(error)[:200]
+        if span.attributes:
+            event['attributes'] = span.attributes
+        self.emit(event)
+
+    def snapshot(self):
+        """返回 {'counters': {...}, 'histograms': {...}}，鍵為 (名稱, 標籤) 元組"""
+        with self._lock:
+            return {
+                'counters': dict(self._counters),
+                'histograms': {key: {'count': h.count, 'sum': h.sum, 'buckets': list(h.counts)}
+                               for key, h in self._histograms.items()},
+            }
+
+    def render_prometheus(self):
+        """以 Prometheus 文本格式返回所有指標"""
+        with self._lock:
+            counters = sorted(self._counters.items())
+            histograms = sorted((key, (list(h.counts), h.sum, h.count))
+                                for key, h in self._histograms.items())
+
+        lines = []
+        described = set()
+
+        def describe(name):
+            if name not in described:
+                described.add(name)
+                kind, help_text = METRICS.get(name, ('untyped', ''))
+                lines.append(f"# HELP {name} {help_text}")
+                lines.append(f"# TYPE {name} {kind}")
+
+        for (name, labels), value in counters:
+            describe(name)
+            lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+
+        for (name, labels), (counts, total, count) in histograms:
+            describe(name)
+            cumulative = 0
+            for bound, bucket in zip(self.buckets, counts):
+                cumulative += bucket
+                lines.append(f"{name}_bucket{_format_labels(labels, ('le', bound))} {cumulative}")
+            lines.append(f"{name}_bucket{_format_labels(labels, ('le', '+Inf'))} {count}")
+            lines.append(f"{name}_sum{_format_labels(labels)} {_format_value(total)}")
+            lines.append(f"{name}_count{_format_labels(labels)} {count}")
+
+        return '\n'.join(lines) + '\n' if lines else ''
+
+
+def traced(name, **attributes):
+    """以 span 追蹤函數調用的裝飾器（支援協程函數）
+
+    停用時只多一次屬性檢查。
+    """
+    def decorator(func):
+        if getattr(func, '__code__', None) and func.__code__.co_flags & _CO_COROUTINE:
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                metrics = get_default_metrics()
+                if not metrics.enabled:
+                    return await func(*args, **kwargs)
+                with metrics.span(name, **attributes):
+                    return await func(*args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            metrics = get_default_metrics()
+            if not metrics.enabled:
+                return func(*args, **kwargs)
+            with metrics.span(name, **attributes):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def current_span():
+    """返回目前的 span，沒有時返回空 span（可直接調用 set()）"""
+    return _current_span.get() or _NOOP_SPAN
+
+
+def transfer_hook(response, *args, **kwargs):
+    """requests 的 response hook，記錄每個 HTTP 回應的傳輸位元組數"""
+    metrics = get_default_metrics()
+    if metrics.enabled:
+        metrics.record_transfer(response, stream=kwargs.get('stream', False))
+    return response
+
+
+_default_metrics = None
+_default_lock = threading.Lock()
+
+
+def configure(metrics_file=METRICS_FILE, port=METRICS_PORT, log=METRICS_LOG, metrics=None):
+    """按參數為 Metrics 加入輸出目標
+
+    Args:
+        metrics_file: Prometheus 文本文件路徑
+        port: 提供 /metrics 端點的埠號
+        log: JSON 日誌文件路徑，`-` 表示標準錯誤輸出
+        metrics: 要設置的 Metrics，默認為進程共用的實例
+
+    Returns:
+        設置後的 Metrics
+    """
+    metrics = metrics or get_default_metrics()
+    was_enabled = metrics.enabled
+    if metrics_file:
+        metrics.add_sink(PrometheusFileSink(metrics_file))
+    if port:
+        metrics.add_sink(PrometheusHttpSink(port))
+    if log:
+        metrics.add_sink(JsonLogSink(log))
+    if metrics.enabled and not was_enabled:
+        atexit.register(metrics.close)
+    return metrics
+
+
+def get_default_metrics():
+    """返回整個進程共用的 Metrics，首次調用時按環境變量設置輸出目標"""
+    global _default_metrics
+    # 熱路徑上每次請求都會調用，已建立時不需要取得鎖
+    metrics = _default_metrics
+    if metrics is not None:
+        return metrics
+    with _default_lock:
+        if _default_metrics is None:
+            _default_metrics = configure(metrics=Metrics())
+        return _default_metrics
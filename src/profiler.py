@@ -0,0 +1,194 @@
+import sys
+import json
+import time
+import platform
+import threading
+
+from src.metrics import Sink, get_default_metrics
+
+
+class PhaseProfiler(Sink):
+    """按階段分析一次命令的耗時
+
+    作為 Metrics 的輸出目標接收 span 事件，每個 span 名稱就是一個階段
+    （config.load、token.store.load、token.refresh.*、account.lookup、
+    container.create.*、container.wait、media.publish 等）。按階段累計調用
+    次數、牆鐘時間、扣除子階段後的自身時間、CPU 時間，以及在該階段中
+    直接發出的 Graph API 請求數和耗時。可選同時以 cProfile 記錄主執行緒
+    的函數調用。
+    """
+
+    def __init__(self, command=None, pstats_path=None, origin=None):
+        """初始化
+
+        Args:
+            command: 報告中記錄的命令名稱
+            pstats_path: 提供時以 cProfile 分析並把統計寫入此文件
+            origin: 模組開始載入時的 (perf_counter, process_time)，
+                提供時到 start() 為止的時間記為 imports 階段
+        """
+        self.command = command
+        self.pstats_path = pstats_path
+        self.origin = origin
+        self._phases = {}
+        self._children = {}
+        self._requests = {}
+        self._unattributed = [0, 0.0]
+        self._lock = threading.Lock()
+        self._started = None
+        self._stopped = None
+        self._profile = None
+
+    def start(self, metrics=None):
+        """開始記錄（會啟用 Metrics 的 span）"""
+        now = (time.perf_counter(), time.process_time())
+        if self.origin:
+            self.add_phase('imports', (now[0] - self.origin[0]) * 1000, (now[1] - self.origin[1]) * 1000,
+                           start=time.time() - (now[0] - self.origin[0]))
+        self._started = self.origin or now
+        (metrics or get_default_metrics()).add_sink(self)
+        if self.pstats_path:
+            import cProfile
+
+            self._profile = cProfile.Profile()
+            self._profile.enable()
+        return self
+
+    def stop(self):
+        """停止記錄並返回報告"""
+        if self._profile is not None:
+            self._profile.disable()
+            self._profile.dump_stats(self.pstats_path)
+            self._profile = None
+        self._stopped = (time.perf_counter(), time.process_time())
+        return self.report()
+
+    def add_phase(self, name, wall_ms, cpu_ms, parent=None, start=None):
+        """加入一個不是以 span 記錄的階段"""
+        with self._lock:
+            self._record(name, parent, start or time.time(), wall_ms, wall_ms, cpu_ms, 0, 0.0, False)
+
+    def emit(self, event):
+        kind = event.get('event')
+        if kind == 'graph_call':
+            # 請求事件的 parent_id 是發出請求時所在的 span
+            span_id = event.get('parent_id')
+            with self._lock:
+                entry = self._requests.setdefault(span_id, [0, 0.0]) if span_id else self._unattributed
+                entry[0] += 1
+                entry[1] += event['duration_ms']
+        elif kind == 'span':
+            with self._lock:
+                children = self._children.pop(event['span_id'], 0.0)
+                requests, request_ms = self._requests.pop(event['span_id'], (0, 0.0))
+                if event['parent_id']:
+                    self._children[event['parent_id']] = \
+                        self._children.get(event['parent_id'], 0.0) + event['duration_ms']
+                self._record(event['name'], event.get('parent'), event['start'], event['duration_ms'],
+                             max(0.0, event['duration_ms'] - children), event['cpu_ms'],
+                             requests, request_ms, event['outcome'] != 'ok')
+
+    def _record(self, name, parent, start, wall_ms, self_ms, cpu_ms, requests, request_ms, error):
+        phase = self._phases.get(name)
+        if phase is None:
+            phase = self._phases[name] = {
+                'name': name, 'parent': parent, 'first_start': start, 'calls': 0, 'errors': 0,
+                'wall_ms': 0.0, 'self_ms': 0.0, 'cpu_ms': 0.0, 'requests': 0, 'request_ms': 0.0,
+            }
+        phase['first_start'] = min(phase['first_start'], start)
+        phase['calls'] += 1
+        phase['errors'] += int(error)
+        phase['wall_ms'] += wall_ms
+        phase['self_ms'] += self_ms
+        phase['cpu_ms'] += cpu_ms
+        phase['requests'] += requests
+        phase['request_ms'] += request_ms
+
+    def report(self):
+        """返回可序列化為 JSON 的報告，階段按第一次開始的時間排列"""
+        end = self._stopped or (time.perf_counter(), time.process_time())
+        with self._lock:
+            phases = sorted(self._phases.values(), key=lambda phase: phase['first_start'])
+            requests = sum(phase['requests'] for phase in phases) + self._unattributed[0]
+            request_ms = sum(phase['request_ms'] for phase in phases) + self._unattributed[1]
+            phases = [
+                {key: round(value, 2) if isinstance(value, float) else value
+                 for key, value in phase.items() if key != 'first_start'}
+                for phase in phases
+            ]
+        started = self._started or end
+        return {
+            'command': self.command,
+            'python': platform.python_version(),
+            'platform': sys.platform,
+            'total': {
+                'wall_ms': round((end[0] - started[0]) * 1000, 2),
+                'cpu_ms': round((end[1] - started[1]) * 1000, 2),
+                'requests': requests,
+                'request_ms': round(request_ms, 2),
+            },
+            'phases': phases,
+        }
+
+
+def _depths(phases):
+    names = {phase['name']: phase for phase in phases}
+    depths = {}
+
+    def depth(name, seen=()):
+        if name not in depths:
+            parent = names.get(name, {}).get('parent')
+            depths[name] = 0 if parent not in names or parent in seen else depth(parent, seen + (name,)) + 1
+        return depths[name]
+
+    return {phase['name']: depth(phase['name']) for phase in phases}
+
+
+def format_report(report):
+    """將報告格式化為文字表格，子階段按層級縮排"""
+    phases = report['phases']
+    depths = _depths(phases)
+    lines = [f"{'phase':32s} {'calls':>6s} {'wall ms':>10s} {'self ms':>10s} {'cpu ms':>10s} "
+             f"{'requests':>8s} {'req ms':>10s}"]
+    for phase in phases:
+        name = '  ' * depths[phase['name']] + phase['name']
+        if phase['errors']:
+            name += f" ({phase['errors']} failed)"
+        lines.append(f"{name:32s} {phase['calls']:6d} {phase['wall_ms']:10.1f} {phase['self_ms']:10.1f} "
+                     f"{phase['cpu_ms']:10.1f} {phase['requests']:8d} {phase['request_ms']:10.1f}")
+    total = report['total']
+    lines.append(f"{'total':32s} {'':6s} {total['wall_ms']:10.1f} {'':10s} {total['cpu_ms']:10.1f} "
+                 f"{total['requests']:8d} {total['request_ms']:10.1f}")
+    return '\n'.join(lines)
+
+
+def compare_reports(baseline, report, tolerance=0.2, min_ms=5.0):
+    """比較兩份報告，返回牆鐘時間明顯變慢的階段
+
+    Args:
+        baseline: 基準報告
+        report: 新的報告
+        tolerance: 允許的相對增幅
+        min_ms: 忽略增加少於此毫秒數的階段（避免短階段的噪音）
+
+    Returns:
+        [(階段, 基準 ms, 目前 ms)]，包括 total
+    """
+    before = {phase['name']: phase['wall_ms'] for phase in baseline.get('phases', [])}
+    before['total'] = baseline.get('total', {}).get('wall_ms', 0.0)
+    after = {phase['name']: phase['wall_ms'] for phase in report['phases']}
+    after['total'] = report['total']['wall_ms']
+
+    slower = []
+    for name, value in after.items():
+        base = before.get(name)
+        if base is not None and value - base >= min_ms and value > base * (1 + tolerance):
+            slower.append((name, base, value))
+    return slower
+
+
+def write_report(report, path):
+    """以固定的鍵順序寫入 JSON 報告，方便在版本之間比較"""
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2, sort_keys=True, ensure_ascii=False)
+        f.write('\n')
@@ -0,0 +1,257 @@
+import os
+import json
+import time
+import uuid
+import hashlib
+import threading
+from pathlib import Path
+
+# 未發布的媒體容器在 24 小時後過期
+CONTAINER_TTL = 86400
+
+# 發布權的認領在此秒數後視為失效（持有者可能已經崩潰）
+CLAIM_TTL = int(os.getenv('PUBLISH_CLAIM_TTL', '1800'))
+
+# 發布流程的狀態
+CLAIMED = 'claimed'          # 已認領發布權，尚未開始創建容器
+CREATING = 'creating'        # 已開始創建容器（可能已在 API 端創建但未記錄 ID）
+CREATED = 'created'          # 容器已創建，尚未發布
+PUBLISHING = 'publishing'    # 已發出發布請求，結果未知
+PUBLISHED = 'published'      # 已發布
+SCHEDULED = 'scheduled'      # 已創建排程容器
+FAILED = 'failed'            # 最後一次嘗試失敗
+
+DONE_STATES = (PUBLISHED, SCHEDULED)
+
+_COLUMNS = ('ig_account_id', 'media_type', 'container_id', 'container_created_at',
+            'media_id', 'error', 'scheduled_time', 'published_at')
+
+# 舊版帳本缺少的欄位，打開時自動加上
+_ADDED_COLUMNS = {'scheduled_time': 'INTEGER', 'published_at': 'INTEGER', 'claimed_by': 'TEXT',
+                  'claimed_at': 'INTEGER'}
+
+
+class PublishInProgressError(Exception):
+    """另一個進程或執行緒正在發布相同內容"""
+
+    def __init__(self, key):
+        super().__init__(f"相同內容正由另一個嘗試發布中（冪等鍵 {key[:12]}），為避免重複發文已停止")
+        self.key = key
+
+
+class AlreadyPublishedError(Exception):
+    """內容已在先前的嘗試中發布，但找不到其媒體 ID"""
+
+    def __init__(self, key, container_id=None):
+        super().__init__(f"此內容已在先前的嘗試中發布（媒體容器 {container_id or '未知'}），"
+                         f"但無法確定其媒體 ID")
+        self.key = key
+        self.container_id = container_id
+
+
+def idempotency_key(ig_account_id, content, caption, scheduled_time=None):
+    """以目標帳戶、媒體 URL、標題和排程時間計算冪等鍵
+
+    Args:
+        ig_account_id: Instagram 商業帳戶 ID
+        content: 媒體 URL 或輪播的 URL 列表
+        caption: 貼文標題
+        scheduled_time: 排程發布時間（可選）
+    """
+    urls = list(content) if isinstance(content, (list, tuple)) else [content]
+    payload = json.dumps([str(ig_account_id), urls, caption or '', scheduled_time], ensure_ascii=False)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+class PublishLedger:
+    """記錄每次發布進度的本地帳本（SQLite）
+
+    以冪等鍵為主鍵，保存容器 ID、狀態和已發布的媒體 ID。重試同一內容時
+    可以跳過已完成的步驟：已發布的內容直接返回先前的結果，未過期的容器
+    直接重用，不會重複發文。查詢只走主鍵索引，耗時與記錄數量無關。
+    使用 WAL 模式，多個進程可以共用同一個帳本；同時處理同一內容的嘗試
+    以 `claim()` 原子地認領發布權，只有一個能繼續。
+    """
+
+    def __init__(self, path=None):
+        """初始化帳本
+
+        Args:
+            path: SQLite 文件路徑，默認為 PUBLISH_LEDGER_FILE 或 config/publish_ledger.db
+        """
+        import sqlite3
+
+        if path is None:
+            base_dir = Path(__file__).parent.parent
+            path = os.getenv('PUBLISH_LEDGER_FILE') or os.path.join(base_dir, 'config', 'publish_ledger.db')
+        self.path = path
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False, isolation_level=None)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        self._conn.execute(
+            'CREATE TABLE IF NOT EXISTS publishes ('
+            ' key TEXT PRIMARY KEY,'
+            ' ig_account_id TEXT,'
+            ' media_type TEXT,'
+            ' state TEXT NOT NULL,'
+            ' container_id TEXT,'
+            ' container_created_at INTEGER,'
+            ' media_id TEXT,'
+            ' error TEXT,'
+            ' scheduled_time INTEGER,'
+            ' published_at INTEGER,'
+            ' claimed_by TEXT,'
+            ' claimed_at INTEGER,'
+            ' attempts INTEGER NOT NULL DEFAULT 0,'
+            ' created_at INTEGER NOT NULL,'
+            ' updated_at INTEGER NOT NULL)'
+        )
+        existing = {row['name'] for row in self._conn.execute('PRAGMA table_info(publishes)')}
+        for column, column_type in _ADDED_COLUMNS.items():
+            if column not in existing:
+                self._conn.execute(f'ALTER TABLE publishes ADD COLUMN {column} {column_type}')
+        self._conn.execute('CREATE INDEX IF NOT EXISTS publishes_container ON publishes (container_id)')
+        self._conn.execute('CREATE INDEX IF NOT EXISTS publishes_account ON publishes (ig_account_id, state)')
+
+    def get(self, key):
+        """返回一個冪等鍵的記錄（字典），沒有時返回 None"""
+        with self._lock:
+            row = self._conn.execute('SELECT * FROM publishes WHERE key = ?', (key,)).fetchone()
+        return dict(row) if row else None
+
+    def find_container(self, container_id):
+        """根據容器 ID 查找記錄"""
+        with self._lock:
+            row = self._conn.execute('SELECT * FROM publishes WHERE container_id = ?',
+                                     (container_id,)).fetchone()
+        return dict(row) if row else None
+
+    def record(self, key, state, **fields):
+        """寫入或更新一個冪等鍵的狀態
+
+        Args:
+            key: 冪等鍵
+            state: 新狀態
+            **fields: 要更新的其他欄位（ig_account_id, media_type, container_id,
+                container_created_at, media_id, error, scheduled_time, published_at）
+        """
+        unknown = set(fields) - set(_COLUMNS)
+        if unknown:
+            raise ValueError(f"未知的帳本欄位: {', '.join(sorted(unknown))}")
+        keep_created_at = False
+        if fields.get('container_id') and 'container_created_at' not in fields:
+            fields['container_created_at'] = int(time.time())
+            keep_created_at = True
+        if state != FAILED and 'error' not in fields:
+            fields['error'] = None
+        if state == PUBLISHED and 'published_at' not in fields:
+            fields['published_at'] = int(time.time())
+
+        now = int(time.time())
+        columns = ['state', *fields]
+        values = [state, *fields.values()]
+        updates = ', '.join(f"{column} = excluded.{column}" for column in columns)
+        if keep_created_at:
+            # 再次記錄同一個容器時保留其原本的創建時間，以正確判斷過期
+            updates = updates.replace(
+                'container_created_at = excluded.container_created_at',
+                'container_created_at = CASE WHEN container_id IS excluded.container_id'
+                ' THEN container_created_at ELSE excluded.container_created_at END'
+            )
+        # 發布時間只記錄第一次，用於計算發布配額何時恢復
+        updates = updates.replace('published_at = excluded.published_at',
+                                  'published_at = COALESCE(published_at, excluded.published_at)')
+        attempts = ', attempts = attempts + 1' if state == CREATING else ''
+        with self._lock:
+            self._conn.execute(
+                f"INSERT INTO publishes (key, {', '.join(columns)}, attempts, created_at, updated_at)"
+                f" VALUES (?, {', '.join('?' * len(columns))}, ?, ?, ?)"
+                f" ON CONFLICT(key) DO UPDATE SET {updates}, updated_at = excluded.updated_at{attempts}",
+                [key, *values, 1 if state == CREATING else 0, now, now]
+            )
+
+    def claim(self, key, ttl=CLAIM_TTL):
+        """原子地認領一個冪等鍵的發布權
+
+        內容已發布，或另一個嘗試持有 `ttl` 秒內的認領時失敗。成功後必須以
+        `release()` 釋放。
+
+        Returns:
+            認領令牌；失敗時返回 None
+        """
+        token = uuid.uuid4().hex
+        now = int(time.time())
+        with self._lock:
+            cursor = self._conn.execute(
+                'INSERT INTO publishes (key, state, claimed_by, claimed_at, attempts, created_at, updated_at)'
+                ' VALUES (?, ?, ?, ?, 0, ?, ?)'
+                ' ON CONFLICT(key) DO UPDATE SET claimed_by = excluded.claimed_by,'
+                ' claimed_at = excluded.claimed_at'
+                ' WHERE publishes.state != ? AND (publishes.claimed_by IS NULL OR publishes.claimed_at <= ?)',
+                (key, CLAIMED, token, now, now, now, PUBLISHED, now - ttl)
+            )
+        return token if cursor.rowcount == 1 else None
+
+    def release(self, key, token):
+        """釋放 `claim()` 取得的認領（認領已被他人接手時不做任何事）"""
+        with self._lock:
+            self._conn.execute('UPDATE publishes SET claimed_by = NULL, claimed_at = NULL'
+                               ' WHERE key = ? AND claimed_by = ?', (key, token))
+
+    def reusable_container(self, entry):
+        """返回記錄中仍可發布（未過期且未發布）的容器 ID，沒有時返回 None"""
+        if not entry or entry['state'] not in (CREATED, PUBLISHING, FAILED):
+            return None
+        if not entry.get('container_id'):
+            return None
+        if (entry.get('container_created_at') or 0) + CONTAINER_TTL <= time.time():
+            return None
+        return entry['container_id']
+
+    def published_times(self, ig_account_id, since):
+        """返回帳戶在 since 之後發布的時間戳（由舊到新）"""
+        with self._lock:
+            rows = self._conn.execute(
+                'SELECT published_at FROM publishes WHERE ig_account_id = ? AND state = ?'
+                ' AND published_at >= ? ORDER BY published_at',
+                (str(ig_account_id), PUBLISHED, since)
+            ).fetchall()
+        return [row[0] for row in rows]
+
+    def scheduled_times(self, ig_account_id, start, end):
+        """返回帳戶排程在 [start, end) 之間發布的時間戳（由早到晚）"""
+        with self._lock:
+            rows = self._conn.execute(
+                'SELECT scheduled_time FROM publishes WHERE ig_account_id = ? AND state = ?'
+                ' AND scheduled_time >= ? AND scheduled_time < ? ORDER BY scheduled_time',
+                (str(ig_account_id), SCHEDULED, start, end)
+            ).fetchall()
+        return [row[0] for row in rows]
+
+    def count(self, state=None):
+        """記錄數量（可按狀態過濾）"""
+        with self._lock:
+            if state is None:
+                return self._conn.execute('SELECT COUNT(*) FROM publishes').fetchone()[0]
+            return self._conn.execute('SELECT COUNT(*) FROM publishes WHERE state = ?',
+                                      (state,)).fetchone()[0]
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+_default_ledger = None
+_default_lock = threading.Lock()
+
+
+def get_default_ledger():
+    """返回整個進程共用的帳本"""
+    global _default_ledger
+    with _default_lock:
+        if _default_ledger is None:
+            _default_ledger = PublishLedger()
+        return _default_ledger
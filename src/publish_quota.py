@@ -0,0 +1,235 @@
+import os
+import time
+import threading
+from datetime import datetime
+
+from src.metrics import traced
+
+# 每個帳戶在 24 小時滾動窗口內可通過 API 發布的貼文數量
+DEFAULT_QUOTA = 100
+QUOTA_WINDOW = 86400
+
+# 配額用量的快取秒數；期間以本地記錄的發布次數推算用量
+QUOTA_TTL = int(os.getenv('PUBLISH_QUOTA_TTL', '300'))
+
+# 發布配額用盡時 Graph API 返回的錯誤子代碼
+QUOTA_ERROR_SUBCODE = 2207042
+
+
+class QuotaExceededError(Exception):
+    """帳戶的內容發布配額已用完，請求未發送"""
+
+    def __init__(self, ig_account_id, limit, retry_at):
+        when = datetime.fromtimestamp(retry_at).strftime('%Y-%m-%d %H:%M:%S')
+        super().__init__(f"Instagram 帳戶 {ig_account_id} 已用完 24 小時內的發布配額（{limit} 則），"
+                         f"預計 {when} 後可再發布")
+        self.ig_account_id = ig_account_id
+        self.limit = limit
+        self.retry_at = retry_at
+
+
+def is_quota_error(error):
+    """Graph API 錯誤是否表示發布配額已用完"""
+    subcode = getattr(error, 'api_error_subcode', None)
+    return callable(subcode) and subcode() == QUOTA_ERROR_SUBCODE
+
+
+class QuotaReservation:
+    """為一次發布預留的配額；發布成功時 commit()，否則 release()"""
+
+    def __init__(self, quota, ig_account_id):
+        self._quota = quota
+        self.ig_account_id = ig_account_id
+        self._done = False
+
+    def commit(self):
+        if not self._done:
+            self._done = True
+            self._quota._finish(self.ig_account_id, published=True)
+
+    def release(self):
+        if not self._done:
+            self._done = True
+            self._quota._finish(self.ig_account_id, published=False)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.release()
+
+
+class PublishQuota:
+    """按帳戶追蹤內容發布配額（content_publishing_limit）
+
+    用量從 API 查詢後快取 `ttl` 秒，期間以本地發布次數和進行中的預留
+    推算剩餘配額，多個執行緒同時發布時不會超出。配額用完時在發送請求
+    之前就拋出 QuotaExceededError，並根據帳本中的發布時間估計下一個
+    名額何時釋放。
+    """
+
+    def __init__(self, ttl=QUOTA_TTL):
+        self.ttl = ttl
+        self._accounts = {}
+        self._lock = threading.Lock()
+        # 每個帳戶一個查詢鎖，快取過期時只有一個執行緒向 API 查詢
+        self._fetch_locks = {}
+
+    def _fetch(self, publisher):
+        """向 API 查詢帳戶的配額設定和目前用量"""
+        data = publisher.api.call(
+            'GET', (publisher.ig_account_id, 'content_publishing_limit'),
+            params={'fields': 'config,quota_usage'}
+        ).json()
+        entry = (data.get('data') or [{}])[0]
+        config = entry.get('config') or {}
+        return {
+            'limit': config.get('quota_total') or DEFAULT_QUOTA,
+            'window': config.get('quota_duration') or QUOTA_WINDOW,
+            'usage': entry.get('quota_usage') or 0,
+            'fetched_at': time.time(),
+            'published': 0,
+            'reserved': 0,
+        }
+
+    def _account(self, publisher, refresh=False):
+        ig_account_id = publisher.ig_account_id
+        requested_at = time.time()
+        with self._lock:
+            state = self._accounts.get(ig_account_id)
+            if state and not refresh and state['fetched_at'] + self.ttl > requested_at:
+                return state
+            fetch_lock = self._fetch_locks.setdefault(ig_account_id, threading.Lock())
+        with fetch_lock:
+            # 等待期間其他執行緒可能已完成查詢，直接使用其結果
+            with self._lock:
+                state = self._accounts.get(ig_account_id)
+                if state and (state['fetched_at'] >= requested_at if refresh
+                              else state['fetched_at'] + self.ttl > time.time()):
+                    return state
+            fetched = self._fetch(publisher)
+            with self._lock:
+                state = self._accounts.get(ig_account_id)
+                # 保留進行中的預留；之前本地記錄的發布已包含在新的用量中
+                fetched['reserved'] = state['reserved'] if state else 0
+                self._accounts[ig_account_id] = fetched
+                return fetched
+
+    @staticmethod
+    def _remaining(state):
+        return state['limit'] - state['usage'] - state['published'] - state['reserved']
+
+    def status(self, publisher, refresh=False):
+        """返回帳戶的配額狀態
+
+        Returns:
+            {'limit', 'used', 'reserved', 'remaining', 'next_slot'}；
+            next_slot 為下一個名額可用的時間戳
+        """
+        state = self._account(publisher, refresh)
+        with self._lock:
+            remaining = self._remaining(state)
+            status = {
+                'limit': state['limit'],
+                'used': state['usage'] + state['published'],
+                'reserved': state['reserved'],
+                'remaining': max(0, remaining),
+            }
+        status['next_slot'] = int(time.time()) if remaining > 0 else self.plan(publisher, 1)[0]
+        return status
+
+    @traced('quota.reserve')
+    def reserve(self, publisher):
+        """預留一個發布名額，配額用完時拋出 QuotaExceededError"""
+        state = self._account(publisher)
+        with self._lock:
+            if self._remaining(state) > 0:
+                state['reserved'] += 1
+                return QuotaReservation(self, publisher.ig_account_id)
+        raise QuotaExceededError(publisher.ig_account_id, state['limit'], self.plan(publisher, 1)[0])
+
+    def check(self, publisher):
+        """確認還有發布名額（不預留），否則拋出 QuotaExceededError"""
+        self.reserve(publisher).release()
+
+    def _finish(self, ig_account_id, published):
+        with self._lock:
+            state = self._accounts.get(ig_account_id)
+            if state:
+                state['reserved'] = max(0, state['reserved'] - 1)
+                if published:
+                    state['published'] += 1
+
+    def exhausted(self, publisher):
+        """API 報告配額已用完時調用，在下次查詢前不再發出發布請求"""
+        with self._lock:
+            state = self._accounts.get(publisher.ig_account_id)
+            if state:
+                state['usage'] = state['limit']
+                state['published'] = 0
+
+    def plan(self, publisher, count, now=None, offset=0):
+        """為排隊中的貼文安排最早可發布的時間
+
+        目前剩餘的名額安排在現在；之後按帳本中窗口內的發布時間計算名額
+        何時釋放（發布時間 + 24 小時）。帳本中沒有記錄的發布（例如在其他
+        工具發布的貼文）無法得知釋放時間，這部分按一整個窗口之後估計。
+
+        Args:
+            publisher: 帳戶的 InstagramPublisher
+            count: 要安排的貼文數量
+            now: 目前時間（默認為 time.time()）
+            offset: 佇列中排在這些貼文之前的數量
+
+        Returns:
+            由早到晚的 count 個時間戳
+        """
+        now = int(now or time.time())
+        state = self._account(publisher)
+        with self._lock:
+            remaining = max(0, self._remaining(state))
+            window = state['window']
+            used = state['limit'] - remaining
+        released = None
+        slots = []
+        for index in range(offset, offset + count):
+            if index < remaining:
+                slots.append(now)
+                continue
+            if used <= 0:
+                slots.append(now + window)
+                continue
+            if released is None:
+                published = publisher.ledger.published_times(publisher.ig_account_id, now - window)
+                released = sorted(max(now, t + window) for t in published[-used:])
+                released += [now + window] * (used - len(released))
+            # 每過一個窗口，同樣的名額會再次釋放
+            cycle, position = divmod(index - remaining, used)
+            slots.append(released[position] + cycle * window)
+        return slots
+
+    def check_scheduled(self, publisher, scheduled_time):
+        """確認排程時間所在的窗口內還有名額，否則拋出 QuotaExceededError
+
+        以帳本中已排程的貼文計算 scheduled_time 之前 24 小時內的排程數量。
+        """
+        state = self._account(publisher)
+        window = state['window']
+        scheduled = publisher.ledger.scheduled_times(publisher.ig_account_id,
+                                                     scheduled_time - window + 1, scheduled_time + 1)
+        if len(scheduled) >= state['limit']:
+            retry_at = scheduled[len(scheduled) - state['limit']] + window
+            raise QuotaExceededError(publisher.ig_account_id, state['limit'], retry_at)
+
+
+_default_quota = None
+_default_lock = threading.Lock()
+
+
+def get_default_quota():
+    """返回整個進程共用的配額追蹤器"""
+    global _default_quota
+    with _default_lock:
+        if _default_quota is None:
+            _default_quota = PublishQuota()
+        return _default_quota
@@ -0,0 +1,488 @@
+import os
+import json
+import time
+import heapq
+import threading
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+
+from src.publish_ledger import (CONTAINER_TTL, CREATING, CREATED, PUBLISHED as LEDGER_PUBLISHED, idempotency_key,
+                               AlreadyPublishedError, PublishInProgressError)
+from src.publish_quota import QuotaExceededError
+from src.metrics import traced
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+# 發布前多少秒預先創建媒體容器；影片需要處理時間，可視需要調大
+STAGE_AHEAD = int(os.getenv('SCHEDULER_STAGE_AHEAD', '600'))
+
+# 兩次完整載入到期任務之間的最長秒數
+RELOAD_INTERVAL = 60
+
+# 檢查其他進程是否加入了任務的間隔秒數
+CHANGE_CHECK_INTERVAL = 1.0
+
+# 兩次載入之間的最短秒數（積壓的任務全部已到期時避免不停查詢）
+MIN_RELOAD_DELAY = 1.0
+
+# 記憶體中最多同時載入的任務數，也是每次分頁查詢的任務數
+LOAD_LIMIT = 1000
+
+# 發布失敗（配額不足以外）的最多嘗試次數，以及重試前的等待秒數
+MAX_ATTEMPTS = 3
+RETRY_DELAY = 60
+
+# 任務狀態
+PENDING = 'pending'          # 等待預先創建容器
+STAGING = 'staging'          # 正在創建容器
+STAGED = 'staged'            # 容器已創建，等待發布時間
+PUBLISHING = 'publishing'    # 正在發布
+PUBLISHED = 'published'      # 已發布
+FAILED = 'failed'            # 發布失敗
+CANCELLED = 'cancelled'      # 已取消
+
+ACTIVE_STATES = (PENDING, STAGING, STAGED, PUBLISHING)
+
+
+class JobQueue:
+    """排程發布任務的持久佇列（SQLite）
+
+    任務按 (狀態, 發布時間) 建立索引，查詢即將到期的任務只讀取索引中
+    的一小段範圍，佇列中有數十萬個未來任務時也不影響速度。以任務鍵
+    去重，重複加入同一任務會返回原有的任務。使用 WAL 模式，命令行可以
+    在排程器運行時加入或取消任務。
+    """
+
+    def __init__(self, path=None):
+        """初始化佇列
+
+        Args:
+            path: SQLite 文件路徑，默認為 SCHEDULER_QUEUE_FILE 或 config/schedule_queue.db
+        """
+        import sqlite3
+
+        if path is None:
+            base_dir = Path(__file__).parent.parent
+            path = os.getenv('SCHEDULER_QUEUE_FILE') or os.path.join(base_dir, 'config', 'schedule_queue.db')
+        self.path = path
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False, isolation_level=None)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        self._conn.execute(
+            'CREATE TABLE IF NOT EXISTS jobs ('
+            ' id INTEGER PRIMARY KEY AUTOINCREMENT,'
+            ' key TEXT NOT NULL UNIQUE,'
+            ' page_id TEXT,'
+            ' media_type TEXT NOT NULL,'
+            ' content TEXT NOT NULL,'
+            ' caption TEXT,'
+            ' options TEXT,'
+            ' publish_at INTEGER NOT NULL,'
+            ' state TEXT NOT NULL,'
+            ' container_id TEXT,'
+            ' media_id TEXT,'
+            ' error TEXT,'
+            ' attempts INTEGER NOT NULL DEFAULT 0,'
+            ' created_at INTEGER NOT NULL,'
+            ' updated_at INTEGER NOT NULL)'
+        )
+        self._conn.execute('CREATE INDEX IF NOT EXISTS jobs_due ON jobs (state, publish_at)')
+
+    @staticmethod
+    def _job(row):
+        if row is None:
+            return None
+        job = dict(row)
+        job['content'] = json.loads(job['content'])
+        job['options'] = json.loads(job['options'] or '{}')
+        return job
+
+    def add(self, page_id, media_type, content, caption, publish_at, key=None, **options):
+        """加入一個任務；相同任務鍵已存在時返回原有的任務
+
+        Args:
+            page_id: 發布帳戶的 Facebook 頁面 ID
+            media_type: IMAGE, VIDEO 或 CAROUSEL
+            content: 媒體 URL 或輪播的 URL 列表
+            caption: 貼文標題
+            publish_at: 發布時間（Unix 時間戳）
+            key: 任務鍵，同時作為發布帳本的冪等鍵（默認以頁面、URL、標題和時間計算）
+            **options: 傳給 create_and_publish 的其他參數（cover_url, upload_type）
+        """
+        key = key or idempotency_key(f"page:{page_id}", content, caption, int(publish_at))
+        now = int(time.time())
+        with self._lock:
+            self._conn.execute(
+                'INSERT OR IGNORE INTO jobs (key, page_id, media_type, content, caption, options,'
+                ' publish_at, state, created_at, updated_at)'
+                ' VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                (key, str(page_id) if page_id else None, media_type.upper(),
+                 json.dumps(content, ensure_ascii=False), caption,
+                 json.dumps(options, ensure_ascii=False), int(publish_at), PENDING, now, now)
+            )
+            row = self._conn.execute('SELECT * FROM jobs WHERE key = ?', (key,)).fetchone()
+        return self._job(row)
+
+    def get(self, job_id):
+        with self._lock:
+            row = self._conn.execute('SELECT * FROM jobs WHERE id = ?', (job_id,)).fetchone()
+        return self._job(row)
+
+    def due(self, until, limit=LOAD_LIMIT, after=None):
+        """返回發布時間不晚於 until 的未完成任務（按發布時間和 ID 排序）
+
+        Args:
+            until: 發布時間上限
+            limit: 最多返回的任務數
+            after: 上一頁最後一個任務的 (publish_at, id)，只返回排在其後的任務
+        """
+        placeholders = ', '.join('?' * len(ACTIVE_STATES))
+        params = [*ACTIVE_STATES, int(until)]
+        page = ''
+        if after is not None:
+            page = ' AND (publish_at, id) > (?, ?)'
+            params.extend(after)
+        with self._lock:
+            rows = self._conn.execute(
+                f'SELECT * FROM jobs WHERE state IN ({placeholders}) AND publish_at <= ?{page}'
+                f' ORDER BY publish_at, id LIMIT ?',
+                (*params, limit)
+            ).fetchall()
+        return [self._job(row) for row in rows]
+
+    def claim(self, job_id, from_states, state):
+        """只在任務處於 from_states 之一時把它改為 state，返回是否成功"""
+        placeholders = ', '.join('?' * len(from_states))
+        with self._lock:
+            cursor = self._conn.execute(
+                f'UPDATE jobs SET state = ?, updated_at = ? WHERE id = ? AND state IN ({placeholders})',
+                (state, int(time.time()), job_id, *from_states)
+            )
+        return cursor.rowcount == 1
+
+    def update(self, job_id, state=None, **fields):
+        """更新任務狀態和欄位（publish_at, container_id, media_id, error, attempts）"""
+        if state is not None:
+            fields = {'state': state, **fields}
+        columns = [*fields, 'updated_at']
+        values = [*fields.values(), int(time.time())]
+        with self._lock:
+            self._conn.execute(
+                f"UPDATE jobs SET {', '.join(f'{column} = ?' for column in columns)} WHERE id = ?",
+                (*values, job_id)
+            )
+
+    def cancel(self, job_id):
+        """取消尚未開始發布的任務，返回是否成功"""
+        return self.claim(job_id, (PENDING, STAGED), CANCELLED)
+
+    def jobs(self, state=None, limit=50):
+        """按發布時間列出任務（可按狀態過濾）"""
+        with self._lock:
+            if state is None:
+                rows = self._conn.execute('SELECT * FROM jobs ORDER BY publish_at LIMIT ?',
+                                          (limit,)).fetchall()
+            else:
+                rows = self._conn.execute('SELECT * FROM jobs WHERE state = ? ORDER BY publish_at LIMIT ?',
+                                          (state, limit)).fetchall()
+        return [self._job(row) for row in rows]
+
+    def counts(self):
+        """返回 {狀態: 任務數量}"""
+        with self._lock:
+            rows = self._conn.execute('SELECT state, COUNT(*) FROM jobs GROUP BY state').fetchall()
+        return {row[0]: row[1] for row in rows}
+
+    def data_version(self):
+        """其他連線每次提交後都會改變的數值，用於低成本地檢測外部修改"""
+        with self._lock:
+            return self._conn.execute('PRAGMA data_version').fetchone()[0]
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class PublishScheduler:
+    """按時發布佇列中任務的常駐排程器
+
+    只把即將到期的任務載入記憶體中的最小堆，由單一執行緒等待到下一個
+    到期時間，再交給工作執行緒池執行：
+        1. 發布前 `stage_ahead` 秒創建媒體容器（記錄在發布帳本中）
+        2. 到發布時間時以同一冪等鍵調用 create_and_publish，直接重用
+           已創建的容器，發布只需要一次請求
+    每一步都先在佇列中原子地更新狀態再執行，並通過發布帳本去重，重新
+    啟動後會從中斷的步驟繼續，不會遺失或重複發文。配額不足的任務會
+    改到下一個名額可用的時間。
+    """
+
+    def __init__(self, registry, queue=None, stage_ahead=STAGE_AHEAD, workers=4, debug=False):
+        """初始化排程器
+
+        Args:
+            registry: PublisherRegistry，按任務的頁面取得發布器
+            queue: JobQueue，默認打開默認位置的佇列
+            stage_ahead: 發布前多少秒創建容器（不超過容器有效期的一半）
+            workers: 同時執行任務的執行緒數量
+            debug: 輸出每個任務的進度
+        """
+        self.registry = registry
+        self.queue = queue or JobQueue()
+        self.stage_ahead = max(0, min(stage_ahead, CONTAINER_TTL // 2))
+        self.workers = max(1, workers)
+        self.debug = debug
+        self._heap = []
+        self._queued = set()
+        self._condition = threading.Condition()
+        self._stopped = False
+        self._reload = False
+        self._executor = None
+        self._lock_file = None
+
+    def add(self, page_id, media_type, content, caption, publish_at, key=None, **options):
+        """加入任務並喚醒排程器（參數同 JobQueue.add）"""
+        job = self.queue.add(page_id, media_type, content, caption, publish_at, key, **options)
+        self._request_load()
+        return job
+
+    def _request_load(self):
+        """在下一輪重新載入到期任務（本進程的寫入不會改變 data_version）"""
+        with self._condition:
+            self._reload = True
+            self._condition.notify()
+
+    def stop(self):
+        with self._condition:
+            self._stopped = True
+            self._condition.notify()
+
+    def _acquire_lock(self):
+        """同一個佇列只允許一個排程器進程"""
+        self._lock_file = open(f"{self.queue.path}.lock", 'a+')
+        try:
+            if fcntl:
+                fcntl.flock(self._lock_file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+            else:
+                self._lock_file.seek(0)
+                msvcrt.locking(self._lock_file.fileno(), msvcrt.LK_NBLCK, 1)
+        except OSError:
+            self._lock_file.close()
+            self._lock_file = None
+            raise RuntimeError(f"另一個排程器正在處理佇列 {self.queue.path}")
+
+    def _release_lock(self):
+        if self._lock_file is not None:
+            self._lock_file.close()
+            self._lock_file = None
+
+    def _push(self, when, job_id, action):
+        with self._condition:
+            heapq.heappush(self._heap, (when, job_id, action))
+            self._queued.add(job_id)
+            self._condition.notify()
+
+    def _done(self, job_id):
+        with self._condition:
+            self._queued.discard(job_id)
+
+    def _load(self, now):
+        """把即將到期的任務載入堆中，返回下一次需要完整載入的時間
+
+        按 (發布時間, ID) 分頁讀取，跳過已在堆中或執行中的任務，記憶體中
+        最多保留 LOAD_LIMIT 個任務。
+        """
+        horizon = now + self.stage_ahead + RELOAD_INTERVAL
+        with self._condition:
+            queued = set(self._queued)
+        capacity = LOAD_LIMIT - len(queued)
+        added = 0
+        after = None
+        while added < capacity:
+            jobs = self.queue.due(horizon, LOAD_LIMIT, after=after)
+            for job in jobs:
+                after = (job['publish_at'], job['id'])
+                if job['id'] in queued:
+                    continue
+                if job['state'] in (PENDING, STAGING):
+                    self._push(job['publish_at'] - self.stage_ahead, job['id'], 'stage')
+                else:
+                    # 已創建容器或上次發布被中斷的任務
+                    self._push(job['publish_at'], job['id'], 'publish')
+                added += 1
+                if added >= capacity:
+                    break
+            if len(jobs) < LOAD_LIMIT:
+                break
+        if added >= capacity:
+            # 可能還有更多任務在同一時段，載入的任務開始執行後再繼續載入；
+            # 積壓的任務已經到期時也至少間隔 MIN_RELOAD_DELAY 秒
+            next_load = now + RELOAD_INTERVAL
+            if after is not None:
+                next_load = min(next_load, after[0] - self.stage_ahead)
+            return max(now + MIN_RELOAD_DELAY, next_load)
+        return now + RELOAD_INTERVAL
+
+    def run(self):
+        """運行排程器直到調用 stop()"""
+        self._acquire_lock()
+        self._stopped = False
+        self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='scheduler')
+        try:
+            next_load = 0
+            version = self.queue.data_version()
+            next_check = time.time() + CHANGE_CHECK_INTERVAL
+            while True:
+                now = time.time()
+                if now >= next_check:
+                    current = self.queue.data_version()
+                    if current != version:
+                        # 其他進程加入或取消了任務
+                        version = current
+                        next_load = 0
+                    next_check = now + CHANGE_CHECK_INTERVAL
+                with self._condition:
+                    if self._reload:
+                        self._reload = False
+                        next_load = 0
+                if now >= next_load:
+                    next_load = self._load(now)
+
+                with self._condition:
+                    if self._stopped:
+                        break
+                    while self._heap and self._heap[0][0] <= time.time():
+                        _, job_id, action = heapq.heappop(self._heap)
+                        task = self._stage if action == 'stage' else self._publish
+                        self._executor.submit(task, job_id)
+                    if self._reload:
+                        continue
+                    wake_at = min(next_load, next_check)
+                    if self._heap:
+                        wake_at = min(wake_at, self._heap[0][0])
+                    self._condition.wait(max(0, wake_at - time.time()))
+        finally:
+            self._executor.shutdown(wait=True)
+            self._release_lock()
+
+    def _log(self, message):
+        if self.debug:
+            print(message)
+
+    def _publisher(self, job):
+        return self.registry.get(job['page_id'])
+
+    def _claim(self, job_id, from_states, state):
+        """讀取任務並原子地改為 state，返回任務
+
+        任務不存在、已被處理或讀取佇列出錯時返回 None，並把任務移出記憶體
+        （下次載入時重新讀取）。
+        """
+        try:
+            job = self.queue.get(job_id)
+            if job and self.queue.claim(job_id, from_states, state):
+                return job
+        except Exception as e:
+            print(f"警告: 讀取排程任務 {job_id} 時出錯，將在下次載入時重試: {e}")
+        self._done(job_id)
+        return None
+
+    @traced('scheduler.stage')
+    def _stage(self, job_id):
+        """預先創建任務的媒體容器；失敗時留待發布時重新創建"""
+        job = self._claim(job_id, (PENDING, STAGING), STAGING)
+        if job is None:
+            return
+        try:
+            publisher = self._publisher(job)
+            key = job['key']
+            entry = publisher.ledger.get(key)
+            if entry and entry['state'] == LEDGER_PUBLISHED:
+                self._published(job_id, publisher, job)
+                return
+
+            container_id = publisher.ledger.reusable_container(entry)
+            if not container_id:
+                claim = publisher.ledger.claim(key)
+                if claim is None:
+                    raise PublishInProgressError(key)
+                try:
+                    # 認領前可能已有其他嘗試創建了容器
+                    container_id = publisher.ledger.reusable_container(publisher.ledger.get(key))
+                    if not container_id:
+                        publisher.ledger.record(key, CREATING, ig_account_id=publisher.ig_account_id,
+                                                media_type=job['media_type'])
+                        container_id = self._create_container(publisher, job)
+                        publisher.ledger.record(key, CREATED, container_id=container_id)
+                finally:
+                    publisher.ledger.release(key, claim)
+            self.queue.update(job_id, STAGED, container_id=container_id, error=None)
+            self._log(f"任務 {job_id} 已創建媒體容器 {container_id}")
+        except Exception as e:
+            self.queue.update(job_id, PENDING, error=str(e))
+            self._log(f"任務 {job_id} 預先創建容器失敗，將在發布時重試: {e}")
+        self._push(job['publish_at'], job_id, 'publish')
+
+    def _published(self, job_id, publisher, job):
+        """任務的內容已在先前發布，記錄其媒體 ID（找不到時記錄原因）"""
+        try:
+            response = publisher.published_media(job['key'], job['caption'])
+        except AlreadyPublishedError as e:
+            self.queue.update(job_id, PUBLISHED, error=str(e))
+        else:
+            self.queue.update(job_id, PUBLISHED, media_id=response['id'], error=None)
+        self._done(job_id)
+
+    @staticmethod
+    def _create_container(publisher, job):
+        options = job['options']
+        if job['media_type'] == 'IMAGE':
+            response = publisher.post_image(job['content'], job['caption'])
+        elif job['media_type'] == 'VIDEO':
+            response = publisher.post_video(job['content'], job['caption'], options.get('cover_url'),
+                                            options.get('upload_type') or 'FEED')
+        elif job['media_type'] == 'CAROUSEL':
+            response = publisher.post_carousel(job['content'], job['caption'])
+        else:
+            raise ValueError(f"不支持的媒體類型: {job['media_type']}")
+        return response['id']
+
+    def _publish(self, job_id):
+        """發布任務；帳本中已有的容器會被直接重用"""
+        job = self._claim(job_id, (PENDING, STAGED, PUBLISHING), PUBLISHING)
+        if job is None:
+            return
+        try:
+            publisher = self._publisher(job)
+            response = publisher.create_and_publish(job['media_type'], job['content'], job['caption'],
+                                                    idempotency_key=job['key'], **job['options'])
+        except AlreadyPublishedError as e:
+            self.queue.update(job_id, PUBLISHED, error=str(e))
+            self._log(f"任務 {job_id}: {e}")
+            self._done(job_id)
+            return
+        except QuotaExceededError as e:
+            self.queue.update(job_id, PENDING, publish_at=int(e.retry_at), error=str(e))
+            self._log(f"任務 {job_id} 配額不足，改期至 {e.retry_at}")
+        except Exception as e:
+            attempts = job['attempts'] + 1
+            if attempts < MAX_ATTEMPTS:
+                self.queue.update(job_id, PENDING, publish_at=int(time.time()) + RETRY_DELAY * attempts,
+                                  attempts=attempts, error=str(e))
+            else:
+                self.queue.update(job_id, FAILED, attempts=attempts, error=str(e))
+            self._log(f"任務 {job_id} 發布失敗: {e}")
+        else:
+            self.queue.update(job_id, PUBLISHED, media_id=response.get('id'), error=None)
+            self._log(f"任務 {job_id} 已發布，媒體 ID: {response.get('id')}")
+            self._done(job_id)
+            return
+        # 改期的任務重新載入
+        self._done(job_id)
+        self._request_load()
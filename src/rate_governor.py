@@ -0,0 +1,211 @@
+import json
+import time
+import threading
+
+from src.metrics import get_default_metrics
+
+# Graph API 的限流錯誤代碼
+# 4: 應用層級, 17: 用戶層級, 32: 頁面層級, 613: 自訂速率限制, 80001-80014: 商業用途案例
+THROTTLE_ERROR_CODES = {4, 17, 32, 613} | set(range(80001, 80015))
+
+APP_USAGE_HEADER = 'x-app-usage'
+BUSINESS_USAGE_HEADER = 'x-business-use-case-usage'
+AD_ACCOUNT_USAGE_HEADER = 'x-ad-account-usage'
+
+# 用量標頭反映最近一小時的滾動窗口；沒有新標頭時舊的用量隨時間線性衰減
+USAGE_WINDOW = 3600
+
+
+def _parse_json_header(headers, name):
+    for key, value in (headers or {}).items():
+        if key.lower() == name:
+            try:
+                return json.loads(value)
+            except (TypeError, ValueError):
+                return None
+    return None
+
+
+def _max_pct(usage, keys):
+    return max((float(usage.get(key) or 0) for key in keys), default=0.0)
+
+
+def _record_wait(seconds):
+    metrics = get_default_metrics()
+    if metrics.enabled:
+        metrics.inc('graph_rate_wait_seconds_total', seconds)
+        metrics.emit({'event': 'rate_wait', 'seconds': round(seconds, 3)})
+
+
+class RateGovernor:
+    """根據 Graph API 用量標頭自適應調整請求速率的令牌桶
+
+    每次調用後解析 X-App-Usage、X-Business-Use-Case-Usage 和
+    X-Ad-Account-Usage 標頭。用量低於 `slowdown_at` 時以 `max_rate` 全速發送，
+    超過後速率隨用量線性下降，到 100% 時降至 `min_rate`。若 API 返回
+    `estimated_time_to_regain_access` 或限流錯誤，則在恢復之前暫停所有請求。
+    一段時間沒有再收到的用量來源（例如不再調用的商業帳戶）按 `usage_window`
+    衰減，過期後移除，不會讓速率一直停留在低速。
+    """
+
+    def __init__(self, max_rate=20.0, burst=10, slowdown_at=50.0, min_rate=0.2,
+                 throttle_cooldown=60, usage_window=USAGE_WINDOW):
+        """初始化速率控制器
+
+        Args:
+            max_rate: 每秒最多發送的請求數
+            burst: 令牌桶容量（允許的突發請求數）
+            slowdown_at: 開始降速的用量百分比
+            min_rate: 用量接近 100% 時的最低速率
+            throttle_cooldown: 收到限流錯誤但沒有恢復時間時暫停的秒數
+            usage_window: 用量標頭的統計窗口秒數，舊的用量在此期間衰減至 0
+        """
+        self.max_rate = max_rate
+        self.burst = burst
+        self.slowdown_at = slowdown_at
+        self.min_rate = min_rate
+        self.throttle_cooldown = throttle_cooldown
+        self.usage_window = usage_window
+
+        self._lock = threading.Lock()
+        self._tokens = float(burst)
+        self._updated = time.monotonic()
+        self._blocked_until = 0.0
+        self._usage = {}
+
+    @property
+    def utilization(self):
+        """目前最高的用量百分比（0-100）"""
+        with self._lock:
+            return self._current_pct()
+
+    @property
+    def rate(self):
+        """目前允許的每秒請求數"""
+        return self._rate_for(self.utilization)
+
+    def snapshot(self):
+        """返回各用量來源的目前狀態"""
+        with self._lock:
+            return {
+                'utilization': self._current_pct(),
+                'blocked_for': max(0.0, self._blocked_until - time.monotonic()),
+                'usage': {key: dict(entry) for key, entry in self._usage.items()},
+            }
+
+    def _current_pct(self):
+        """按時間衰減後的最高用量百分比，並移除過期的來源（調用時需持有鎖）"""
+        now = time.time()
+        pct = 0.0
+        for key, entry in list(self._usage.items()):
+            age = max(0.0, now - entry['updated_at'])
+            if age >= self.usage_window:
+                del self._usage[key]
+                continue
+            pct = max(pct, entry['pct'] * (1 - age / self.usage_window))
+        return pct
+
+    def _rate_for(self, pct):
+        if pct <= self.slowdown_at:
+            return self.max_rate
+        factor = max(0.0, (100.0 - pct) / (100.0 - self.slowdown_at))
+        return max(self.min_rate, self.max_rate * factor)
+
+    def _reserve(self, cost):
+        """嘗試取得令牌；成功返回 0，否則返回需要等待的秒數"""
+        cost = min(cost, self.burst)
+        with self._lock:
+            now = time.monotonic()
+            if now < self._blocked_until:
+                return self._blocked_until - now
+            rate = self._rate_for(self._current_pct())
+            self._tokens = min(self.burst, self._tokens + (now - self._updated) * rate)
+            self._updated = now
+            if self._tokens >= cost:
+                self._tokens -= cost
+                return 0
+            return (cost - self._tokens) / rate
+
+    def acquire(self, cost=1):
+        """在發送請求前調用，必要時阻塞直到允許發送
+
+        Args:
+            cost: 此請求消耗的令牌數（例如批次請求中的操作數）
+        """
+        waited = 0.0
+        while True:
+            delay = self._reserve(cost)
+            if not delay:
+                break
+            time.sleep(delay)
+            waited += delay
+        if waited:
+            _record_wait(waited)
+
+    async def acquire_async(self, cost=1):
+        """acquire() 的 asyncio 版本，等待時不阻塞事件循環"""
+        import asyncio
+
+        waited = 0.0
+        while True:
+            delay = self._reserve(cost)
+            if not delay:
+                break
+            await asyncio.sleep(delay)
+            waited += delay
+        if waited:
+            _record_wait(waited)
+
+    def observe(self, headers, error_code=None):
+        """在收到回應（包括錯誤回應）後調用，更新用量狀態
+
+        Args:
+            headers: HTTP 回應標頭
+            error_code: Graph API 錯誤代碼（如有）
+        """
+        regain_seconds = 0.0
+        updates = {}
+
+        app_usage = _parse_json_header(headers, APP_USAGE_HEADER)
+        if isinstance(app_usage, dict):
+            updates['app'] = _max_pct(app_usage, ('call_count', 'total_cputime', 'total_time'))
+
+        business_usage = _parse_json_header(headers, BUSINESS_USAGE_HEADER)
+        if isinstance(business_usage, dict):
+            for business_id, entries in business_usage.items():
+                for entry in entries or []:
+                    key = f"business:{business_id}:{entry.get('type', '')}"
+                    updates[key] = _max_pct(entry, ('call_count', 'total_cputime', 'total_time'))
+                    minutes = float(entry.get('estimated_time_to_regain_access') or 0)
+                    regain_seconds = max(regain_seconds, minutes * 60)
+
+        ad_account_usage = _parse_json_header(headers, AD_ACCOUNT_USAGE_HEADER)
+        if isinstance(ad_account_usage, dict):
+            pct = float(ad_account_usage.get('acc_id_util_pct') or 0)
+            updates['ad_account'] = pct
+            if pct >= 100:
+                regain_seconds = max(regain_seconds, float(ad_account_usage.get('reset_time_duration') or 0))
+
+        if error_code in THROTTLE_ERROR_CODES and not regain_seconds:
+            regain_seconds = self.throttle_cooldown
+
+        with self._lock:
+            now = time.monotonic()
+            for key, pct in updates.items():
+                self._usage[key] = {'pct': pct, 'updated_at': time.time()}
+            if regain_seconds:
+                self._blocked_until = max(self._blocked_until, now + regain_seconds)
+                self._tokens = 0.0
+
+
+_default_governor = None
+_default_lock = threading.Lock()
+
+
+def get_default_governor():
+    """返回整個進程共用的速率控制器"""
+    global _default_governor
+    with _default_lock:
+        if _default_governor is None:
+            _default_governor = RateGovernor()
+        return _default_governor
@@ -0,0 +1,331 @@
+import os
+import re
+import time
+import random
+import threading
+from urllib.parse import urlparse
+
+from src.rate_governor import THROTTLE_ERROR_CODES
+from src.metrics import get_default_metrics
+
+# 錯誤分類
+TRANSIENT = 'transient'    # 暫時性錯誤，稍後重試通常會成功
+THROTTLED = 'throttled'    # 被限流，請求沒有被執行
+PERMANENT = 'permanent'    # 參數、權限等錯誤，重試沒有意義
+
+# Graph API 的暫時性錯誤代碼
+# 1: 未知錯誤, 2: 服務暫時不可用
+TRANSIENT_ERROR_CODES = {1, 2}
+
+MAX_ATTEMPTS = int(os.getenv('GRAPH_RETRY_ATTEMPTS', '4'))
+
+_NUMERIC_ID = re.compile(r'^\d+$')
+
+
+class CircuitOpenError(Exception):
+    """端點的熔斷器處於開啟狀態，請求未發送"""
+
+    def __init__(self, endpoint, retry_after):
+        super().__init__(f"Graph API 端點 {endpoint} 暫時不可用（連續失敗已熔斷），"
+                         f"{retry_after:.0f} 秒後再試")
+        self.endpoint = endpoint
+        self.retry_after = retry_after
+
+
+def classify(error):
+    """將異常分類為 TRANSIENT、THROTTLED 或 PERMANENT"""
+    from requests.exceptions import ConnectionError, Timeout
+    from facebook_business.exceptions import FacebookRequestError
+
+    if isinstance(error, FacebookRequestError):
+        code = error.api_error_code()
+        if code in THROTTLE_ERROR_CODES:
+            return THROTTLED
+        if error.api_transient_error() or code in TRANSIENT_ERROR_CODES:
+            return TRANSIENT
+        if (error.http_status() or 0) >= 500 and code is None:
+            return TRANSIENT
+        return PERMANENT
+    if isinstance(error, (ConnectionError, Timeout)):
+        return TRANSIENT
+    return PERMANENT
+
+
+def endpoint_key(method, path):
+    """把請求路徑中的 ID 替換為 {id}，作為熔斷器的端點名稱
+
+    例如 POST 17841400000000000/media_publish → POST {id}/media_publish
+    """
+    if isinstance(path, (list, tuple)):
+        parts = [str(part) for part in path]
+    else:
+        path = str(path)
+        if '://' in path:
+            path = urlparse(path).path
+        parts = path.split('?')[0].strip('/').split('/')
+        if parts and re.match(r'^v\d+\.\d+$', parts[0]):
+            parts = parts[1:]
+    parts = ['{id}' if _NUMERIC_ID.match(part) else part for part in parts if part]
+    return f"{method.upper()} {'/'.join(parts) or '/'}"
+
+
+class RetryBudget:
+    """限制重試佔總請求量的比例，避免故障時重試放大流量
+
+    每個成功的請求存入 `ratio` 個令牌，每次重試消耗一個；另外每秒
+    補充 `min_per_second` 個，使低流量時也能重試。
+    """
+
+    def __init__(self, ratio=0.2, min_per_second=1.0, max_tokens=20):
+        self.ratio = ratio
+        self.min_per_second = min_per_second
+        self.max_tokens = max_tokens
+        self._tokens = float(max_tokens)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, now):
+        self._tokens = min(self.max_tokens, self._tokens + (now - self._updated) * self.min_per_second)
+        self._updated = now
+
+    def deposit(self):
+        with self._lock:
+            self._refill(time.monotonic())
+            self._tokens = min(self.max_tokens, self._tokens + self.ratio)
+
+    def withdraw(self):
+        """嘗試取得一次重試的額度"""
+        with self._lock:
+            self._refill(time.monotonic())
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return True
+            return False
+
+
+class CircuitBreaker:
+    """單一端點的熔斷器
+
+    連續 `failure_threshold` 次暫時性失敗後開啟，在 `reset_timeout` 秒內
+    直接拒絕請求；之後進入半開狀態，只放行一個試探請求，成功則關閉，
+    失敗則再次開啟。
+    """
+
+    def __init__(self, endpoint, failure_threshold=5, reset_timeout=30.0):
+        self.endpoint = endpoint
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._failures = 0
+        self._opened_at = None
+        self._probing = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        with self._lock:
+            if self._opened_at is None:
+                return 'closed'
+            if time.monotonic() - self._opened_at < self.reset_timeout:
+                return 'open'
+            return 'half-open'
+
+    def before_call(self):
+        """發送請求前調用；熔斷中時拋出 CircuitOpenError"""
+        with self._lock:
+            if self._opened_at is None:
+                return
+            elapsed = time.monotonic() - self._opened_at
+            if elapsed < self.reset_timeout:
+                raise CircuitOpenError(self.endpoint, self.reset_timeout - elapsed)
+            if self._probing:
+                raise CircuitOpenError(self.endpoint, 1)
+            self._probing = True
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+            self._probing = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self._probing or self._failures >= self.failure_threshold:
+                self._opened_at = time.monotonic()
+            self._probing = False
+
+    def abort_probe(self):
+        """試探請求被中斷（取消或 KeyboardInterrupt）時調用，不計為失敗，允許下一個試探"""
+        with self._lock:
+            self._probing = False
+
+
+class Resilience:
+    """Graph API 調用的分類重試、退避、重試預算和按端點熔斷
+
+    重試規則:
+        - 暫時性錯誤（代碼 1/2、is_transient、5xx、連線錯誤）在請求可以安全
+          重複時以指數退避加抖動重試
+        - 限流錯誤（代碼 4/17/32/613/800xx）表示請求未被執行，任何請求都可
+          重試；等待時間由速率控制器決定
+        - 其他錯誤立即拋出
+    """
+
+    def __init__(self, max_attempts=MAX_ATTEMPTS, base_delay=0.5, max_delay=30.0,
+                 budget=None, failure_threshold=5, reset_timeout=30.0, sleep=time.sleep):
+        """初始化
+
+        Args:
+            max_attempts: 每個請求的最多嘗試次數（包括第一次）
+            base_delay: 第一次重試前的基本等待秒數
+            max_delay: 單次等待的上限秒數
+            budget: RetryBudget，默認新建一個
+            failure_threshold: 熔斷器開啟前的連續失敗次數
+            reset_timeout: 熔斷器開啟後拒絕請求的秒數
+            sleep: 等待函數（測試時可替換）
+        """
+        self.max_attempts = max(1, max_attempts)
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.budget = budget or RetryBudget()
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._sleep = sleep
+        self._breakers = {}
+        self._lock = threading.Lock()
+
+    def breaker(self, endpoint):
+        with self._lock:
+            breaker = self._breakers.get(endpoint)
+            if breaker is None:
+                breaker = CircuitBreaker(endpoint, self.failure_threshold, self.reset_timeout)
+                self._breakers[endpoint] = breaker
+            return breaker
+
+    def breakers(self):
+        """返回 {端點: 狀態}"""
+        with self._lock:
+            breakers = list(self._breakers.values())
+        return {breaker.endpoint: breaker.state for breaker in breakers}
+
+    def backoff(self, attempt):
+        """第 attempt 次失敗後的等待秒數（指數退避，完全抖動）"""
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** (attempt - 1)))
+
+    def _before_call(self, endpoint, breaker, metrics):
+        try:
+            breaker.before_call()
+        except CircuitOpenError:
+            if metrics.enabled:
+                metrics.record_circuit_open(endpoint)
+            raise
+
+    def _after_error(self, endpoint, breaker, metrics, error, attempt, duration, idempotent):
+        """記錄一次失敗的嘗試，返回重試前的等待秒數；不應重試時返回 None"""
+        kind = classify(error)
+        if metrics.enabled:
+            metrics.record_call(endpoint, duration, error, kind, attempt)
+        if kind == TRANSIENT:
+            breaker.record_failure()
+        else:
+            # 限流或參數錯誤說明端點本身可用
+            breaker.record_success()
+
+        retryable = kind == THROTTLED or (kind == TRANSIENT and idempotent)
+        if not retryable or attempt >= self.max_attempts or not self.budget.withdraw():
+            return None
+        delay = self.backoff(attempt)
+        if metrics.enabled:
+            metrics.record_retry(endpoint, kind, attempt, delay)
+        return delay
+
+    def _after_success(self, endpoint, breaker, metrics, attempt, duration):
+        if metrics.enabled:
+            metrics.record_call(endpoint, duration, attempt=attempt)
+        breaker.record_success()
+        self.budget.deposit()
+
+    def call(self, endpoint, func, idempotent=True):
+        """執行 func()，按錯誤分類重試
+
+        Args:
+            endpoint: 端點名稱（見 endpoint_key）
+            func: 發送請求的函數
+            idempotent: 請求是否可以安全重複；否則只在限流時重試
+        """
+        metrics = get_default_metrics()
+        breaker = self.breaker(endpoint)
+        attempt = 0
+        while True:
+            attempt += 1
+            self._before_call(endpoint, breaker, metrics)
+            started = time.perf_counter()
+            try:
+                result = func()
+            except Exception as e:
+                delay = self._after_error(endpoint, breaker, metrics, e, attempt,
+                                          time.perf_counter() - started, idempotent)
+                if delay is None:
+                    raise
+                self._sleep(delay)
+                continue
+            except BaseException:
+                breaker.abort_probe()
+                raise
+            self._after_success(endpoint, breaker, metrics, attempt, time.perf_counter() - started)
+            return result
+
+    async def call_async(self, endpoint, func, idempotent=True):
+        """call() 的 asyncio 版本：func() 返回協程，退避期間以 asyncio.sleep 等待
+
+        重試規則、重試預算和熔斷器與同步請求共用。
+        """
+        import asyncio
+
+        metrics = get_default_metrics()
+        breaker = self.breaker(endpoint)
+        attempt = 0
+        while True:
+            attempt += 1
+            self._before_call(endpoint, breaker, metrics)
+            started = time.perf_counter()
+            try:
+                result = await func()
+            except Exception as e:
+                delay = self._after_error(endpoint, breaker, metrics, e, attempt,
+                                          time.perf_counter() - started, idempotent)
+                if delay is None:
+                    raise
+                await asyncio.sleep(delay)
+                continue
+            except BaseException:
+                # 例如 asyncio.CancelledError；否則半開的熔斷器會一直等待不存在的試探結果
+                breaker.abort_probe()
+                raise
+            self._after_success(endpoint, breaker, metrics, attempt, time.perf_counter() - started)
+            return result
+
+
+def is_idempotent(method, path):
+    """請求重複發送是否安全
+
+    GET/DELETE 以及創建媒體容器（重複時只會多出一個 24 小時後過期的
+    未發布容器）可以重試；發布等其他 POST 重複可能導致重複發文。
+    """
+    method = method.upper()
+    if method in ('GET', 'DELETE'):
+        return True
+    return method == 'POST' and endpoint_key(method, path) == 'POST {id}/media'
+
+
+_default_resilience = None
+_default_lock = threading.Lock()
+
+
+def get_default_resilience():
+    """返回整個進程共用的重試與熔斷設定"""
+    global _default_resilience
+    with _default_lock:
+        if _default_resilience is None:
+            _default_resilience = Resilience()
+        return _default_resilience
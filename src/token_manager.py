@@ -1,25 +1,34 @@
 import os
 import json
 import time
-import requests
+import threading
 from datetime import datetime
 from pathlib import Path
-from facebook_business.api import FacebookAdsApi
-from facebook_business.adobjects.user import User
+
+from src.rate_governor import get_default_governor
+from src.graph_batch import GRAPH_URL, GRAPH_API_VERSION
+from src.token_store import open_token_store
+from src.metrics import traced
 
 class TokenManager:
     """管理 Meta API 訪問令牌的類"""
     
-    def __init__(self, app_id=None, app_secret=None, token_file=None):
+    def __init__(self, app_id=None, app_secret=None, token_file=None, governor=None, session=None,
+                 store=None):
         """初始化令牌管理器
         
         Args:
             app_id: Facebook 應用 ID
             app_secret: Facebook 應用密鑰
-            token_file: 存儲令牌的文件路徑
+            token_file: 存儲令牌的文件路徑（.db/.sqlite 使用 SQLite 後端）
+            governor: 速率控制器，默認使用進程共用的實例
+            session: HTTP 會話，默認使用共用連線池
+            store: 令牌存儲後端，提供時忽略 token_file
         """
         self.app_id = app_id or os.getenv('APP_ID')
         self.app_secret = app_secret or os.getenv('APP_SECRET')
+        self.governor = governor or get_default_governor()
+        self._session = session
         
         if not self.app_id or not self.app_secret:
             raise ValueError("缺少 APP_ID 或 APP_SECRET，請檢查環境變量")
@@ -27,34 +36,59 @@ class TokenManager:
         # 設置令牌存儲文件
         if token_file:
             self.token_file = token_file
+        elif os.getenv('TOKEN_FILE'):
+            self.token_file = os.getenv('TOKEN_FILE')
         else:
             base_dir = Path(__file__).parent.parent
             self.token_file = os.path.join(base_dir, 'config', 'tokens.json')
         
-        # 加載現有令牌
-        self.tokens = self._load_tokens()
+        # 令牌存儲後端（跨進程安全，讀取有記憶體快取）
+        self.store = store or open_token_store(self.token_file)
+        self._page_sweep_lock = threading.Lock()
+        self.refresher = None
     
-    def _load_tokens(self):
-        """從文件加載令牌"""
-        if os.path.exists(self.token_file):
-            try:
-                with open(self.token_file, 'r') as f:
-                    return json.load(f)
-            except json.JSONDecodeError:
-                return {}
-        return {}
+    @property
+    def session(self):
+        """HTTP 會話（第一次使用時才建立共用連線池）"""
+        if self._session is None:
+            from src.http_session import get_session
+            self._session = get_session()
+        return self._session
     
-    def _save_tokens(self):
-        """保存令牌到文件"""
-        # 確保目錄存在
-        os.makedirs(os.path.dirname(self.token_file), exist_ok=True)
-        
-        with open(self.token_file, 'w') as f:
-            json.dump(self.tokens, f, indent=2)
+    @property
+    def tokens(self):
+        """所有存儲的令牌（從存儲後端的快取讀取）"""
+        return self.store.all()
+    
+    def _graph_get(self, url, params):
+        """發送 GET 請求並將用量標頭回報給速率控制器
+
+        暫時性錯誤和限流錯誤會按重試設定重試；最終仍失敗時返回錯誤回應，
+        由調用者處理。
+        """
+        from facebook_business.exceptions import FacebookRequestError
+        from src.resilience import get_default_resilience, endpoint_key
+
+        def attempt():
+            self.governor.acquire()
+            response = self.session.get(url, params=params)
+            data = response.json()
+            error_code = data.get('error', {}).get('code') if isinstance(data, dict) else None
+            self.governor.observe(response.headers, error_code=error_code)
+            if error_code is not None:
+                raise FacebookRequestError("Graph API 請求失敗", {'method': 'GET', 'path': url},
+                                           response.status_code, response.headers, json.dumps(data))
+            return data
+
+        try:
+            return get_default_resilience().call(endpoint_key('GET', url), attempt)
+        except FacebookRequestError as e:
+            return e.body()
     
+    @traced('token.refresh.user')
     def extend_user_token(self, short_lived_token):
         """將短期用戶令牌轉換為長期令牌"""
-        url = "https://graph.facebook.com/v22.0/oauth/access_token"
+        url = f"{GRAPH_URL}/{GRAPH_API_VERSION}/oauth/access_token"
         params = {
             'grant_type': 'fb_exchange_token',
             'client_id': self.app_id,
@@ -62,68 +96,105 @@ class TokenManager:
             'fb_exchange_token': short_lived_token
         }
         
-        response = requests.get(url, params=params)
-        data = response.json()
+        data = self._graph_get(url, params)
         
         if 'access_token' in data:
             # 存儲新獲取的長期令牌
-            self.tokens['user_token'] = {
+            self.store.set('user_token', {
                 'token': data['access_token'],
                 'created_at': int(time.time()),
                 'expires_in': data.get('expires_in', 5184000)  # 默認60天
-            }
-            self._save_tokens()
+            })
             return data['access_token']
         else:
             raise Exception(f"無法延長令牌: {data.get('error', {}).get('message')}")
     
-    def get_page_token(self, user_token, page_id):
-        """使用用戶令牌獲取頁面令牌"""
-        # 初始化 API
-        FacebookAdsApi.init(self.app_id, self.app_secret, user_token)
+    @traced('token.refresh.page')
+    def refresh_page_tokens(self, user_token=None):
+        """以一次分頁掃描獲取所有管理頁面的令牌及其關聯的 Instagram 商業帳戶
         
-        me = User(fbid='me')
-        pages = me.get_accounts(fields=['access_token', 'name', 'id'])
+        所有頁面會在同一次寫入中存入令牌存儲，之後任何頁面的查詢都直接讀取存儲。
+        me/accounts 不再返回的頁面（已失去管理權限或已刪除）會從存儲中移除；
+        返回空列表時不作任何修改，以免暫時的權限問題清空所有頁面令牌。
         
+        Args:
+            user_token: 用戶令牌，省略時使用 get_valid_user_token()
+            
+        Returns:
+            {頁面 ID: 令牌信息} 字典
+        """
+        from facebook_business.adobjects.user import User
+        from src.graph_api import GraphApi
+        
+        user_token = user_token or self.get_valid_user_token()
+        
+        # 使用獨立的 API 實例，避免覆蓋全局默認 API
+        api = GraphApi.create(self.app_id, self.app_secret, user_token, governor=self.governor)
+        
+        me = User(fbid='me', api=api)
+        # 欄位展開語法不在 SDK 的欄位列表中，經由 params 傳遞以免觸發警告
+        pages = me.get_accounts(
+            params={'fields': 'access_token,name,id,instagram_business_account{id,username}', 'limit': 100}
+        )
+        
+        now = int(time.time())
+        entries = {}
         for page in pages:
-            if page['id'] == page_id:
-                # 存儲新獲取的頁面令牌
-                self.tokens[f'page_{page_id}'] = {
-                    'token': page['access_token'],
-                    'name': page['name'],
-                    'created_at': int(time.time())
-                }
-                self._save_tokens()
-                return page['access_token']
+            info = {
+                'token': page['access_token'],
+                'name': page['name'],
+                'created_at': now
+            }
+            ig_account = page.get('instagram_business_account')
+            if ig_account:
+                info['instagram_business_account_id'] = ig_account['id']
+                if ig_account.get('username'):
+                    info['instagram_username'] = ig_account['username']
+            entries[f"page_{page['id']}"] = info
+        
+        if entries:
+            # 一次寫入同時更新令牌並移除不再返回的頁面
+            self.store.replace_prefix('page_', entries)
+        return {key[len('page_'):]: info for key, info in entries.items()}
+    
+    def get_page_token(self, user_token, page_id):
+        """使用用戶令牌獲取頁面令牌（同時刷新所有頁面的令牌）"""
+        pages = self.refresh_page_tokens(user_token)
+        if page_id in pages:
+            return pages[page_id]['token']
         
         raise Exception(f"找不到ID為 {page_id} 的頁面")
     
+    def get_page_info(self, page_id):
+        """返回存儲中的頁面令牌信息（包括關聯的 Instagram 帳戶 ID），沒有時返回 None"""
+        return self.store.get(f'page_{page_id}')
+    
+    @traced('token.refresh.app')
     def get_app_token(self):
         """獲取應用訪問令牌"""
-        url = "https://graph.facebook.com/oauth/access_token"
+        url = f"{GRAPH_URL}/oauth/access_token"
         params = {
             'client_id': self.app_id,
             'client_secret': self.app_secret,
             'grant_type': 'client_credentials'
         }
         
-        response = requests.get(url, params=params)
-        data = response.json()
+        data = self._graph_get(url, params)
         
         if 'access_token' in data:
             # 存儲新獲取的應用令牌
-            self.tokens['app_token'] = {
+            self.store.set('app_token', {
                 'token': data['access_token'],
                 'created_at': int(time.time())
-            }
-            self._save_tokens()
+            })
             return data['access_token']
         else:
             raise Exception(f"無法獲取應用令牌: {data.get('error', {}).get('message')}")
     
+    @traced('token.get.user')
     def get_valid_user_token(self, refresh=False):
         """獲取有效的用戶令牌，必要時刷新"""
-        user_token_info = self.tokens.get('user_token', {})
+        user_token_info = self.store.get('user_token', {})
         
         # 如果沒有用戶令牌或需要刷新，則從環境變量獲取並延長
         if not user_token_info or refresh:
@@ -133,44 +204,87 @@ class TokenManager:
             
             return self.extend_user_token(env_token)
         
-        # 檢查令牌是否過期
-        if 'created_at' in user_token_info and 'expires_in' in user_token_info:
-            created = user_token_info['created_at']
-            expires_in = user_token_info['expires_in']
-            now = int(time.time())
+        # 檢查令牌是否過期（優先使用 debug_token 驗證得到的過期時間）
+        expires_at = self.token_expires_at(user_token_info)
+        now = int(time.time())
+        
+        # 如果令牌已失效、已過期或將在1天內過期，則刷新
+        if user_token_info.get('is_valid') is False or (expires_at and expires_at - now < 86400):  # 1天 = 86400秒
+            env_token = os.getenv('ACCESS_TOKEN')
+            if not env_token:
+                raise ValueError("缺少 ACCESS_TOKEN 環境變量，無法刷新令牌")
             
-            # 如果令牌已過期或將在1天內過期，則刷新
-            if (created + expires_in - now) < 86400:  # 1天 = 86400秒
-                env_token = os.getenv('ACCESS_TOKEN')
-                if not env_token:
-                    raise ValueError("缺少 ACCESS_TOKEN 環境變量，無法刷新令牌")
-                
-                return self.extend_user_token(env_token)
+            return self.extend_user_token(env_token)
         
         return user_token_info['token']
     
+    def renew_user_token(self):
+        """提前延長用戶令牌：優先以存儲中的長期令牌交換，失敗時使用 ACCESS_TOKEN 環境變量"""
+        user_token_info = self.store.get('user_token', {})
+        if user_token_info.get('token') and user_token_info.get('is_valid') is not False:
+            try:
+                return self.extend_user_token(user_token_info['token'])
+            except Exception:
+                pass
+        return self.get_valid_user_token(refresh=True)
+    
+    @staticmethod
+    def token_expires_at(info):
+        """返回令牌的過期時間戳，永不過期或未知時返回 0"""
+        if info.get('expires_at'):
+            return info['expires_at']
+        if 'created_at' in info and 'expires_in' in info:
+            return info['created_at'] + info['expires_in']
+        return 0
+    
+    @traced('token.get.page')
     def get_valid_page_token(self, page_id, refresh=False):
         """獲取有效的頁面令牌"""
         page_token_key = f'page_{page_id}'
-        page_token_info = self.tokens.get(page_token_key, {})
+        page_token_info = self.store.get(page_token_key, {})
+        
+        # 沒有頁面令牌、令牌已失效（背景驗證發現）或已過期時，通過用戶令牌重新獲取
+        if not refresh and self._page_token_usable(page_token_info):
+            return page_token_info['token']
         
-        # 如果沒有頁面令牌或需要刷新，則通過用戶令牌獲取
-        if not page_token_info or refresh:
+        with self._page_sweep_lock:
+            # 等待鎖期間其他執行緒可能已完成掃描，令牌已更新時不再重複掃描
+            current = self.store.get(page_token_key, {})
+            if self._page_token_usable(current) and \
+                    (not refresh or current['token'] != page_token_info.get('token')):
+                return current['token']
             user_token = self.get_valid_user_token()
             return self.get_page_token(user_token, page_id)
-        
-        return page_token_info['token']
+    
+    def _page_token_usable(self, info):
+        """頁面令牌存在、未被標記為失效且未過期"""
+        if not info or info.get('is_valid') is False:
+            return False
+        expires_at = self.token_expires_at(info)
+        return not (expires_at and expires_at <= time.time())
     
     def get_valid_app_token(self, refresh=False):
         """獲取有效的應用令牌"""
-        app_token_info = self.tokens.get('app_token', {})
+        app_token_info = self.store.get('app_token', {})
         
-        # 如果沒有應用令牌或需要刷新，則獲取新的
-        if not app_token_info or refresh:
+        # 如果沒有應用令牌、已失效或需要刷新，則獲取新的
+        if not app_token_info or app_token_info.get('is_valid') is False or refresh:
             return self.get_app_token()
         
         return app_token_info['token']
     
+    def start_background_refresh(self, **kwargs):
+        """啟動背景令牌刷新器，參數傳遞給 TokenRefresher
+        
+        Returns:
+            已啟動的 TokenRefresher
+        """
+        from src.token_refresher import TokenRefresher
+        
+        if self.refresher is None:
+            self.refresher = TokenRefresher(self, **kwargs)
+        return self.refresher.start()
+    
     def print_token_info(self):
         """打印所有存儲的令牌信息"""
         print("\n===== 存儲的令牌信息 =====")
@@ -185,11 +299,9 @@ class TokenManager:
                 created_time = datetime.fromtimestamp(info['created_at']).strftime('%Y-%m-%d %H:%M:%S')
                 print(f"  創建時間: {created_time}")
             
-            if 'expires_in' in info:
-                expires_in = info['expires_in']
-                created_at = info['created_at']
+            if self.token_expires_at(info):
                 now = int(time.time())
-                remaining = created_at + expires_in - now
+                remaining = self.token_expires_at(info) - now
                 
                 if remaining > 0:
                     days = remaining // 86400
@@ -200,5 +312,14 @@ class TokenManager:
             
             if 'name' in info:
                 print(f"  名稱: {info['name']}")
+            
+            if 'validated_at' in info:
+                validated_time = datetime.fromtimestamp(info['validated_at']).strftime('%Y-%m-%d %H:%M:%S')
+                print(f"  驗證結果: {'有效' if info.get('is_valid') else '無效'}（{validated_time}）")
+            
+            if 'instagram_business_account_id' in info:
+                ig_username = info.get('instagram_username')
+                ig_display = f" (@{ig_username})" if ig_username else ""
+                print(f"  Instagram 帳戶: {info['instagram_business_account_id']}{ig_display}")
         
         print("\n==============================")
\ No newline at end of file
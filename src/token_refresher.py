@@ -0,0 +1,147 @@
+import time
+import random
+import threading
+
+from src.graph_batch import GraphBatch
+from src.metrics import traced
+
+
+class TokenRefresher:
+    """在背景提前刷新令牌，讓發布流程總是直接從存儲取得有效令牌
+
+    每一輪會以批次請求調用 `debug_token` 驗證存儲中的所有令牌，把
+    `is_valid`、`expires_at` 和 `validated_at` 寫回存儲，然後：
+        - 用戶令牌無效或將在 `refresh_ahead` 秒內過期時重新延長
+        - 任何頁面令牌無效或即將過期時重新掃描所有頁面令牌
+        - 應用令牌無效時重新獲取
+    刷新時間加入隨機抖動，避免多個進程同時刷新。
+    """
+
+    def __init__(self, token_manager, interval=3600, refresh_ahead=3 * 86400, jitter=0.2):
+        """初始化背景刷新器
+
+        Args:
+            token_manager: TokenManager 實例
+            interval: 兩次驗證之間的最長秒數
+            refresh_ahead: 在過期前多少秒刷新令牌
+            jitter: 刷新提前量與等待間隔的隨機抖動比例
+        """
+        self.token_manager = token_manager
+        self.interval = interval
+        self.refresh_ahead = refresh_ahead
+        self.jitter = jitter
+        self._stop = threading.Event()
+        self._thread = None
+        self.last_error = None
+
+    def start(self):
+        """啟動背景執行緒（已啟動時不做任何事）"""
+        if self._thread is None or not self._thread.is_alive():
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name='token-refresher', daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self, timeout=None):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                delay = self.run_once()
+                self.last_error = None
+            except Exception as e:
+                self.last_error = e
+                delay = min(self.interval, 300)
+            self._stop.wait(delay * (1 + random.uniform(-self.jitter, self.jitter)))
+
+    def _jittered_ahead(self):
+        return self.refresh_ahead * (1 + random.uniform(0, self.jitter))
+
+    @traced('token.validate')
+    def validate(self):
+        """以批次的 debug_token 請求驗證所有存儲的令牌，並把結果寫回存儲
+
+        Returns:
+            {存儲鍵: debug_token 結果} 字典
+        """
+        manager = self.token_manager
+        tokens = {key: info for key, info in manager.tokens.items() if info.get('token')}
+        if not tokens:
+            return {}
+
+        batch = GraphBatch(manager.get_valid_app_token(), governor=manager.governor,
+                           session=manager.session)
+        names = {key: batch.add('GET', 'debug_token', {'input_token': info['token']})
+                 for key, info in tokens.items()}
+        batch.execute()
+
+        now = int(time.time())
+        results = {}
+        updates = {}
+        for key, name in names.items():
+            response = batch.result(name)
+            if not response.ok:
+                continue
+            data = response.get('data') or {}
+            results[key] = data
+
+            current = manager.store.get(key) or {}
+            # 令牌可能在驗證期間已被其他進程替換
+            if current.get('token') != tokens[key]['token']:
+                continue
+            updates[key] = {
+                **current,
+                'is_valid': bool(data.get('is_valid')),
+                'expires_at': data.get('expires_at') or 0,
+                'validated_at': now,
+            }
+
+        if updates:
+            manager.store.update(updates)
+        return results
+
+    def run_once(self):
+        """驗證並刷新需要刷新的令牌
+
+        Returns:
+            距離下一次需要檢查的秒數
+        """
+        manager = self.token_manager
+        self.validate()
+
+        now = int(time.time())
+        next_check = self.interval
+
+        def needs_refresh(info):
+            if info.get('is_valid') is False:
+                return True
+            expires_at = manager.token_expires_at(info)
+            return bool(expires_at) and expires_at - now <= self._jittered_ahead()
+
+        def seconds_until_refresh(info):
+            expires_at = manager.token_expires_at(info)
+            if not expires_at:
+                return self.interval
+            return max(0, expires_at - now - self.refresh_ahead)
+
+        user_info = manager.store.get('user_token')
+        if user_info and needs_refresh(user_info):
+            manager.renew_user_token()
+        elif user_info:
+            next_check = min(next_check, seconds_until_refresh(user_info))
+
+        pages = [info for key, info in manager.tokens.items() if key.startswith('page_')]
+        if any(needs_refresh(info) for info in pages):
+            manager.refresh_page_tokens()
+            pages = [info for key, info in manager.tokens.items() if key.startswith('page_')]
+        for info in pages:
+            next_check = min(next_check, seconds_until_refresh(info))
+
+        app_info = manager.store.get('app_token')
+        if app_info and app_info.get('is_valid') is False:
+            manager.get_valid_app_token(refresh=True)
+
+        return max(next_check, 60)
@@ -0,0 +1,142 @@
+import os
+import abc
+import json
+import time
+import threading
+
+from src.json_store import JsonFileStore
+from src.metrics import get_default_metrics, traced
+
+
+class TokenStore(abc.ABC):
+    """令牌存儲後端的基類
+
+    所有寫入都是以鍵為單位的增量更新，不會覆蓋其他進程寫入的鍵。
+    """
+
+    def get(self, key, default=None):
+        return self.all().get(key, default)
+
+    @abc.abstractmethod
+    def all(self):
+        """返回所有令牌（字典副本）"""
+
+    def set(self, key, info):
+        self.update({key: info})
+
+    @abc.abstractmethod
+    def update(self, tokens):
+        """寫入或替換多個鍵"""
+
+    @abc.abstractmethod
+    def replace_prefix(self, prefix, tokens):
+        """在同一次寫入中以 tokens 取代所有以 prefix 開頭的鍵（其他鍵不變）"""
+
+    @abc.abstractmethod
+    def delete(self, key):
+        """刪除一個鍵"""
+
+    @abc.abstractmethod
+    def clear(self):
+        """刪除所有鍵"""
+
+
+class JsonFileTokenStore(JsonFileStore, TokenStore):
+    """以 JSON 文件存儲令牌（見 JsonFileStore）"""
+
+    load_span = 'token.store.load'
+
+
+class SqliteTokenStore(TokenStore):
+    """以 SQLite 存儲令牌，每個鍵一行，寫入只更新對應的行
+
+    使用 WAL 模式允許多個進程同時讀取；通過 `PRAGMA data_version`
+    偵測其他連線的提交，只在資料改變時才重新載入記憶體快取。
+    """
+
+    def __init__(self, path):
+        import sqlite3
+
+        self.path = path
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False, isolation_level=None)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute(
+            'CREATE TABLE IF NOT EXISTS tokens ('
+            ' key TEXT PRIMARY KEY, value TEXT NOT NULL, updated_at INTEGER NOT NULL)'
+        )
+        self._cache = {}
+        self._version = None
+
+    def _refresh(self):
+        with self._lock:
+            version = self._conn.execute('PRAGMA data_version').fetchone()[0]
+            if version != self._version:
+                with get_default_metrics().span('token.store.load'):
+                    rows = self._conn.execute('SELECT key, value FROM tokens').fetchall()
+                    self._cache = {key: json.loads(value) for key, value in rows}
+                self._version = version
+            return self._cache
+
+    def all(self):
+        return dict(self._refresh())
+
+    def get(self, key, default=None):
+        return self._refresh().get(key, default)
+
+    def update(self, tokens):
+        now = int(time.time())
+        with self._lock:
+            self._conn.execute('BEGIN IMMEDIATE')
+            try:
+                self._conn.executemany(
+                    'INSERT INTO tokens (key, value, updated_at) VALUES (?, ?, ?)'
+                    ' ON CONFLICT(key) DO UPDATE SET value = excluded.value, updated_at = excluded.updated_at',
+                    [(key, json.dumps(info), now) for key, info in tokens.items()]
+                )
+                self._conn.execute('COMMIT')
+            except BaseException:
+                self._conn.execute('ROLLBACK')
+                raise
+            self._cache.update(tokens)
+
+    def replace_prefix(self, prefix, tokens):
+        now = int(time.time())
+        with self._lock:
+            self._conn.execute('BEGIN IMMEDIATE')
+            try:
+                stale = [key for (key,) in self._conn.execute(
+                    'SELECT key FROM tokens WHERE substr(key, 1, ?) = ?', (len(prefix), prefix)
+                ) if key not in tokens]
+                self._conn.executemany('DELETE FROM tokens WHERE key = ?', [(key,) for key in stale])
+                self._conn.executemany(
+                    'INSERT INTO tokens (key, value, updated_at) VALUES (?, ?, ?)'
+                    ' ON CONFLICT(key) DO UPDATE SET value = excluded.value, updated_at = excluded.updated_at',
+                    [(key, json.dumps(info), now) for key, info in tokens.items()]
+                )
+                self._conn.execute('COMMIT')
+            except BaseException:
+                self._conn.execute('ROLLBACK')
+                raise
+            for key in stale:
+                self._cache.pop(key, None)
+            self._cache.update(tokens)
+
+    def delete(self, key):
+        with self._lock:
+            self._conn.execute('DELETE FROM tokens WHERE key = ?', (key,))
+            self._cache.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute('DELETE FROM tokens')
+            self._cache = {}
+
+
+@traced('token.store.open')
+def open_token_store(path):
+    """根據文件擴展名選擇存儲後端（.db/.sqlite 使用 SQLite，其他使用 JSON）"""
+    if path.endswith(('.db', '.sqlite', '.sqlite3')):
+        return SqliteTokenStore(path)
+    return JsonFileTokenStore(path)
@@ -0,0 +1,89 @@
+import os
+import sys
+import asyncio
+import unittest
+
+from requests.exceptions import ConnectionError
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src.resilience import Resilience, CircuitBreaker, CircuitOpenError
+
+
+def fail():
+    raise ConnectionError("connection reset")
+
+
+class CircuitBreakerTest(unittest.TestCase):
+    """熔斷器 closed → open → half-open → 試探（成功／失敗／中斷）的狀態轉換"""
+
+    def resilience(self, reset_timeout=0.0):
+        return Resilience(max_attempts=1, failure_threshold=1, reset_timeout=reset_timeout,
+                          sleep=lambda delay: None)
+
+    def test_opens_after_threshold(self):
+        resilience = self.resilience(reset_timeout=60)
+        with self.assertRaises(ConnectionError):
+            resilience.call('GET x', fail)
+        self.assertEqual(resilience.breakers()['GET x'], 'open')
+        with self.assertRaises(CircuitOpenError):
+            resilience.call('GET x', lambda: 'ok')
+
+    def test_probe_success_closes(self):
+        resilience = self.resilience()
+        with self.assertRaises(ConnectionError):
+            resilience.call('GET x', fail)
+        self.assertEqual(resilience.breakers()['GET x'], 'half-open')
+        self.assertEqual(resilience.call('GET x', lambda: 'ok'), 'ok')
+        self.assertEqual(resilience.breakers()['GET x'], 'closed')
+
+    def test_probe_failure_reopens(self):
+        breaker = CircuitBreaker('GET x', failure_threshold=1, reset_timeout=60)
+        breaker.record_failure()
+        breaker._opened_at -= 60
+        self.assertEqual(breaker.state, 'half-open')
+        breaker.before_call()
+        breaker.record_failure()
+        self.assertEqual(breaker.state, 'open')
+        with self.assertRaises(CircuitOpenError):
+            breaker.before_call()
+
+    def test_only_one_probe_at_a_time(self):
+        breaker = CircuitBreaker('GET x', failure_threshold=1, reset_timeout=0)
+        breaker.record_failure()
+        breaker.before_call()
+        with self.assertRaises(CircuitOpenError):
+            breaker.before_call()
+
+    def test_interrupted_probe_is_not_a_failure(self):
+        resilience = self.resilience()
+        with self.assertRaises(ConnectionError):
+            resilience.call('GET x', fail)
+
+        def interrupt():
+            raise KeyboardInterrupt
+
+        with self.assertRaises(KeyboardInterrupt):
+            resilience.call('GET x', interrupt)
+        self.assertEqual(resilience.call('GET x', lambda: 'ok'), 'ok')
+        self.assertEqual(resilience.breakers()['GET x'], 'closed')
+
+    def test_cancelled_async_probe_releases_breaker(self):
+        resilience = self.resilience()
+        with self.assertRaises(ConnectionError):
+            resilience.call('GET x', fail)
+
+        async def cancel_probe():
+            task = asyncio.ensure_future(resilience.call_async('GET x', lambda: asyncio.sleep(10)))
+            await asyncio.sleep(0)
+            task.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await task
+
+        asyncio.run(cancel_probe())
+        self.assertEqual(resilience.call('GET x', lambda: 'ok'), 'ok')
+        self.assertEqual(resilience.breakers()['GET x'], 'closed')
+
+
+if __name__ == '__main__':
+    unittest.main()